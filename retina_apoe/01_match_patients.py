@@ -6,6 +6,8 @@ Gera matched_patients.csv com dados unificados para análise.
 Uso:
     python 01_match_patients.py              # Preview: mostra matches e stats
     python 01_match_patients.py --execute    # Gera matched_patients.csv
+    python 01_match_patients.py --execute --fetch-missing
+        # Imagens removidas pelo cache local (image_cache.py) são baixadas de volta do CDN
 """
 
 import sys
@@ -15,13 +17,21 @@ import csv
 import json
 import os
 import re
-import unicodedata
 from pathlib import Path
 from difflib import SequenceMatcher
 
 SCRIPT_DIR = Path(__file__).parent
 CSV_PATH = SCRIPT_DIR / 'laudados_2026-02-26.csv'
 DOWNLOADS_DIR = SCRIPT_DIR.parent / 'downloads'
+ETL_DIR = SCRIPT_DIR.parent / 'scripts' / 'eyercloud_downloader'
+PROFILE_DIR = SCRIPT_DIR / 'profiles'
+
+sys.path.insert(0, str(ETL_DIR))
+from text_normalize import normalize_name
+import profiling
+
+# Local image cache (set in main() with --fetch-missing)
+IMAGE_CACHE = None
 
 # Manual exclusions: fuzzy matches that are clearly wrong people
 FALSE_MATCHES = {
@@ -36,17 +46,6 @@ FALSE_MATCHES = {
 
 # --- Normalization ---
 
-def normalize_name(name):
-    """Normalize name: uppercase, strip accents, collapse spaces."""
-    if not name:
-        return ''
-    name = unicodedata.normalize('NFKD', name)
-    name = ''.join(c for c in name if not unicodedata.combining(c))
-    name = name.upper().strip()
-    name = re.sub(r'\s+', ' ', name)
-    return name
-
-
 def name_similarity(a, b):
     """Compute similarity between two names using multiple strategies."""
     if not a or not b:
@@ -217,9 +216,12 @@ def url_to_local_path(url):
     folder = match.group(1)
     filename = match.group(2)
     local = DOWNLOADS_DIR / folder / filename
-    if local.exists():
-        return str(local)
-    return ''
+    if IMAGE_CACHE is not None:
+        # get() counts the hit (or fetches the evicted file back and counts the miss)
+        cached = IMAGE_CACHE.get(url)
+        if cached:
+            return str(cached)
+    return str(local) if local.exists() else ''
 
 
 # --- Matching ---
@@ -266,8 +268,13 @@ def match_patients(laudos, apoe_patients):
 
 
 def main():
+    global IMAGE_CACHE
     execute = '--execute' in sys.argv
 
+    if '--fetch-missing' in sys.argv:
+        from image_cache import ImageCache
+        IMAGE_CACHE = ImageCache.default()
+
     print("=" * 70)
     print("  RETINA x APOE — Cruzamento de Pacientes")
     print("=" * 70)
@@ -378,6 +385,11 @@ def main():
     else:
         print(f"\n[PREVIEW] Use --execute para gerar matched_patients.csv")
 
+    if IMAGE_CACHE is not None:
+        IMAGE_CACHE.save()
+        print(f"Cache de imagens: {IMAGE_CACHE.stats['hits']} hits, {IMAGE_CACHE.stats['misses']} misses "
+              f"(hit rate {IMAGE_CACHE.hit_rate():.1%})")
+
 
 if __name__ == '__main__':
-    main()
+    profiling.profile_main(main, '01_match_patients', PROFILE_DIR)
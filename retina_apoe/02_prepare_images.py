@@ -21,6 +21,11 @@ SCRIPT_DIR = Path(__file__).parent
 MATCHED_CSV = SCRIPT_DIR / 'matched_patients.csv'
 OUTPUT_DIR = SCRIPT_DIR / 'automorph_input'
 RESULTS_DIR = SCRIPT_DIR / 'automorph_results'
+ETL_DIR = SCRIPT_DIR.parent / 'scripts' / 'eyercloud_downloader'
+PROFILE_DIR = SCRIPT_DIR / 'profiles'
+
+sys.path.insert(0, str(ETL_DIR))
+import profiling
 
 # Phelcom EyerCloud default: ~45° FOV, ~2000x2000 px sensor
 # Resolution ≈ 11 μm/pixel (estimated for 45° FOV retinal camera)
@@ -135,4 +140,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    profiling.profile_main(main, '02_prepare_images', PROFILE_DIR)
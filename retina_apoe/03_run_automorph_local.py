@@ -15,6 +15,7 @@ Uso:
     python 03_run_automorph_local.py --run --cpu        # Força CPU (sem GPU)
     python 03_run_automorph_local.py --skip-quality     # Pula M1 quality (processa TODAS as imagens)
     python 03_run_automorph_local.py --run --skip-quality  # Roda sem filtro de qualidade
+    python 03_run_automorph_local.py --run --profile    # + perfil e timers por etapa em profiles/
 """
 
 import sys
@@ -35,6 +36,11 @@ AUTOMORPH_DIR = SCRIPT_DIR / 'AutoMorph'
 INPUT_DIR = SCRIPT_DIR / 'automorph_input'
 RESULTS_DIR = SCRIPT_DIR / 'automorph_results'
 LOG_FILE = SCRIPT_DIR / 'automorph_local_log.txt'
+ETL_DIR = SCRIPT_DIR.parent / 'scripts' / 'eyercloud_downloader'
+PROFILE_DIR = SCRIPT_DIR / 'profiles'
+
+sys.path.insert(0, str(ETL_DIR))
+import profiling
 
 AUTOMORPH_REPO = 'https://github.com/rmaphoh/AutoMorph.git'
 
@@ -54,11 +60,12 @@ def run_cmd(cmd, cwd=None, check=True, env=None):
     merged_env = os.environ.copy()
     if env:
         merged_env.update(env)
-    result = subprocess.run(
-        cmd, shell=True, cwd=cwd,
-        capture_output=True, text=True,
-        env=merged_env, encoding='utf-8', errors='replace'
-    )
+    with profiling.section(profiling.cmd_label(cmd)):
+        result = subprocess.run(
+            cmd, shell=True, cwd=cwd,
+            capture_output=True, text=True,
+            env=profiling.child_env(merged_env), encoding='utf-8', errors='replace'
+        )
     if result.stdout.strip():
         for line in result.stdout.strip().split('\n')[-20:]:  # Last 20 lines
             log(f"    | {line}")
@@ -594,28 +601,36 @@ def main():
 
     log("")
     start = datetime.now()
+    if profiling.active():
+        log(f"  Profile: {profiling.active().prefix}.* (+ AutoMorph: __<módulo>_<pid>)")
 
     # Step 1: Clone
+    profiling.mark('clone')
     if not step_clone():
         log("ABORT: Falha ao clonar AutoMorph")
         return
 
     # Step 2: Install deps
+    profiling.mark('install_deps')
     if not step_install_deps():
         log("ABORT: Falha ao instalar dependências")
         return
 
     # Step 3: Copy images
+    profiling.mark('prepare_images')
     if not step_prepare_images():
         log("ABORT: Falha ao preparar imagens")
         return
 
     # Step 4: Run pipeline
+    profiling.mark('run_pipeline')
     step_run_pipeline(skip_quality=skip_quality, force_cpu=force_cpu)
 
     # Step 5: Collect results
+    profiling.mark('collect_results')
     success = step_collect_results()
 
+    profiling.mark(None)
     elapsed = datetime.now() - start
     log(f"\n  Tempo total: {elapsed}")
 
@@ -626,4 +641,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    profiling.profile_main(main, '03_run_automorph_local', PROFILE_DIR)
@@ -35,6 +35,11 @@ SCRIPT_DIR = Path(__file__).parent
 MATCHED_CSV = SCRIPT_DIR / 'matched_patients.csv'
 MANIFEST_CSV = SCRIPT_DIR / 'image_manifest.csv'
 FIGURES_DIR = SCRIPT_DIR / 'figures'
+ETL_DIR = SCRIPT_DIR.parent / 'scripts' / 'eyercloud_downloader'
+PROFILE_DIR = SCRIPT_DIR / 'profiles'
+
+sys.path.insert(0, str(ETL_DIR))
+import profiling
 
 GENOTYPE_ORDER = ['e2e2', 'e2e3', 'e3e3', 'e3e4', 'e4e4']
 GENOTYPE_LABELS = {
@@ -474,4 +479,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    profiling.profile_main(main, '04_analyze', PROFILE_DIR)
@@ -16,6 +16,7 @@ Uso:
     python 05_mozania_automorph_local.py --run --skip-quality     # Pula filtro M1
     python 05_mozania_automorph_local.py --run --batch 500        # Processa em batches de 500
     python 05_mozania_automorph_local.py --run --batch 500 --start 500  # Continua do batch 2
+    python 05_mozania_automorph_local.py --run --batch 500 --profile    # + perfil e timers por etapa em profiles/
 """
 
 import sys
@@ -42,6 +43,11 @@ ZIP_PATH = SCRIPT_DIR / 'mozania_selected_images.zip'
 EXTRACT_DIR = SCRIPT_DIR / 'mozania_images_extracted'
 RESULTS_DIR = SCRIPT_DIR / 'automorph_results_mozania'
 LOG_FILE = SCRIPT_DIR / 'mozania_automorph_log.txt'
+ETL_DIR = SCRIPT_DIR.parent / 'scripts' / 'eyercloud_downloader'
+PROFILE_DIR = SCRIPT_DIR / 'profiles'
+
+sys.path.insert(0, str(ETL_DIR))
+import profiling
 
 AUTOMORPH_REPO = 'https://github.com/rmaphoh/AutoMorph.git'
 
@@ -59,47 +65,49 @@ def run_cmd(cmd, cwd=None, check=True, env=None, timeout=None, stream=False):
     merged_env = os.environ.copy()
     if env:
         merged_env.update(env)
-    try:
-        if stream:
-            # Stream output in real-time (for long-running commands)
-            proc = subprocess.Popen(
-                cmd, shell=True, cwd=cwd,
-                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                env=merged_env, text=True, encoding='utf-8', errors='replace',
-                bufsize=1
-            )
-            for line in proc.stdout:
-                line = line.rstrip()
-                if line:
-                    log(f"    | {line}")
-            proc.wait()
-            if check and proc.returncode != 0:
-                log(f"  ⚠ Retorno: {proc.returncode}")
-            # Return a simple object with returncode
-            class R:
-                pass
-            r = R()
-            r.returncode = proc.returncode
-            return r
-        else:
-            result = subprocess.run(
-                cmd, shell=True, cwd=cwd,
-                capture_output=True, text=True,
-                env=merged_env, encoding='utf-8', errors='replace',
-                timeout=timeout
-            )
-            if result.stdout.strip():
-                for line in result.stdout.strip().split('\n')[-20:]:
-                    log(f"    | {line}")
-            if result.stderr.strip():
-                for line in result.stderr.strip().split('\n')[-10:]:
-                    log(f"    ! {line}")
-            if check and result.returncode != 0:
-                log(f"  ⚠ Retorno: {result.returncode}")
-            return result
-    except subprocess.TimeoutExpired:
-        log(f"  ⚠ Timeout ({timeout}s)")
-        return None
+    with profiling.section(profiling.cmd_label(cmd)):
+        merged_env = profiling.child_env(merged_env)
+        try:
+            if stream:
+                # Stream output in real-time (for long-running commands)
+                proc = subprocess.Popen(
+                    cmd, shell=True, cwd=cwd,
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                    env=merged_env, text=True, encoding='utf-8', errors='replace',
+                    bufsize=1
+                )
+                for line in proc.stdout:
+                    line = line.rstrip()
+                    if line:
+                        log(f"    | {line}")
+                proc.wait()
+                if check and proc.returncode != 0:
+                    log(f"  ⚠ Retorno: {proc.returncode}")
+                # Return a simple object with returncode
+                class R:
+                    pass
+                r = R()
+                r.returncode = proc.returncode
+                return r
+            else:
+                result = subprocess.run(
+                    cmd, shell=True, cwd=cwd,
+                    capture_output=True, text=True,
+                    env=merged_env, encoding='utf-8', errors='replace',
+                    timeout=timeout
+                )
+                if result.stdout.strip():
+                    for line in result.stdout.strip().split('\n')[-20:]:
+                        log(f"    | {line}")
+                if result.stderr.strip():
+                    for line in result.stderr.strip().split('\n')[-10:]:
+                        log(f"    ! {line}")
+                if check and result.returncode != 0:
+                    log(f"  ⚠ Retorno: {result.returncode}")
+                return result
+        except subprocess.TimeoutExpired:
+            log(f"  ⚠ Timeout ({timeout}s)")
+            return None
 
 
 def check_gpu():
@@ -456,7 +464,7 @@ def _run_parallel_scripts(scripts_with_cwd, label="parallel"):
         log(f"  [{label}] Iniciando: {name}")
         proc = subprocess.Popen(
             f'{python} {script_path}',
-            shell=True, cwd=str(cwd),
+            shell=True, cwd=str(cwd), env=profiling.child_env(os.environ.copy()),
             stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
             text=True, encoding='utf-8', errors='replace',
             bufsize=1
@@ -690,7 +698,8 @@ def step_run(batch, skip_quality):
 
     if m3_scripts:
         log(f"  {len(m3_scripts)} scripts M3 — rodando TODOS em paralelo!")
-        _run_parallel_scripts(m3_scripts, label="M3")
+        with profiling.section('M3'):
+            _run_parallel_scripts(m3_scripts, label="M3")
     else:
         log("  ⚠ Nenhum script M3 encontrado! Verificando estrutura...")
         for d_name in ['M3_feature_zone', 'M3_feature_whole_pic']:
@@ -824,7 +833,11 @@ def main():
         merge_batches()
         return
 
+    if profiling.active():
+        log(f"  Profile: {profiling.active().prefix}.* (+ AutoMorph: __<módulo>_<pid>)")
+
     # Extract ZIP
+    profiling.mark('extract_zip')
     images = step_extract_zip()
     if not images:
         return
@@ -842,11 +855,13 @@ def main():
         return
 
     # Clone
+    profiling.mark('clone')
     if not step_clone():
         log("ABORT: Falha ao clonar AutoMorph")
         return
 
     # Install deps
+    profiling.mark('install_deps')
     if not step_install_deps():
         log("ABORT: Dependências faltando")
         return
@@ -860,6 +875,7 @@ def main():
         return
 
     # Diagnóstico rápido sempre (versões)
+    profiling.mark('diagnose')
     step_diagnose()
 
     # Batch processing
@@ -868,9 +884,13 @@ def main():
         batch_end = min(batch_start + args.batch, len(images))
         log(f"\n  Processando batch {batch_start}-{batch_end} de {len(images)}")
 
+        profiling.mark('prepare_batch')
         batch, label = step_prepare_batch(images, batch_start, args.batch)
+        profiling.mark('run')
         step_run(batch, args.skip_quality)
+        profiling.mark('collect')
         collected = step_collect(label)
+        profiling.mark(None)
 
         # Summary
         mac = collected.get('Macular_Features.csv', 0)
@@ -887,9 +907,13 @@ def main():
 
     else:
         # All at once
+        profiling.mark('prepare_batch')
         batch, label = step_prepare_batch(images, 0, 0)
+        profiling.mark('run')
         step_run(batch, args.skip_quality)
+        profiling.mark('collect')
         collected = step_collect(label)
+        profiling.mark(None)
 
         mac = collected.get('Macular_Features.csv', 0)
         log(f"\n  Total: {mac} imagens com métricas de {len(images)} processadas")
@@ -902,4 +926,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    profiling.profile_main(main, '05_mozania_automorph_local', PROFILE_DIR)
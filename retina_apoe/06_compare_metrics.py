@@ -33,6 +33,11 @@ warnings.filterwarnings('ignore')
 
 SCRIPT_DIR = Path(__file__).parent
 FIGURES_DIR = SCRIPT_DIR / 'figures_comparison'
+ETL_DIR = SCRIPT_DIR.parent / 'scripts' / 'eyercloud_downloader'
+PROFILE_DIR = SCRIPT_DIR / 'profiles'
+
+sys.path.insert(0, str(ETL_DIR))
+import profiling
 
 # Mapping: CSV do médico (6 métricas por olho) -> AutoMorph column names
 # O CSV do médico tem: {side}_{metric} onde side = left/right
@@ -370,4 +375,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    profiling.profile_main(main, '06_compare_metrics', PROFILE_DIR)
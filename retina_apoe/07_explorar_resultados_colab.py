@@ -31,6 +31,11 @@ warnings.filterwarnings('ignore')
 
 SCRIPT_DIR = Path(__file__).parent
 FIGURES_DIR = SCRIPT_DIR / 'figures_mozania'
+ETL_DIR = SCRIPT_DIR.parent / 'scripts' / 'eyercloud_downloader'
+PROFILE_DIR = SCRIPT_DIR / 'profiles'
+
+sys.path.insert(0, str(ETL_DIR))
+import profiling
 
 
 def load_results(results_dir: Path):
@@ -323,4 +328,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    profiling.profile_main(main, '07_explorar_resultados_colab', PROFILE_DIR)
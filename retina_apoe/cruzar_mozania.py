@@ -5,10 +5,14 @@ Gera CSV com: N, prontuario_lista, nome_lista, prontuario_banco, nome_banco (raw
 
 import json
 import csv
-import unicodedata
 import re
+import sys
+from pathlib import Path
 from difflib import SequenceMatcher
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'scripts' / 'eyercloud_downloader'))
+from text_normalize import normalize_key
+
 # --- Lista da Dra. Mozania ---
 MOZANIA_LIST = [
     (1, "006.31.016", "Neusa Maria O. Luccas"),
@@ -896,17 +900,6 @@ MOZANIA_LIST = [
     (925, "007.38.072", "FLAVIO FAUSTO"),
 ]
 
-def normalize_str(s):
-    """Normaliza string: uppercase, sem acentos, sem pontuação extra"""
-    if not s:
-        return ""
-    s = s.upper().strip()
-    s = unicodedata.normalize('NFD', s)
-    s = ''.join(c for c in s if unicodedata.category(c) != 'Mn')
-    s = re.sub(r'[^A-Z0-9 ]', ' ', s)
-    s = re.sub(r'\s+', ' ', s).strip()
-    return s
-
 def normalize_prontuario(p):
     """Normaliza prontuário: remove espaços, normaliza pontos"""
     if not p:
@@ -980,7 +973,7 @@ for p in db_patients:
             prontuario_index[pron_norm].append(p)
 
 # Prepara nomes normalizados do banco para busca fuzzy (usa nome extraído)
-db_names_norm = [(normalize_str(p['_extracted_name'] or p.get('normalizedName') or p.get('rawName', '')), p) for p in db_patients]
+db_names_norm = [(normalize_key(p['_extracted_name'] or p.get('normalizedName') or p.get('rawName', '')), p) for p in db_patients]
 
 def find_best_match(lista_n, lista_pron, lista_nome):
     """
@@ -989,7 +982,7 @@ def find_best_match(lista_n, lista_pron, lista_nome):
     Retorna lista de candidatos com score.
     """
     lista_pron_norm = pron_normalize_segments(lista_pron)
-    lista_nome_norm = normalize_str(lista_nome)
+    lista_nome_norm = normalize_key(lista_nome)
 
     candidates = []
     seen_ids = set()
@@ -1010,7 +1003,7 @@ def find_best_match(lista_n, lista_pron, lista_nome):
     # 1. Match exato por prontuário normalizado
     if lista_pron_norm and lista_pron_norm in prontuario_index:
         for p in prontuario_index[lista_pron_norm]:
-            db_name_norm = normalize_str(p['_extracted_name'] or p.get('rawName', ''))
+            db_name_norm = normalize_key(p['_extracted_name'] or p.get('rawName', ''))
             name_sim = similarity(lista_nome_norm, db_name_norm)
             add_candidate(p, 'prontuario_exato', name_sim, 0.7 + 0.3 * name_sim)
 
@@ -1019,7 +1012,7 @@ def find_best_match(lista_n, lista_pron, lista_nome):
         for pron_n, patients in prontuario_index.items():
             if pron_n != lista_pron_norm and lista_pron_norm.endswith(pron_n):
                 for p in patients:
-                    db_name_norm = normalize_str(p['_extracted_name'] or p.get('rawName', ''))
+                    db_name_norm = normalize_key(p['_extracted_name'] or p.get('rawName', ''))
                     name_sim = similarity(lista_nome_norm, db_name_norm)
                     add_candidate(p, 'prontuario_sufixo', name_sim, 0.65 + 0.35 * name_sim)
 
@@ -1029,7 +1022,7 @@ def find_best_match(lista_n, lista_pron, lista_nome):
         for pron_n, patients in prontuario_index.items():
             if pron_n.startswith(prefix) and pron_n != lista_pron_norm:
                 for p in patients:
-                    db_name_norm = normalize_str(p['_extracted_name'] or p.get('rawName', ''))
+                    db_name_norm = normalize_key(p['_extracted_name'] or p.get('rawName', ''))
                     name_sim = similarity(lista_nome_norm, db_name_norm)
                     pron_sim = similarity(lista_pron_norm, pron_n)
                     score = 0.4 * pron_sim + 0.6 * name_sim
@@ -1,10 +1,9 @@
 import json
+import sys
 from pathlib import Path
 
-def normalize_name(name):
-    import unicodedata
-    if not name: return "UNKNOWN"
-    return "".join(c for c in unicodedata.normalize('NFD', name.upper()) if unicodedata.category(c) != 'Mn')
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'eyercloud_downloader'))
+from text_normalize import normalize_name
 
 def main():
     mapping_path = Path("e:/GitHub/NeuroApp/scripts/eyercloud_downloader/bytescale_mapping_final.json")
@@ -21,7 +20,7 @@ def main():
     for key, exam in data.items():
         name = exam.get('patient_name', 'Unknown')
         bday = exam.get('birthday', 'Unknown')
-        norm_name = normalize_name(name)
+        norm_name = normalize_name(name) or "UNKNOWN"
         patient_key = f"{norm_name}|{bday}"
         
         if patient_key not in unique_patients:
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Cheap auth-validity probe for saved EyerCloud sessions.
+=======================================================
+Scripts used to decide whether they were logged in by loading /exam in the
+browser and sniffing the page ("Acessar exame" in page.content()) or by
+waiting a fixed 20-30 s for a manual login. This probe checks the saved
+storage_state cookies with ONE small authenticated API call (clinic/list)
+and caches a positive answer until the earliest cookie expiry, capped at
+PROBE_TTL. A browser login is only needed when the probe fails.
+
+Cache: auth_probe_cache.json  {auth_file: {fingerprint, valid_until, checked_at}}
+The fingerprint is a hash of the cookies, so a re-login invalidates it.
+
+Usage:
+    cd scripts/eyercloud_downloader
+    python auth_probe.py                         # auth_state.json
+    python auth_probe.py auth_state_x.json --force
+
+From other scripts:
+    from auth_probe import probe_auth
+    if not probe_auth(auth_file):
+        ... start the login flow ...
+"""
+
+import os
+import json
+import time
+import hashlib
+import argparse
+from pathlib import Path
+from urllib.parse import urlparse
+
+# EYERCLOUD_DOMAIN points every API client at another host (e.g. eyercloud_standin.py)
+API_BASE = f"{os.getenv('EYERCLOUD_DOMAIN', 'https://eyercloud.com').rstrip('/')}/api/v2/eyercloud"
+API_HOST = urlparse(API_BASE).hostname
+PROBE_URL = f"{API_BASE}/clinic/list"
+CACHE_FILE = Path("auth_probe_cache.json")
+PROBE_TTL = 15 * 60  # server-side sessions can end before their cookies do
+PROBE_TIMEOUT = 10
+
+
+def load_cookies(auth_file):
+    """Cookies from a Playwright storage_state file ([] if missing/unreadable)."""
+    try:
+        state = json.loads(Path(auth_file).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return []
+    return [c for c in state.get('cookies', [])
+            if 'eyercloud' in c.get('domain', '') or c.get('domain', '').lstrip('.') == API_HOST]
+
+
+def cookie_fingerprint(cookies):
+    key = sorted((c.get('domain', ''), c.get('name', ''), c.get('value', '')) for c in cookies)
+    return hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+
+
+def cookie_expiry(cookies, now):
+    """Earliest expiry among persistent cookies, capped at now + PROBE_TTL."""
+    expiries = [c['expires'] for c in cookies if c.get('expires', -1) > 0]
+    return min([now + PROBE_TTL] + expiries)
+
+
+def _load_cache():
+    try:
+        return json.loads(CACHE_FILE.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache):
+    CACHE_FILE.write_text(json.dumps(cache, indent=2), encoding='utf-8')
+
+
+def invalidate(auth_file):
+    cache = _load_cache()
+    if cache.pop(str(auth_file), None) is not None:
+        _save_cache(cache)
+
+
+def check_cookies(cookies):
+    """One authenticated request with these cookies. True if the session is accepted."""
+    import requests
+
+    session = requests.Session()
+    for c in cookies:
+        session.cookies.set(c['name'], c['value'], domain=c.get('domain', ''), path=c.get('path', '/'))
+    try:
+        resp = session.post(PROBE_URL, headers={'Accept': 'application/json'}, timeout=PROBE_TIMEOUT)
+    except requests.RequestException:
+        return False
+    if resp.status_code != 200:
+        return False
+    try:
+        return isinstance(resp.json().get('result'), list)
+    except ValueError:
+        return False
+
+
+def probe_auth(auth_file, force=False):
+    """True if the session saved in auth_file is still logged in (cached)."""
+    cookies = load_cookies(auth_file)
+    if not cookies:
+        return False
+
+    now = time.time()
+    fingerprint = cookie_fingerprint(cookies)
+    cache = _load_cache()
+    entry = cache.get(str(auth_file))
+    if not force and entry and entry['fingerprint'] == fingerprint and entry['valid_until'] > now:
+        return True
+
+    if not check_cookies(cookies):
+        if entry is not None:
+            cache.pop(str(auth_file))
+            _save_cache(cache)
+        return False
+
+    cache[str(auth_file)] = {
+        'fingerprint': fingerprint,
+        'valid_until': cookie_expiry(cookies, now),
+        'checked_at': now,
+    }
+    _save_cache(cache)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check whether a saved EyerCloud session is still valid')
+    parser.add_argument('auth_file', nargs='?', default='auth_state.json')
+    parser.add_argument('--force', action='store_true', help='Ignore the cache and call the API')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    valid = probe_auth(args.auth_file, force=args.force)
+    elapsed = (time.perf_counter() - started) * 1000
+    entry = _load_cache().get(args.auth_file)
+    print(f"{args.auth_file}: {'VALID' if valid else 'INVALID'} ({elapsed:.0f} ms)")
+    if valid and entry:
+        print(f"  cached until {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['valid_until']))}")
+
+
+if __name__ == "__main__":
+    main()
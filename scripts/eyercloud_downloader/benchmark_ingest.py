@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+End-to-end ingestion benchmark against the local stand-ins.
+===========================================================
+Onboards a synthetic login served by eyercloud_standin.py and uploads it to
+bytescale_standin.py -- never the real services -- stage by stage:
+
+    listing   exam/filter pages (API session, as downloader.py)
+    details   /examData/list per exam
+    download  COLOR/ANTERIOR images from the CloudFront-like endpoint
+    verify    JPEG SOI/EOI check (the ingest_pipeline verify stage)
+    upload    bytescale_backend.BytescaleBackend
+
+for every (dataset size, concurrency) cell. Each cell records wall time per
+stage, items/s and MB/s, p50/p95 latency, peak RSS and the requests each
+stand-in received (including 429s). Results go to a JSON file tagged with
+the git commit, so runs can be compared across commits.
+
+Reading the results (1000 x 64 KB images, default latencies, stand-ins at
+revision 2): upload is the slowest stage at every concurrency (46.9 s at 1
+worker, 8.3 s at 16), then download (30.2 s / 6.2 s); details (13.3 s /
+1.6 s) and listing are minor. The stand-ins run in this process, so at
+0 ms latency the cells measure CPU/GIL contention, not the clients -- more
+workers get slower there. Runs recorded before revision 2 carried a ~40 ms
+per-request floor from the stand-ins (Nagle + delayed ACK) that inflated
+details and upload; `compare` warns when the revisions differ.
+
+Usage:
+    cd scripts/eyercloud_downloader
+    python benchmark_ingest.py                                   # 1k,10k,50k x 4,16
+    python benchmark_ingest.py --sizes 1000 --concurrency 1,4,8,16
+    python benchmark_ingest.py --latency-ms 120 --cdn-latency-ms 30 --rate-limit 40
+    python benchmark_ingest.py compare benchmarks/ingest_a.json benchmarks/ingest_b.json
+"""
+
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import threading
+import subprocess
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import eyercloud_standin
+import bytescale_standin
+from bytescale_backend import BytescaleBackend
+from benchmark_upload import RssSampler, percentile
+from jpeg_scrub import check_markers
+
+RESULTS_DIR = Path("benchmarks")
+USEFUL_TYPES = ('COLOR', 'ANTERIOR')
+MAX_RETRIES = 5
+STAGES = ('listing', 'details', 'download', 'verify', 'upload')
+# Bumped when a stand-in change shifts the numbers; 2 = Nagle disabled in both stand-ins
+STANDIN_REVISION = 2
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=Path(__file__).resolve().parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+class Client:
+    """One logged-in API session, cloned per worker thread (requests.Session is not thread-safe)."""
+
+    def __init__(self, base_url, email='bench@example.com', password='bench'):
+        self.api = f"{base_url}{eyercloud_standin.API_PREFIX}"
+        session = requests.Session()
+        resp = session.post(f"{self.api}/auth/login", json={'email': email, 'password': password}, timeout=30)
+        resp.raise_for_status()
+        self.cookies = session.cookies.get_dict()
+        self.retries = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.cookies.update(self.cookies)
+        return session
+
+    def call(self, method, url, **kwargs):
+        """Request with Retry-After handling for 429/503, like a polite client."""
+        for attempt in range(MAX_RETRIES + 1):
+            resp = self.session().request(method, url, timeout=60, **kwargs)
+            if resp.status_code not in (429, 503) or attempt == MAX_RETRIES:
+                return resp
+            with self._lock:
+                self.retries += 1
+            time.sleep(float(resp.headers.get('Retry-After', 0.2 * (attempt + 1))))
+        return resp
+
+
+def timed_map(func, items, concurrency):
+    """Run func over items in a thread pool. Returns (results, latencies, wall)."""
+    latencies = []
+    lock = threading.Lock()
+
+    def run(item):
+        started = time.perf_counter()
+        result = func(item)
+        with lock:
+            latencies.append(time.perf_counter() - started)
+        return result
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        results = list(pool.map(run, items))
+    return results, latencies, time.perf_counter() - started
+
+
+def stage_stats(items, ok, nbytes, latencies, wall):
+    return {
+        'items': items,
+        'ok': ok,
+        'failed': items - ok,
+        'wall_s': round(wall, 3),
+        'items_per_s': round(ok / wall, 2) if wall else 0,
+        'mb_per_s': round(nbytes / (1024 * 1024) / wall, 2) if wall else 0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+    }
+
+
+def run_cell(eyercloud_url, backend, concurrency, workdir):
+    client = Client(eyercloud_url)
+    stages = {}
+
+    # listing: sequential pages, stop on an empty or already-seen page
+    exams, seen, latencies = [], set(), []
+    started = time.perf_counter()
+    page = 1
+    while True:
+        t0 = time.perf_counter()
+        resp = client.call('POST', f"{client.api}/exam/filter",
+                           json={'startDate': '01/01/2000', 'endDate': '01/01/2050',
+                                 'statusFilter': 'all', 'page': str(page)})
+        latencies.append(time.perf_counter() - t0)
+        result = resp.json().get('result', []) if resp.ok else []
+        ids = {e['id'] for e in result}
+        if not result or ids <= seen:
+            break
+        exams.extend(e for e in result if e['id'] not in seen)
+        seen |= ids
+        page += 1
+    stages['listing'] = stage_stats(len(latencies), len(latencies), 0, latencies, time.perf_counter() - started)
+
+    # details
+    def fetch_details(exam_id):
+        resp = client.call('GET', f"{client.api}/examData/list", params={'id': exam_id})
+        return resp.json() if resp.ok else None
+
+    details, latencies, wall = timed_map(fetch_details, [e['id'] for e in exams], concurrency)
+    stages['details'] = stage_stats(len(exams), sum(1 for d in details if d), 0, latencies, wall)
+
+    jobs = []
+    for exam, data in zip(exams, details):
+        for img in (data or {}).get('examDataList', []):
+            if img.get('type') in USEFUL_TYPES:
+                jobs.append((f"{data['dataPath']}/{img['uuid']}",
+                             workdir / exam['id'] / f"{img['uuid']}.jpg"))
+
+    # download
+    def download(job):
+        url, path = job
+        resp = client.session().get(url, timeout=60)
+        if resp.status_code != 200 or len(resp.content) <= 1000:
+            return 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(resp.content)
+        return len(resp.content)
+
+    sizes, latencies, wall = timed_map(download, jobs, concurrency)
+    stages['download'] = stage_stats(len(jobs), sum(1 for s in sizes if s), sum(sizes), latencies, wall)
+    paths = [path for (_, path), size in zip(jobs, sizes) if size]
+
+    # verify
+    checks, latencies, wall = timed_map(check_markers, paths, concurrency)
+    verified = [p for p, (ok, _) in zip(paths, checks) if ok]
+    stages['verify'] = stage_stats(len(paths), len(verified), sum(sizes), latencies, wall)
+
+    # upload
+    def upload(path):
+        return backend.upload(path, f"/neuroapp/benchmark/{path.parent.name}", path.name)
+
+    uploads, latencies, wall = timed_map(upload, verified, concurrency)
+    uploaded_bytes = sum(p.stat().st_size for p, r in zip(verified, uploads) if r)
+    stages['upload'] = stage_stats(len(verified), sum(1 for r in uploads if r), uploaded_bytes, latencies, wall)
+
+    return stages, client.retries
+
+
+def counters_delta(before, after):
+    return {k: after.get(k, 0) - before.get(k, 0) for k in after if after.get(k, 0) - before.get(k, 0)}
+
+
+def run(args):
+    sizes = [int(s) for s in args.sizes.split(',')]
+    levels = [int(c) for c in args.concurrency.split(',')]
+    bytescale_server, bytescale_url = bytescale_standin.start_standin(
+        latency_ms=args.upload_latency_ms, seed=42)
+    backend = BytescaleBackend(api_key='secret_benchmark', account_id='BENCH', api_base=bytescale_url)
+
+    print("=" * 96)
+    print("  End-to-end ingestion benchmark (EyerCloud + Bytescale stand-ins)")
+    print(f"  Commit:     {git_commit()}")
+    print(f"  Latency:    API {args.latency_ms} ms, CDN {args.cdn_latency_ms} ms, "
+          f"upload {args.upload_latency_ms} ms   Rate limit: {args.rate_limit or 'none'}")
+    print(f"  Images:     {args.image_kb:g} KB each")
+    print("=" * 96)
+    print(f"  {'images':>7} {'conc':>5} {'wall s':>8} " + ' '.join(f"{s + ' s':>10}" for s in STAGES)
+          + f" {'img/s':>7} {'RSS MB':>7} {'reqs':>7} {'429':>5}")
+
+    results = []
+    for size in sizes:
+        dataset = eyercloud_standin.Dataset.for_image_count(size, image_kb=args.image_kb, seed=7)
+        server, base_url = eyercloud_standin.start_standin(
+            dataset=dataset, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+            cdn_latency_ms=args.cdn_latency_ms, pagination=args.pagination,
+            rate_limit=args.rate_limit, burst=args.rate_limit, seed=42,
+        )
+        try:
+            for concurrency in levels:
+                workdir = Path(tempfile.mkdtemp(prefix='bench_ingest_'))
+                eyer_before = dict(server.config.counters, **server.config.endpoints)
+                bytescale_before = dict(bytescale_server.config.counters)
+                try:
+                    with RssSampler() as rss:
+                        started = time.perf_counter()
+                        stages, retries = run_cell(base_url, backend, concurrency, workdir)
+                        wall = time.perf_counter() - started
+                finally:
+                    shutil.rmtree(workdir, ignore_errors=True)
+                eyer_requests = counters_delta(eyer_before, dict(server.config.counters, **server.config.endpoints))
+                cell = {
+                    'images': dataset.image_count,
+                    'exams': len(dataset.exams),
+                    'concurrency': concurrency,
+                    'wall_s': round(wall, 3),
+                    'images_per_s': round(stages['upload']['ok'] / wall, 2) if wall else 0,
+                    'peak_rss_mb': round(rss.peak / (1024 * 1024), 1),
+                    'client_retries': retries,
+                    'stages': stages,
+                    'requests': {
+                        'eyercloud': eyer_requests,
+                        'bytescale': counters_delta(bytescale_before, bytescale_server.config.counters),
+                    },
+                }
+                results.append(cell)
+                print(f"  {cell['images']:>7} {concurrency:>5} {wall:>8.1f} "
+                      + ' '.join(f"{stages[s]['wall_s']:>10.1f}" for s in STAGES)
+                      + f" {cell['images_per_s']:>7} {cell['peak_rss_mb']:>7} "
+                      f"{eyer_requests.get('requests', 0):>7} {eyer_requests.get('rate_limited', 0):>5}")
+                sys.stdout.flush()
+        finally:
+            server.shutdown()
+    bytescale_server.shutdown()
+
+    report = {
+        'created_at': datetime.now().isoformat(),
+        'commit': git_commit(),
+        'standin_revision': STANDIN_REVISION,
+        'params': {k: v for k, v in vars(args).items() if k != 'command'},
+        'results': results,
+    }
+    output = Path(args.output) if args.output else \
+        RESULTS_DIR / f"ingest_{report['commit']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding='utf-8')
+    print(f"\n  Results saved: {output}")
+
+
+def compare(old_file, new_file):
+    old = json.loads(Path(old_file).read_text(encoding='utf-8'))
+    new = json.loads(Path(new_file).read_text(encoding='utf-8'))
+    old_cells = {(c['images'], c['concurrency']): c for c in old['results']}
+
+    def delta(a, b):
+        return f"{(b - a) / a * 100:+6.1f}%" if a else "    n/a"
+
+    print(f"  {old.get('commit')} -> {new.get('commit')}")
+    revisions = old.get('standin_revision', 1), new.get('standin_revision', 1)
+    if revisions[0] != revisions[1]:
+        print(f"  WARNING: stand-in revision {revisions[0]} -> {revisions[1]}; the deltas below "
+              f"include the stand-in change, not just the client")
+    print(f"  {'images':>7} {'conc':>5} {'wall s':>18} {'img/s':>18} {'RSS MB':>18}  slowest stage")
+    for cell in new['results']:
+        prev = old_cells.get((cell['images'], cell['concurrency']))
+        slowest = max(STAGES, key=lambda s: cell['stages'][s]['wall_s'])
+        if prev is None:
+            print(f"  {cell['images']:>7} {cell['concurrency']:>5}  (new cell)")
+            continue
+        print(f"  {cell['images']:>7} {cell['concurrency']:>5} "
+              f"{cell['wall_s']:>10.1f} {delta(prev['wall_s'], cell['wall_s'])} "
+              f"{cell['images_per_s']:>10} {delta(prev['images_per_s'], cell['images_per_s'])} "
+              f"{cell['peak_rss_mb']:>10} {delta(prev['peak_rss_mb'], cell['peak_rss_mb'])}  {slowest}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end ingestion benchmark against local stand-ins')
+    parser.add_argument('command', nargs='?', default='run', choices=['run', 'compare'])
+    parser.add_argument('files', nargs='*', help='compare: OLD.json NEW.json')
+    parser.add_argument('--sizes', default='1000,10000,50000', help='Comma-separated dataset sizes (images)')
+    parser.add_argument('--concurrency', default='4,16', help='Comma-separated worker counts per stage')
+    parser.add_argument('--image-kb', type=float, default=64, help='Size of each synthetic image')
+    parser.add_argument('--latency-ms', type=float, default=50, help='EyerCloud API latency')
+    parser.add_argument('--jitter-ms', type=float, default=20)
+    parser.add_argument('--cdn-latency-ms', type=float, default=20)
+    parser.add_argument('--upload-latency-ms', type=float, default=50)
+    parser.add_argument('--rate-limit', type=float, default=0, help='EyerCloud API requests/s per session')
+    parser.add_argument('--pagination', default='repeat-last', choices=sorted(eyercloud_standin.PAGINATION_MODES))
+    parser.add_argument('--output', default=None, help='Results JSON (default: benchmarks/ingest_<commit>_<ts>.json)')
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        if len(args.files) != 2:
+            parser.error('compare needs OLD.json NEW.json')
+        compare(*args.files)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
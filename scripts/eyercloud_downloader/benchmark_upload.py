@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Upload throughput benchmark against the local Bytescale stand-in.
+=================================================================
+Drives the upload engine (bytescale_backend.BytescaleBackend, the same code
+the pipeline uses) at several concurrency levels and image sizes, against
+bytescale_standin.py -- never against the real account.
+
+For each (size, concurrency) cell it reports files/s, MB/s, p50/p95 upload
+latency, failures and peak RSS of this process during the cell.
+
+Usage:
+    cd scripts/eyercloud_downloader
+    python benchmark_upload.py
+    python benchmark_upload.py --sizes 300KB,2MB --concurrency 1,4,8,16,32 --files 200
+    python benchmark_upload.py --latency-ms 80 --bandwidth-mbps 100 --error-rate 0.01
+    python benchmark_upload.py --url http://127.0.0.1:8765     # stand-in already running
+    python benchmark_upload.py --output bench_upload.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import threading
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from bytescale_backend import BytescaleBackend
+from bytescale_standin import start_standin
+from image_cache import parse_size, format_size
+
+
+def current_rss():
+    """Resident set size of this process in bytes (Linux /proc, else peak RSS)."""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        return 0
+
+
+class RssSampler:
+    """Samples RSS in a background thread; .peak is the max seen."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def make_synthetic_images(directory, size_bytes, count):
+    """JPEG-framed random payloads (SOI ... EOI) of the requested size."""
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = directory / f"bench_{size_bytes}_{i:05d}.jpg"
+        path.write_bytes(b'\xff\xd8' + os.urandom(max(0, size_bytes - 4)) + b'\xff\xd9')
+        paths.append(path)
+    return paths
+
+
+def run_cell(backend, paths, concurrency):
+    latencies = []
+    failures = 0
+    lock = threading.Lock()
+
+    def upload_one(path):
+        nonlocal failures
+        started = time.perf_counter()
+        result = backend.upload(path, '/neuroapp/benchmark', path.name)
+        elapsed = time.perf_counter() - started
+        with lock:
+            if result:
+                latencies.append(elapsed)
+            else:
+                failures += 1
+
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(upload_one, paths))
+        wall = time.perf_counter() - started
+
+    ok = len(latencies)
+    total_bytes = sum(p.stat().st_size for p in paths[:ok]) if ok else 0
+    return {
+        'files': len(paths),
+        'ok': ok,
+        'failed': failures,
+        'wall_s': round(wall, 3),
+        'files_per_s': round(ok / wall, 2) if wall else 0,
+        'mb_per_s': round(total_bytes / (1024 * 1024) / wall, 2) if wall else 0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'peak_rss_mb': round(rss.peak / (1024 * 1024), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark uploads against the Bytescale stand-in')
+    parser.add_argument('--url', default=None, help='Use an already-running stand-in at this base URL')
+    parser.add_argument('--sizes', default='300KB,1MB,3MB', help='Comma-separated image sizes')
+    parser.add_argument('--concurrency', default='1,4,8,16', help='Comma-separated worker counts')
+    parser.add_argument('--files', type=int, default=100, help='Uploads per (size, concurrency) cell')
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--jitter-ms', type=float, default=20)
+    parser.add_argument('--bandwidth-mbps', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--output', default=None, help='Write results JSON here')
+    args = parser.parse_args()
+
+    sizes = [parse_size(s) for s in args.sizes.split(',')]
+    levels = [int(c) for c in args.concurrency.split(',')]
+
+    server = None
+    if args.url:
+        base_url = args.url
+    else:
+        server, base_url = start_standin(
+            latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+            bandwidth_mbps=args.bandwidth_mbps, error_rate=args.error_rate, seed=42,
+        )
+    backend = BytescaleBackend(api_key='secret_benchmark', account_id='BENCH', api_base=base_url)
+
+    print("=" * 78)
+    print("  Upload benchmark (Bytescale stand-in)")
+    print(f"  Stand-in:    {base_url}")
+    print(f"  Latency:     {args.latency_ms} ms (+{args.jitter_ms} jitter)  "
+          f"Bandwidth: {args.bandwidth_mbps or 'unlimited'} Mbps  Errors: {args.error_rate:.1%}")
+    print(f"  Files/cell:  {args.files}")
+    print("=" * 78)
+    print(f"  {'size':>9} {'conc':>5} {'files/s':>9} {'MB/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'failed':>7} {'RSS MB':>8}")
+
+    results = []
+    workdir = Path(tempfile.mkdtemp(prefix='bench_upload_'))
+    try:
+        for size in sizes:
+            paths = make_synthetic_images(workdir / str(size), size, args.files)
+            for concurrency in levels:
+                cell = run_cell(backend, paths, concurrency)
+                cell.update({'size_bytes': size, 'concurrency': concurrency})
+                results.append(cell)
+                print(f"  {format_size(size):>9} {concurrency:>5} {cell['files_per_s']:>9} "
+                      f"{cell['mb_per_s']:>8} {cell['p50_ms']:>8} {cell['p95_ms']:>8} "
+                      f"{cell['failed']:>7} {cell['peak_rss_mb']:>8}")
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        if server is not None:
+            server.shutdown()
+
+    best = max(results, key=lambda r: r['mb_per_s']) if results else None
+    if best:
+        print(f"\n  Best MB/s: {best['mb_per_s']} at concurrency {best['concurrency']} "
+              f"({format_size(best['size_bytes'])} images)")
+
+    if args.output:
+        report = {
+            'created_at': datetime.now().isoformat(),
+            'params': vars(args),
+            'results': results,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"  Results saved: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Batched /examData/list fetches inside the browser.
+==================================================
+The per-exam scripts make one page.evaluate round trip per exam, and each
+round trip issues a single fetch. Here a whole chunk of exam ids goes into
+ONE page.evaluate call that runs a bounded promise pool in the page (same
+cookies, same origin as the per-exam calls). Chunks are pipelined: while
+Python processes chunk N, chunk N+1 is already being fetched by the browser.
+
+    from browser_batch import iter_exam_data
+
+    async for exam_id, data in iter_exam_data(page, exam_ids, concurrency=8):
+        images = data.get('examDataList', [])   # failed ids are not yielded
+
+    results = await fetch_exam_data_batch(page, exam_ids)   # {exam_id: data}
+
+Ids whose fetch failed (HTTP error, invalid JSON, failed evaluate) are
+reported and left out, so callers keep those exams pending for the next run
+instead of recording them as exams without images.
+"""
+
+import os
+import asyncio
+from urllib.parse import urlparse
+
+EXAMDATA_API_URL = f"{os.getenv('EYERCLOUD_DOMAIN', 'https://eyercloud.com').rstrip('/')}/api/v2/eyercloud/examData/list"
+DEFAULT_CONCURRENCY = 8
+DEFAULT_CHUNK_SIZE = 50
+
+# Runs in the page: fetch every id of the chunk with at most `concurrency`
+# requests in flight. Returns [{id, status, data, error, ms}] in input order.
+_POOL_JS = '''async ({ids, url, method, concurrency}) => {
+    const results = new Array(ids.length);
+    let next = 0;
+    async function worker() {
+        while (next < ids.length) {
+            const i = next++;
+            const id = ids[i];
+            const started = performance.now();
+            try {
+                const resp = await fetch(`${url}?id=${encodeURIComponent(id)}`, {
+                    method,
+                    credentials: "include",
+                    // Content-Type only with a body: on a cross-origin GET it would force a CORS preflight
+                    headers: method === "POST"
+                        ? { "Accept": "application/json", "Content-Type": "application/json" }
+                        : { "Accept": "application/json" },
+                    body: method === "POST" ? "{}" : undefined,
+                });
+                const text = await resp.text();
+                let data = null;
+                try { data = JSON.parse(text); } catch (e) {}
+                results[i] = { id, status: resp.status, data,
+                               error: resp.ok && data ? null : (data ? `HTTP ${resp.status}` : "invalid JSON"),
+                               ms: performance.now() - started };
+            } catch (e) {
+                results[i] = { id, status: 0, data: null, error: String(e), ms: performance.now() - started };
+            }
+        }
+    }
+    await Promise.all(Array.from({ length: Math.min(concurrency, ids.length) }, worker));
+    return results;
+}'''
+
+
+async def _fetch_chunk(page, ids, url, method, concurrency):
+    return await page.evaluate(_POOL_JS, {
+        'ids': list(ids), 'url': url, 'method': method, 'concurrency': concurrency,
+    })
+
+
+async def iter_exam_results(page, exam_ids, concurrency=DEFAULT_CONCURRENCY,
+                            chunk_size=DEFAULT_CHUNK_SIZE, url=EXAMDATA_API_URL, method='GET',
+                            metrics=None):
+    """Yield raw {id, status, data, error, ms} dicts, one chunk per page.evaluate.
+
+    The next chunk is started before the current one is yielded, so browser
+    fetches overlap with whatever the caller does between items. With a
+    telemetry.Metrics, each fetch is recorded as a 'details' operation using
+    the latency measured inside the page.
+    """
+    host = urlparse(url).netloc
+    exam_ids = list(exam_ids)
+    chunks = [exam_ids[i:i + chunk_size] for i in range(0, len(exam_ids), chunk_size)]
+    if not chunks:
+        return
+
+    pending = asyncio.ensure_future(_fetch_chunk(page, chunks[0], url, method, concurrency))
+    try:
+        for index, chunk in enumerate(chunks):
+            try:
+                results = await pending
+            except Exception as e:
+                # The evaluate itself failed (navigation, closed page): report every id
+                results = [{'id': i, 'status': 0, 'data': None, 'error': str(e)} for i in chunk]
+            pending = None
+            if index + 1 < len(chunks):
+                pending = asyncio.ensure_future(
+                    _fetch_chunk(page, chunks[index + 1], url, method, concurrency))
+            for result in results:
+                if metrics is not None:
+                    metrics.observe('details', (result.get('ms') or 0) / 1000, host=host,
+                                    ok=not result['error'])
+                yield result
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+
+
+async def iter_exam_data(page, exam_ids, **kwargs):
+    """Yield (exam_id, data) for the ids fetched successfully; failed ids are skipped."""
+    async for result in iter_exam_results(page, exam_ids, **kwargs):
+        if result['error'] or not isinstance(result['data'], dict):
+            print(f"    ERROR fetching exam details {result['id']}: {result['error'] or 'not an object'}"
+                  f" (left pending)")
+            continue
+        yield result['id'], result['data']
+
+
+async def fetch_exam_data_batch(page, exam_ids, **kwargs):
+    """{exam_id: data} for the ids fetched successfully (see iter_exam_data)."""
+    return {exam_id: data async for exam_id, data in iter_exam_data(page, exam_ids, **kwargs)}
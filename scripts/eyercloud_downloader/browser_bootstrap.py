@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Lean Playwright bootstrap shared by the browser-based scripts.
+==============================================================
+    - blocks images, fonts, media and stylesheets: the scripts only need the
+      Vue app's JavaScript, its cookies and its Sails socket;
+    - waits on explicit signals (login form rendered, socket connected, URL
+      change) instead of fixed sleeps/countdowns;
+    - keeps one storage_state file per account (auth_state_<login>.json, or
+      auth_state.json without a login) so every script reuses the same session.
+
+    from browser_bootstrap import open_browser, login_eyercloud, wait_for_sails_socket
+
+    async with async_playwright() as p:
+        browser, context, page = await open_browser(p, auth_file)
+        if not await login_eyercloud(page, email, password, auth_file):
+            ...
+        await page.goto(f"{BASE_URL}/exam", wait_until="domcontentloaded")
+        await wait_for_sails_socket(page)
+
+Set EYERCLOUD_HEADLESS=1 to run without a window once a session is saved.
+"""
+
+import os
+import re
+import asyncio
+from pathlib import Path
+
+from auth_probe import probe_auth, invalidate
+from etl_common import sanitize_email
+
+# Web app host; EYERCLOUD_APP_URL can point the browser scripts at eyercloud_standin.py
+BASE_URL = os.getenv('EYERCLOUD_APP_URL', "https://ec2.eyercloud.com").rstrip('/')
+BLOCKED_RESOURCE_TYPES = frozenset({'image', 'media', 'font', 'stylesheet'})
+MANUAL_LOGIN_TIMEOUT = 300  # seconds to wait for a login typed in the browser
+
+_SOCKET_CONNECTED_JS = """() => {
+    try {
+        const app = document.querySelector('#app')?.__vue_app__;
+        return !!app && (app.config.globalProperties.$io?.socket?.isConnected() || false);
+    } catch (e) { return false; }
+}"""
+
+# Resolves to 'login' when the login form is on screen, 'app' once the
+# authenticated app is up (Sails socket connected)
+_LANDING_JS = """() => {
+    if (document.querySelector('input[placeholder="Email"]')) return 'login';
+    try {
+        const app = document.querySelector('#app')?.__vue_app__;
+        if (app && app.config.globalProperties.$io?.socket?.isConnected()) return 'app';
+    } catch (e) {}
+    return null;
+}"""
+
+
+def auth_file_for(email=None):
+    """The storage_state file shared by every script for this account."""
+    if email:
+        return Path(f"auth_state_{sanitize_email(email)}.json")
+    return Path("auth_state.json")
+
+
+async def _block_non_essential(route):
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def open_browser(playwright, auth_file=None, headless=None, block_resources=True, **context_options):
+    """Launch Chromium and open (browser, context, page), reusing auth_file if present."""
+    if headless is None:
+        headless = os.getenv('EYERCLOUD_HEADLESS', '') not in ('', '0', 'false')
+    browser = await playwright.chromium.launch(headless=headless)
+    if auth_file and Path(auth_file).exists():
+        context = await browser.new_context(storage_state=str(auth_file), **context_options)
+        print(f"Using saved auth session ({auth_file})")
+    else:
+        context = await browser.new_context(**context_options)
+    if block_resources:
+        await context.route("**/*", _block_non_essential)
+    page = await context.new_page()
+    return browser, context, page
+
+
+async def login_eyercloud(page, email, password, auth_file=None, manual_timeout=MANUAL_LOGIN_TIMEOUT):
+    """Make sure the page is logged in; saves storage_state to auth_file. Returns True on success.
+
+    Uses the saved session if it is still valid, then the credentials, then
+    waits for a manual login in the browser (until the URL reaches /exam).
+    The saved session is checked with auth_probe (one API call, cached until
+    the cookies expire) before any page is loaded.
+    """
+    if auth_file:
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(None, probe_auth, auth_file):
+            print("Saved session is valid (auth probe).")
+            await page.goto(f"{BASE_URL}/exam", timeout=60000, wait_until="domcontentloaded")
+            return True
+
+    print(f"Navigating to {BASE_URL}...")
+    await page.goto(f"{BASE_URL}/exam", timeout=60000, wait_until="domcontentloaded")
+    try:
+        handle = await page.wait_for_function(_LANDING_JS, timeout=30000, polling=250)
+        landing = await handle.json_value()
+    except Exception:
+        landing = 'login' if '/login' in page.url else None
+
+    if landing == 'app':
+        print("Already logged in!")
+    else:
+        logged_in = False
+        if email and password:
+            print(f"Logging in as {email}...")
+            try:
+                await page.get_by_placeholder("Email").fill(email)
+                pw_field = page.get_by_placeholder("Senha")
+                await pw_field.fill(password)
+                await pw_field.press("Enter")
+                await page.wait_for_url("**/exam**", timeout=15000)
+                print("Login successful!")
+                logged_in = True
+            except Exception as e:
+                print(f"Auto-login failed: {e}")
+        if not logged_in:
+            print(f"Please login manually in the browser (waiting up to {manual_timeout}s)...")
+            try:
+                await page.wait_for_url(re.compile(r".*/(exam|patient).*"), timeout=manual_timeout * 1000)
+                print("Manual login detected!")
+            except Exception:
+                return False
+
+    if auth_file:
+        await page.context.storage_state(path=str(auth_file))
+        invalidate(auth_file)
+    return True
+
+
+async def wait_for_sails_socket(page, timeout=30):
+    """Wait until the Sails.js WebSocket is connected (polled in the page, no sleeps)."""
+    print("Waiting for Sails WebSocket...", end=' ')
+    try:
+        await page.wait_for_function(_SOCKET_CONNECTED_JS, timeout=timeout * 1000, polling=250)
+    except Exception:
+        print("TIMEOUT!")
+        return False
+    print("connected!")
+    return True
+
+
+async def open_exam_page(page, timeout=30):
+    """Go to /exam (if not already there) and wait for the socket. Returns True when ready."""
+    if '/exam' not in page.url:
+        await page.goto(f"{BASE_URL}/exam", timeout=60000, wait_until="domcontentloaded")
+    return await wait_for_sails_socket(page, timeout)
+
+
+if __name__ == "__main__":
+    # Quick check of the saved session: time until the socket is connected
+    import sys
+    import time
+    from playwright.async_api import async_playwright
+
+    async def _main():
+        email = sys.argv[1] if len(sys.argv) > 1 else None
+        auth_file = auth_file_for(email)
+        started = time.perf_counter()
+        async with async_playwright() as p:
+            browser, context, page = await open_browser(p, auth_file)
+            ok = await login_eyercloud(page, email, None, auth_file) and await open_exam_page(page)
+            print(f"{'Ready' if ok else 'Not ready'} in {time.perf_counter() - started:.1f}s")
+            await browser.close()
+
+    asyncio.run(_main())
@@ -0,0 +1,172 @@
+"""
+Storage backends for Bytescale uploads and folder listings.
+============================================================
+Shared by the reconciliation, pipeline and upload scripts so they all talk to
+Bytescale (or a stand-in) through the same two calls:
+
+    backend.list_folder(folder_path, cursor=None) -> (items, next_cursor)
+    backend.upload(filepath, folder_path, filename) -> {'filePath', 'fileUrl'} | None
+
+Items are dicts: {'type': 'File'|'Folder', 'path': '/neuroapp/...', 'size': int}.
+
+Backends:
+    BytescaleBackend  -- real API (or a local stand-in via BYTESCALE_API_BASE);
+                         the key comes from BYTESCALE_API_KEY
+    LocalDirBackend   -- a local directory mirrors the remote tree (tests/offline)
+
+Usage:
+    from bytescale_backend import get_backend
+    backend = get_backend()                        # Bytescale
+    backend = get_backend('local:/tmp/fake_cdn')   # local directory
+"""
+
+import os
+import shutil
+import threading
+import mimetypes
+from pathlib import Path
+
+# --- BYTESCALE CONFIG ---
+API_KEY = os.getenv('BYTESCALE_API_KEY')  # secret_... key; never committed here
+ACCOUNT_ID = os.getenv('BYTESCALE_ACCOUNT_ID', "W142icY")
+API_BASE = os.getenv('BYTESCALE_API_BASE', "https://api.bytescale.com")
+CDN_BASE_URL = os.getenv('BYTESCALE_CDN_BASE', f"https://upcdn.io/{ACCOUNT_ID}/raw")
+
+LIST_PAGE_SIZE = 100
+
+
+def get_mime_type(filepath):
+    mime_type, _ = mimetypes.guess_type(str(filepath))
+    return mime_type or 'application/octet-stream'
+
+
+class BytescaleBackend:
+    """Bytescale REST API. One requests.Session per thread."""
+
+    def __init__(self, api_key=API_KEY, account_id=ACCOUNT_ID, api_base=API_BASE,
+                 cdn_base=CDN_BASE_URL, timeout=60):
+        if not api_key:
+            raise ValueError("BYTESCALE_API_KEY is not set: export the secret_... key of the "
+                             "Bytescale account (any value works against bytescale_standin.py)")
+        self.api_key = api_key
+        self.account_id = account_id
+        self.api_base = api_base.rstrip('/')
+        self.cdn_base = cdn_base.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def upload_url(self):
+        return f"{self.api_base}/v2/accounts/{self.account_id}/uploads/binary"
+
+    @property
+    def list_url(self):
+        return f"{self.api_base}/v2/accounts/{self.account_id}/folders/list"
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            import requests
+            session = requests.Session()
+            session.headers['Authorization'] = f'Bearer {self.api_key}'
+            self._local.session = session
+        return session
+
+    def file_url(self, file_path):
+        return f"{self.cdn_base}{file_path}"
+
+    def list_folder(self, folder_path, cursor=None):
+        """Fetch one page of a folder listing (non-recursive)."""
+        params = {'folderPath': folder_path, 'limit': LIST_PAGE_SIZE}
+        if cursor:
+            params['cursor'] = cursor
+        resp = self._session().get(self.list_url, params=params, timeout=self.timeout)
+        resp.raise_for_status()
+        body = resp.json()
+
+        items = []
+        for item in body.get('items', []):
+            if item.get('type') == 'Folder':
+                items.append({'type': 'Folder', 'path': item.get('folderPath', ''), 'size': 0})
+            else:
+                items.append({'type': 'File', 'path': item.get('filePath', ''), 'size': item.get('size', 0)})
+
+        next_cursor = None if body.get('isPaginationComplete', True) else body.get('cursor')
+        return items, next_cursor
+
+    def upload(self, filepath, folder_path, filename):
+        """Upload a single file. Returns response JSON or None."""
+        params = {'folderPath': folder_path, 'fileName': filename}
+        with open(filepath, 'rb') as f:
+            file_data = f.read()
+        headers = {
+            'Content-Type': get_mime_type(filepath),
+            'Content-Length': str(len(file_data)),
+        }
+        try:
+            resp = self._session().post(self.upload_url, params=params, headers=headers,
+                                        data=file_data, timeout=self.timeout)
+            if resp.status_code in (200, 201):
+                return resp.json()
+            print(f"      FAIL HTTP {resp.status_code}: {resp.text[:200]}")
+            return None
+        except Exception as e:
+            print(f"      FAIL upload error: {e}")
+            return None
+
+
+class LocalDirBackend:
+    """A local directory standing in for the Bytescale file tree.
+
+    '/neuroapp/patients/X/Y.jpg' lives at '<root>/neuroapp/patients/X/Y.jpg'.
+    Listings are paginated with an integer cursor so callers exercise the
+    same paging loop as against the real API.
+    """
+
+    def __init__(self, root, page_size=LIST_PAGE_SIZE, cdn_base=None):
+        self.root = Path(root)
+        self.page_size = page_size
+        self.cdn_base = (cdn_base or self.root.resolve().as_uri()).rstrip('/')
+
+    def _local_path(self, remote_path):
+        return self.root / remote_path.lstrip('/')
+
+    def file_url(self, file_path):
+        return f"{self.cdn_base}{file_path}"
+
+    def list_folder(self, folder_path, cursor=None):
+        folder = self._local_path(folder_path)
+        if not folder.is_dir():
+            return [], None
+        entries = sorted(folder.iterdir(), key=lambda p: p.name)
+        start = int(cursor or 0)
+        page = entries[start:start + self.page_size]
+
+        base = '/' + folder_path.strip('/')
+        items = []
+        for entry in page:
+            remote = f"{base}/{entry.name}"
+            if entry.is_dir():
+                items.append({'type': 'Folder', 'path': remote, 'size': 0})
+            else:
+                items.append({'type': 'File', 'path': remote, 'size': entry.stat().st_size})
+
+        end = start + len(page)
+        return items, (str(end) if end < len(entries) else None)
+
+    def upload(self, filepath, folder_path, filename):
+        remote = f"/{folder_path.strip('/')}/{filename}"
+        target = self._local_path(remote)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(filepath, target)
+        return {'filePath': remote, 'fileUrl': self.file_url(remote)}
+
+
+def get_backend(spec=None):
+    """'bytescale' (default) or 'local:<dir>'."""
+    spec = spec or os.getenv('BYTESCALE_BACKEND', 'bytescale')
+    if spec.startswith('local:'):
+        return LocalDirBackend(spec[len('local:'):])
+    if spec == 'bytescale':
+        return BytescaleBackend()
+    raise ValueError(f"Unknown backend: {spec!r} (use 'bytescale' or 'local:<dir>')")
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Bytescale upload API.
+============================================
+Implements just enough of the Bytescale contract to exercise the uploaders
+without touching the real account:
+
+    POST /v2/accounts/{id}/uploads/binary?folderPath=...&fileName=...
+         -> {accountId, filePath, fileUrl, etag, size}
+    GET  /v2/accounts/{id}/folders/list?folderPath=...&cursor=...
+         -> {items, cursor, isPaginationComplete}   (only with --store)
+    GET  /raw/<filePath>                              (only with --store)
+
+Knobs for benchmarking and failure testing:
+    --latency-ms     fixed delay added to every request
+    --jitter-ms      extra uniform random delay
+    --bandwidth-mbps shared ingress cap for all uploads (token bucket)
+    --error-rate     fraction of uploads answered with --error-status
+
+Usage:
+    cd scripts/eyercloud_downloader
+    python bytescale_standin.py --port 8765 --latency-ms 80 --bandwidth-mbps 50
+    python bytescale_standin.py --port 8765 --store /tmp/fake_bytescale --error-rate 0.02
+
+    # then point anything built on bytescale_backend at it
+    BYTESCALE_API_KEY=standin BYTESCALE_API_BASE=http://127.0.0.1:8765 python ingest_pipeline.py --email ... --password ...
+    BYTESCALE_API_KEY=standin BYTESCALE_API_BASE=http://127.0.0.1:8765 python reconcile_bytescale.py --dry-run
+"""
+
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from bytescale_backend import LocalDirBackend
+
+UPLOAD_RE = re.compile(r'^/v2/accounts/([^/]+)/uploads/binary$')
+LIST_RE = re.compile(r'^/v2/accounts/([^/]+)/folders/list$')
+
+
+class StandinConfig:
+    def __init__(self, latency_ms=0, jitter_ms=0, bandwidth_mbps=0, error_rate=0.0,
+                 error_status=503, store=None, seed=None):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.bandwidth = bandwidth_mbps * 1024 * 1024 / 8  # bytes/s, 0 = unlimited
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.store = LocalDirBackend(store) if store else None
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._link_free_at = 0.0
+        self.counters = {'uploads': 0, 'errors': 0, 'bytes': 0}
+
+    def delay(self):
+        with self._lock:
+            extra = self.random.uniform(0, self.jitter) if self.jitter else 0
+        if self.latency or extra:
+            time.sleep(self.latency + extra)
+
+    def throttle(self, nbytes):
+        """Serialize transfer time on a shared link of `bandwidth` bytes/s."""
+        if not self.bandwidth:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._link_free_at)
+            self._link_free_at = start + nbytes / self.bandwidth
+            wait = self._link_free_at - now
+        time.sleep(wait)
+
+    def should_fail(self):
+        with self._lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    server_version = "BytescaleStandin/1.0"
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; with Nagle on, the body waits
+    # for the client's delayed ACK (~40 ms on every keep-alive request)
+    disable_nagle_algorithm = True
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self):
+        return self.headers.get('Authorization', '').startswith('Bearer ')
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        match = UPLOAD_RE.match(url.path)
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+
+        if not match:
+            return self._send_json(404, {'error': {'code': 'not_found', 'message': url.path}})
+        if not self._authorized():
+            return self._send_json(401, {'error': {'code': 'unauthorized'}})
+
+        config = self.config
+        config.delay()
+        config.throttle(len(body))
+        if config.should_fail():
+            with config._lock:
+                config.counters['errors'] += 1
+            return self._send_json(config.error_status, {'error': {'code': 'injected_error'}})
+
+        account_id = match.group(1)
+        params = parse_qs(url.query)
+        folder = '/' + params.get('folderPath', [''])[0].strip('/')
+        filename = params.get('fileName', [hashlib.md5(body).hexdigest()])[0]
+        file_path = f"{folder.rstrip('/')}/{filename}"
+
+        if config.store is not None:
+            target = config.store.root / file_path.lstrip('/')
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(body)
+
+        with config._lock:
+            config.counters['uploads'] += 1
+            config.counters['bytes'] += len(body)
+
+        host = self.headers.get('Host', 'localhost')
+        self._send_json(200, {
+            'accountId': account_id,
+            'filePath': file_path,
+            'fileUrl': f"http://{host}/raw{file_path}",
+            'etag': hashlib.md5(body).hexdigest(),
+            'size': len(body),
+        })
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        config = self.config
+        if config.store is None:
+            return self._send_json(404, {'error': {'code': 'no_store'}})
+
+        if LIST_RE.match(url.path):
+            if not self._authorized():
+                return self._send_json(401, {'error': {'code': 'unauthorized'}})
+            config.delay()
+            params = parse_qs(url.query)
+            folder = params.get('folderPath', ['/'])[0]
+            cursor = params.get('cursor', [None])[0]
+            items, next_cursor = config.store.list_folder(folder, cursor)
+            return self._send_json(200, {
+                'folder': {'folderPath': folder},
+                'items': [
+                    {'type': 'Folder', 'folderPath': i['path']} if i['type'] == 'Folder'
+                    else {'type': 'File', 'filePath': i['path'], 'size': i['size']}
+                    for i in items
+                ],
+                'cursor': next_cursor,
+                'isPaginationComplete': next_cursor is None,
+            })
+
+        if url.path.startswith('/raw/'):
+            target = config.store.root / url.path[len('/raw/'):]
+            if not target.is_file():
+                return self._send_json(404, {'error': {'code': 'file_not_found'}})
+            data = target.read_bytes()
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        self._send_json(404, {'error': {'code': 'not_found', 'message': url.path}})
+
+
+def start_standin(host='127.0.0.1', port=0, verbose=False, **config):
+    """Start the stand-in in a background thread. Returns (server, base_url)."""
+    server = ThreadingHTTPServer((host, port), StandinHandler)
+    server.daemon_threads = True
+    server.config = StandinConfig(**config)
+    server.verbose = verbose
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local Bytescale upload API stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--bandwidth-mbps', type=float, default=0, help='Shared ingress cap (0 = unlimited)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of uploads that fail')
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--store', default=None, help='Keep uploaded files here (enables listing and /raw)')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--verbose', action='store_true', help='Log every request')
+    args = parser.parse_args()
+
+    if args.store:
+        Path(args.store).mkdir(parents=True, exist_ok=True)
+
+    server, base_url = start_standin(
+        args.host, args.port, args.verbose,
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, bandwidth_mbps=args.bandwidth_mbps,
+        error_rate=args.error_rate, error_status=args.error_status, store=args.store, seed=args.seed,
+    )
+    print("=" * 65)
+    print("  Bytescale stand-in")
+    print(f"  Listening: {base_url}")
+    print(f"  Latency:   {args.latency_ms} ms (+{args.jitter_ms} ms jitter)")
+    print(f"  Bandwidth: {args.bandwidth_mbps or 'unlimited'} Mbps")
+    print(f"  Errors:    {args.error_rate:.1%} -> HTTP {args.error_status}")
+    print(f"  Store:     {args.store or '(discard)'}")
+    print("=" * 65)
+    print(f"\n  BYTESCALE_API_KEY=standin BYTESCALE_API_BASE={base_url}\n")
+    try:
+        while True:
+            time.sleep(10)
+            c = server.config.counters
+            print(f"  uploads {c['uploads']}  errors {c['errors']}  {c['bytes'] / (1024 * 1024):.1f} MB")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Local completeness precheck before calling /examData/list.
+==========================================================
+On re-runs the downloaders used to call /examData/list for every exam not
+marked as downloaded, even when the exam's image list is already in the
+state file and every image is on disk. This precheck compares the known
+UUID list against the local inventory first; only exams with missing or
+unknown images go to the API.
+
+An exam is "provably complete" when:
+    - the state has its UUID list (image_list / image_details), and
+    - that list is not shorter than expected_images, and
+    - every listed image exists in its folder and is > MIN_IMAGE_BYTES.
+
+Usage:
+    cd scripts/eyercloud_downloader
+    python completeness.py                                # download_state.json + downloads/
+    python completeness.py --state staging_download_state_x.json --downloads downloads_staging/x
+    python completeness.py --mark                         # add complete exams to downloaded_exams
+
+From other scripts:
+    from completeness import LocalInventory, exam_is_complete
+    inventory = LocalInventory(DOWNLOAD_DIR)
+    if exam_is_complete(details, inventory):
+        ...skip the API call...
+"""
+
+import os
+import json
+import argparse
+from pathlib import Path
+
+MIN_IMAGE_BYTES = 1000
+
+
+class LocalInventory:
+    """Lazy {folder: {filename: size}} over a downloads directory (one scandir per folder)."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self._folders = {}
+
+    def files(self, folder_name):
+        if folder_name not in self._folders:
+            entries = {}
+            try:
+                with os.scandir(self.root / folder_name) as it:
+                    for entry in it:
+                        if entry.is_file():
+                            entries[entry.name] = entry.stat().st_size
+            except OSError:
+                pass
+            self._folders[folder_name] = entries
+        return self._folders[folder_name]
+
+    def forget(self, folder_name):
+        """Drop the cached listing after files were written to the folder."""
+        self._folders.pop(folder_name, None)
+
+
+def known_images(details, useful_types=None):
+    """UUIDs the state knows for an exam, optionally restricted to some types."""
+    images = details.get('image_list') or details.get('image_details') or []
+    return [
+        img['uuid'] for img in images
+        if isinstance(img, dict) and img.get('uuid')
+        and (useful_types is None or img.get('type') in useful_types)
+    ]
+
+
+def exam_is_complete(details, inventory, useful_types=None, folder_name=None):
+    """True if every known image of the exam is on disk (see module docstring)."""
+    if not details:
+        return False
+    uuids = known_images(details, useful_types)
+    if not uuids:
+        return False
+    expected = details.get('expected_images')
+    if isinstance(expected, int) and len(uuids) < expected:
+        return False
+    folder_name = folder_name or details.get('folder_name')
+    if not folder_name:
+        return False
+    files = inventory.files(folder_name)
+    return all(files.get(f"{uuid}.jpg", 0) > MIN_IMAGE_BYTES for uuid in uuids)
+
+
+def precheck(exam_ids, state, inventory, useful_types=None):
+    """Split exam ids into (complete, to_fetch) using only local data."""
+    details_by_id = state.get('exam_details', {})
+    complete, to_fetch = [], []
+    for exam_id in exam_ids:
+        if exam_is_complete(details_by_id.get(exam_id), inventory, useful_types):
+            complete.append(exam_id)
+        else:
+            to_fetch.append(exam_id)
+    return complete, to_fetch
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find exams already complete on disk (no API calls)')
+    parser.add_argument('--state', default='download_state.json')
+    parser.add_argument('--downloads', default='downloads')
+    parser.add_argument('--useful-only', action='store_true', help='Only require COLOR and ANTERIOR images')
+    parser.add_argument('--mark', action='store_true', help='Add complete exams to downloaded_exams')
+    args = parser.parse_args()
+
+    with open(args.state, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    useful_types = ('COLOR', 'ANTERIOR') if args.useful_only else None
+    inventory = LocalInventory(args.downloads)
+
+    downloaded = set(state.get('downloaded_exams', []))
+    candidates = [eid for eid in state.get('exam_details', {}) if eid not in downloaded]
+    complete, to_fetch = precheck(candidates, state, inventory, useful_types)
+
+    print(f"Exams in state:            {len(state.get('exam_details', {}))}")
+    print(f"Marked downloaded:         {len(downloaded)}")
+    print(f"Not marked, complete:      {len(complete)}  (no API call needed)")
+    print(f"Not marked, need the API:  {len(to_fetch)}")
+
+    if args.mark and complete:
+        state.setdefault('downloaded_exams', []).extend(complete)
+        with open(args.state, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=4, ensure_ascii=False)
+        print(f"Marked {len(complete)} exams as downloaded in {args.state}")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,8 @@ import re
 from pathlib import Path
 from datetime import datetime
 
+from completeness import LocalInventory, precheck
+
 try:
     from playwright.async_api import async_playwright
 except ImportError:
@@ -59,6 +61,13 @@ async def main():
     already_done = [eid for eid in exam_ids if eid in state.get('downloaded_exams', [])]
     to_download = [eid for eid in exam_ids if eid not in state.get('downloaded_exams', [])]
     print(f"Already downloaded: {already_done}")
+
+    # Exams whose known COLOR/ANTERIOR images are all on disk need no examData/list call
+    complete, to_download = precheck(to_download, state, LocalInventory(DOWNLOAD_DIR), ('COLOR', 'ANTERIOR'))
+    if complete:
+        state['downloaded_exams'].extend(complete)
+        save_state(state)
+        print(f"Complete on disk (no API call): {len(complete)}")
     print(f"To download: {len(to_download)}")
 
     if not to_download:
@@ -10,6 +10,8 @@ import requests
 from pathlib import Path
 from playwright.async_api import async_playwright
 
+from browser_bootstrap import login_eyercloud
+
 MISSING_FILE = Path('../missing_images.json')
 BASE_URL = 'https://eyercloud.com'
 AUTH_STATE_FILE = Path('auth_state.json')
@@ -144,23 +146,11 @@ async def main():
 
         page = await context.new_page()
 
-        # Open EyerCloud main page
-        print('Opening EyerCloud...')
-        await page.goto('https://ec2.eyercloud.com', timeout=60000)
-
-        print('\n' + '=' * 60)
-        print('  FACA LOGIN NO NAVEGADOR (se necessario)')
-        print('  Aguardando 20 segundos...')
-        print('=' * 60 + '\n')
-
-        for i in range(20, 0, -1):
-            print(f'  Aguardando... {i}s', end='\r')
-            await asyncio.sleep(1)
-        print('  Tempo esgotado! Continuando...     ')
-
-        # Save session
-        await context.storage_state(path=str(AUTH_STATE_FILE))
-        print('\nSession saved!\n')
+        # Saved session is checked with one API call; the browser login only runs if it fails
+        if not await login_eyercloud(page, None, None, AUTH_STATE_FILE):
+            print('FATAL: Could not login.')
+            await browser.close()
+            return
 
         # Download images for each exam
         total_downloaded = 0
@@ -26,11 +26,8 @@ Output:
 """
 
 import asyncio
-import json
-import os
-import re
 import sys
-import unicodedata
+import time
 import argparse
 from pathlib import Path
 from datetime import datetime
@@ -47,98 +44,30 @@ except ImportError:
     print("pip install requests")
     sys.exit(1)
 
+from etl_common import (
+    sanitize_email, normalize_name, safe_folder_name, load_json, save_json,
+    useful_images as select_useful_images, exam_details_record, tracked_images,
+)
+from browser_batch import iter_exam_data, DEFAULT_CONCURRENCY, DEFAULT_CHUNK_SIZE
+from browser_bootstrap import (
+    open_browser, login_eyercloud, wait_for_sails_socket, open_exam_page, auth_file_for, BASE_URL,
+)
+from auth_probe import API_BASE
+from exam_feed import ExamFeed, inventory_from_exams, print_change
+from telemetry import Metrics, host_of
+from profiling import profile_main
+
 # --- Config ---
-BASE_URL = "https://ec2.eyercloud.com"
-PATIENT_API = "https://eyercloud.com/api/v2/eyercloud/patient/list"
 PAGE_SIZE = 20
 
 
-def sanitize_email(email):
-    return re.sub(r'[^a-zA-Z0-9]', '_', email.split('@')[0])
-
-
-def normalize_name(name):
-    if not name:
-        return ''
-    name = name.upper().strip()
-    name = unicodedata.normalize('NFD', name)
-    name = ''.join(c for c in name if unicodedata.category(c) != 'Mn')
-    name = ' '.join(name.split())
-    return name
-
-
-def safe_folder_name(patient_name, exam_id):
-    safe = re.sub(r'[<>:"/\\|?*]', '_', patient_name).replace(' ', '_')
-    return f"{safe}_{exam_id[:8]}"
-
-
-def load_json(path):
-    if path.exists():
-        return json.loads(path.read_text(encoding='utf-8'))
-    return None
-
-
-def save_json(data, path):
-    path.write_text(
-        json.dumps(data, indent=2, ensure_ascii=False, default=str),
-        encoding='utf-8'
-    )
-
-
-async def login_eyercloud(page, email, password, auth_file):
-    """Login to EyerCloud. Returns True if successful."""
-    print(f"Navigating to {BASE_URL}...")
-    await page.goto(BASE_URL, timeout=60000)
-    await asyncio.sleep(2)
-
-    if '/exam' in page.url:
-        print("Already logged in!")
-        return True
-
-    print(f"Logging in as {email}...")
-    try:
-        await page.get_by_placeholder("Email").fill(email)
-        pw_field = page.get_by_placeholder("Senha")
-        await pw_field.fill(password)
-        await pw_field.press("Enter")
-        await page.wait_for_url("**/exam**", timeout=15000)
-        print("Login successful!")
-        return True
-    except Exception as e:
-        print(f"Auto-login failed: {e}")
-        print("Please login manually in the browser...")
-        print("Press ENTER here after login.")
-        await asyncio.get_event_loop().run_in_executor(None, input, ">>> ")
-        if '/exam' in page.url or '/patient' in page.url:
-            print("Manual login detected!")
-            return True
-        return False
-
-
-async def wait_for_sails_socket(page, timeout=30):
-    """Wait until Sails.js WebSocket is connected."""
-    print("Waiting for Sails WebSocket...", end=' ')
-    for _ in range(timeout):
-        connected = await page.evaluate("""
-            () => {
-                try {
-                    const app = document.querySelector('#app')?.__vue_app__;
-                    if (!app) return false;
-                    return app.config.globalProperties.$io?.socket?.isConnected() || false;
-                } catch(e) { return false; }
-            }
-        """)
-        if connected:
-            print("connected!")
-            return True
-        await asyncio.sleep(1)
-    print("TIMEOUT!")
-    return False
-
-
-async def fetch_all_exam_ids_via_socket(page):
+async def fetch_all_exam_ids_via_socket(page, known_ids=None):
     """Fetch ALL exam IDs + basic info via Sails WebSocket pagination.
-    Returns list of {id, patient_name, patient_id, image_count}."""
+    Returns list of {id, patient_name, patient_id, image_count}.
+
+    The socket returns the newest exams first, so with known_ids the listing
+    stops at the first page where every exam is already known.
+    """
     print("\n=== Phase 1: Fetching exam list via Sails WebSocket ===")
 
     all_exams = []
@@ -244,6 +173,10 @@ async def fetch_all_exam_ids_via_socket(page):
             if len(exams) < PAGE_SIZE:
                 break
 
+            if known_ids is not None and all(exam.get('id') in known_ids for exam in exams):
+                print("  Caught up with known exams - stopping listing")
+                break
+
             page_num += 1
             await asyncio.sleep(0.3)
 
@@ -255,38 +188,121 @@ async def fetch_all_exam_ids_via_socket(page):
     return all_exams, total_count or 0
 
 
-async def fetch_exam_images(page, exam_id):
-    """Fetch image details for a specific exam via /examData/list API."""
-    try:
-        result = await page.evaluate('''async (examId) => {
-            const resp = await fetch(
-                `https://eyercloud.com/api/v2/eyercloud/examData/list?id=${examId}`,
-                { credentials: "include" }
-            );
-            return await resp.json();
-        }''', exam_id)
-        return result
-    except Exception as e:
-        print(f"    ERROR fetching exam details: {e}")
-        return {'examDataList': []}
+def record_staging_metadata(staging_state, all_exams):
+    """Fold socket exam records into staging_state (patients, exams, exam_images)."""
+    for exam in all_exams:
+        eid = exam.get('id', '')
+        if not eid:
+            continue
+
+        # Patient
+        pat = exam.get('patient', {}) or {}
+        full_name = pat.get('fullName', '') or ''
+        if not full_name:
+            full_name = f"{pat.get('firstName', '')} {pat.get('lastName', '')}".strip()
+
+        pid = pat.get('id', '')
+        anamnesis = pat.get('anamnesis', {}) or {}
+
+        if pid and pid not in staging_state['patients']:
+            staging_state['patients'][pid] = {
+                'id': pid,
+                'rawName': full_name,
+                'normalizedName': normalize_name(full_name),
+                'cpf': pat.get('cpf', ''),
+                'gender': pat.get('gender', ''),
+                'birthday': pat.get('birthday', ''),
+                'phone': pat.get('phone', ''),
+                'prontuario': pat.get('mrn', ''),
+                'anamnesis': anamnesis,
+                'otherDisease': pat.get('otherDisease', ''),
+                'underlyingDiseases': {
+                    'diabetes': anamnesis.get('diabetes', False),
+                    'hypertension': anamnesis.get('hipertensaoArterial', False) or anamnesis.get('hypertension', False),
+                    'cholesterol': anamnesis.get('hipercolesterolemia', False) or anamnesis.get('cholesterol', False),
+                    'smoker': anamnesis.get('tabagismo', False) or anamnesis.get('smoker', False),
+                },
+                'ophthalmicDiseases': {
+                    'cataract': anamnesis.get('catarata', False) or anamnesis.get('cataract', False),
+                    'glaucoma': anamnesis.get('glaucoma', False),
+                    'diabeticRetinopathy': anamnesis.get('retinopatia', False) or anamnesis.get('diabeticRetinopathy', False),
+                    'pterygium': anamnesis.get('pterygium', False),
+                    'dmri': anamnesis.get('dmri', False),
+                    'lowVisualAcuity': anamnesis.get('lowVisualAcuity', False),
+                },
+            }
 
+        # Exam
+        staging_state['exams'][eid] = {
+            'id': eid,
+            'patientName': full_name,
+            'patientId': pid,
+            'examDate': exam.get('date', ''),
+            'clinicName': exam.get('clinicName', ''),
+            'clinicId': exam.get('clinicId', ''),
+            'technicianName': exam.get('technicianName', ''),
+            'status': exam.get('status', ''),
+        }
 
-def download_image(url, filepath, cookies, headers):
-    """Download a single image. Returns (success, size)."""
+        # Images (filter REDFREE from socket data; same filter as the exam feed)
+        images = []
+        for img in tracked_images(exam.get('examImages')):
+            images.append({
+                'uuid': img.get('uuid', ''),
+                'type': (img.get('type') or 'UNKNOWN').upper(),
+                'laterality': img.get('laterality', ''),
+                'url': '',
+                'parentsUUID': img.get('parentsUUID', ''),
+            })
+        staging_state['exam_images'][eid] = images
+
+
+def exams_from_staging_state(staging_state):
+    """Reconstruct the socket exam list from a saved staging state."""
+    all_exams = []
+    for eid, exam_data in staging_state['exams'].items():
+        all_exams.append({
+            'id': eid,
+            'patient': {
+                'fullName': exam_data.get('patientName', ''),
+                'id': exam_data.get('patientId', ''),
+            },
+            'date': exam_data.get('examDate', ''),
+            'clinicName': exam_data.get('clinicName', ''),
+            'examImages': staging_state.get('exam_images', {}).get(eid, []),
+        })
+    return all_exams
+
+
+def download_image(url, filepath, cookies, headers, metrics=None):
+    """Download a single image. Returns (success, size).
+
+    With a telemetry.Metrics, the GET is recorded as 'cdn' and the write as 'disk'.
+    """
     if filepath.exists():
         size = filepath.stat().st_size
         if size > 1000:
             return True, size
 
+    started = time.perf_counter()
     try:
         resp = requests.get(url, cookies=cookies, headers=headers, timeout=60)
-        if resp.status_code == 200 and len(resp.content) > 1000:
+        # CloudFront error pages come back as HTML; only keep real JPEG bodies
+        ok = resp.status_code == 200 and len(resp.content) > 1000 and resp.content[:2] == b'\xff\xd8'
+        if metrics is not None:
+            metrics.observe('cdn', time.perf_counter() - started, host_of(url), len(resp.content), ok)
+        if ok:
+            written_at = time.perf_counter()
             filepath.parent.mkdir(parents=True, exist_ok=True)
             with open(filepath, 'wb') as f:
                 f.write(resp.content)
+            if metrics is not None:
+                metrics.observe('disk', time.perf_counter() - written_at, nbytes=len(resp.content))
             return True, len(resp.content)
         return False, 0
     except Exception as e:
+        if metrics is not None:
+            metrics.observe('cdn', time.perf_counter() - started, host_of(url), ok=False)
         print(f"    DL ERROR: {e}")
         return False, 0
 
@@ -302,13 +318,23 @@ async def main():
                         help='Start downloading from exam index N (0-based)')
     parser.add_argument('--max-exams', type=int, default=0,
                         help='Download at most N exams (0=all)')
+    parser.add_argument('--changes-only', action='store_true',
+                        help='Only process exams added/modified in the exam feed since the last download run')
+    parser.add_argument('--fetch-concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'/examData/list requests in flight inside the browser (default: {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--fetch-chunk', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f'Exams per page.evaluate call (default: {DEFAULT_CHUNK_SIZE})')
+    parser.add_argument('--no-metrics', action='store_true',
+                        help='Do not write the telemetry timeline/textfile under metrics/')
     args = parser.parse_args()
 
     email_safe = sanitize_email(args.email)
-    auth_file = Path(f"auth_state_{email_safe}.json")
+    auth_file = auth_file_for(args.email)
     staging_state_file = Path(f"staging_state_{email_safe}.json")
     dl_state_file = Path(f"staging_download_state_{email_safe}.json")
     download_dir = Path("downloads_staging") / email_safe
+    feed = ExamFeed(args.email)
+    metrics = Metrics('download_staging_images', enabled=not args.no_metrics)
 
     print("=" * 60)
     print(f"  EyerCloud Staging Image Downloader")
@@ -336,138 +362,53 @@ async def main():
     }
 
     async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=False)
-
-        if auth_file.exists():
-            context = await browser.new_context(storage_state=str(auth_file))
-            print("Using saved auth session")
-        else:
-            context = await browser.new_context()
+        metrics.mark('login')
+        browser, context, page = await open_browser(p, auth_file)
 
-        page = await context.new_page()
-
-        # Login
-        logged_in = await login_eyercloud(page, args.email, args.password, auth_file)
+        # Login (saves auth state)
+        with metrics.timer('login', host=host_of(BASE_URL)) as op:
+            logged_in = await login_eyercloud(page, args.email, args.password, auth_file)
+            op['ok'] = logged_in
         if not logged_in:
             print("FATAL: Could not login.")
             await browser.close()
             sys.exit(1)
-
-        await context.storage_state(path=str(auth_file))
         print("Auth state saved.\n")
 
-        # Navigate and wait for socket
-        await page.goto(f"{BASE_URL}/exam", timeout=60000)
-        await asyncio.sleep(3)
-
-        if not await wait_for_sails_socket(page):
+        # Wait for socket
+        if not await open_exam_page(page):
             print("FATAL: Sails WebSocket not connected.")
             await browser.close()
             sys.exit(1)
 
         # ===== Phase 1: Get all exam IDs =====
+        metrics.mark('listing')
         # Check if we already have the exam list in staging state
         if args.resume and staging_state.get('exams') and len(staging_state['exams']) > 0:
             print(f"\nResuming with {len(staging_state['exams'])} exams from staging state")
-            # Reconstruct exam list from staging state
-            all_exams = []
-            for eid, exam_data in staging_state['exams'].items():
-                all_exams.append({
-                    'id': eid,
-                    'patient': {
-                        'fullName': exam_data.get('patientName', ''),
-                        'id': exam_data.get('patientId', ''),
-                    },
-                    'date': exam_data.get('examDate', ''),
-                    'clinicName': exam_data.get('clinicName', ''),
-                    'examImages': staging_state.get('exam_images', {}).get(eid, []),
-                })
+            all_exams = exams_from_staging_state(staging_state)
             total_count = len(all_exams)
         else:
-            all_exams, total_count = await fetch_all_exam_ids_via_socket(page)
+            with metrics.timer('listing', host=host_of(API_BASE)):
+                all_exams, total_count = await fetch_all_exam_ids_via_socket(page)
 
             # Save staging state (metadata) for future DB import
-            for exam in all_exams:
-                eid = exam.get('id', '')
-                if not eid:
-                    continue
-
-                # Patient
-                pat = exam.get('patient', {}) or {}
-                full_name = pat.get('fullName', '') or ''
-                if not full_name:
-                    full_name = f"{pat.get('firstName', '')} {pat.get('lastName', '')}".strip()
-
-                pid = pat.get('id', '')
-                anamnesis = pat.get('anamnesis', {}) or {}
-
-                if pid and pid not in staging_state['patients']:
-                    staging_state['patients'][pid] = {
-                        'id': pid,
-                        'rawName': full_name,
-                        'normalizedName': normalize_name(full_name),
-                        'cpf': pat.get('cpf', ''),
-                        'gender': pat.get('gender', ''),
-                        'birthday': pat.get('birthday', ''),
-                        'phone': pat.get('phone', ''),
-                        'prontuario': pat.get('mrn', ''),
-                        'anamnesis': anamnesis,
-                        'otherDisease': pat.get('otherDisease', ''),
-                        'underlyingDiseases': {
-                            'diabetes': anamnesis.get('diabetes', False),
-                            'hypertension': anamnesis.get('hipertensaoArterial', False) or anamnesis.get('hypertension', False),
-                            'cholesterol': anamnesis.get('hipercolesterolemia', False) or anamnesis.get('cholesterol', False),
-                            'smoker': anamnesis.get('tabagismo', False) or anamnesis.get('smoker', False),
-                        },
-                        'ophthalmicDiseases': {
-                            'cataract': anamnesis.get('catarata', False) or anamnesis.get('cataract', False),
-                            'glaucoma': anamnesis.get('glaucoma', False),
-                            'diabeticRetinopathy': anamnesis.get('retinopatia', False) or anamnesis.get('diabeticRetinopathy', False),
-                            'pterygium': anamnesis.get('pterygium', False),
-                            'dmri': anamnesis.get('dmri', False),
-                            'lowVisualAcuity': anamnesis.get('lowVisualAcuity', False),
-                        },
-                    }
-
-                # Exam
-                staging_state['exams'][eid] = {
-                    'id': eid,
-                    'patientName': full_name,
-                    'patientId': pid,
-                    'examDate': exam.get('date', ''),
-                    'clinicName': exam.get('clinicName', ''),
-                    'clinicId': exam.get('clinicId', ''),
-                    'technicianName': exam.get('technicianName', ''),
-                    'status': exam.get('status', ''),
-                }
-
-                # Images (filter REDFREE from socket data)
-                images = []
-                for img in exam.get('examImages', []):
-                    img_type = (img.get('type') or 'UNKNOWN').upper()
-                    if img_type == 'REDFREE':
-                        continue
-                    images.append({
-                        'uuid': img.get('uuid', ''),
-                        'type': img_type,
-                        'laterality': img.get('laterality', ''),
-                        'url': '',
-                        'parentsUUID': img.get('parentsUUID', ''),
-                    })
-                staging_state['exam_images'][eid] = images
-
+            record_staging_metadata(staging_state, all_exams)
             staging_state['fetched_at'] = datetime.now().isoformat()
             save_json(staging_state, staging_state_file)
             print(f"\nStaging state saved: {len(staging_state['patients'])} patients, {len(staging_state['exams'])} exams")
+            print_change(feed.update(inventory_from_exams(all_exams), source='download_staging_images'))
 
         if args.metadata_only:
             total_imgs = sum(len(imgs) for imgs in staging_state.get('exam_images', {}).values())
             print(f"\nMetadata-only mode. Total images (no REDFREE): {total_imgs}")
             print(f"State: {staging_state_file}")
             await browser.close()
+            metrics.close()
             return
 
         # ===== Phase 2: Download images =====
+        metrics.mark('downloads')
         print(f"\n=== Phase 2: Downloading images ===")
         print(f"Total exams: {len(all_exams)}")
         print(f"Already downloaded: {len(dl_state['downloaded_exams'])}")
@@ -477,7 +418,7 @@ async def main():
         cookies = {c['name']: c['value'] for c in cookies_list}
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)',
-            'Referer': 'https://ec2.eyercloud.com/',
+            'Referer': f'{BASE_URL}/',
         }
 
         download_dir.mkdir(parents=True, exist_ok=True)
@@ -486,6 +427,13 @@ async def main():
         pending_exams = [e for e in all_exams if e['id'] not in dl_state['downloaded_exams']]
         print(f"Pending: {len(pending_exams)} exams")
 
+        if args.changes_only and not feed.is_new('download'):
+            changed = feed.pending('download')
+            wanted = set(changed['added']) | set(changed['modified'])
+            # Modified exams get re-checked even if they were marked downloaded before
+            pending_exams = [e for e in all_exams if e['id'] in wanted]
+            print(f"Changes only (feed seq {changed['seq']}): {len(pending_exams)} added/modified exams")
+
         # Apply start/max filters
         if args.start_exam > 0:
             pending_exams = pending_exams[args.start_exam:]
@@ -499,21 +447,25 @@ async def main():
         total_failed = 0
         session_bytes = 0
 
-        for idx, exam in enumerate(pending_exams):
-            exam_id = exam['id']
+        # Exam details (dataPath + image UUIDs) are fetched in chunks inside the
+        # browser, ahead of the downloads below
+        pending_by_id = {e['id']: e for e in pending_exams}
+        details_iter = iter_exam_data(page, pending_by_id, concurrency=args.fetch_concurrency,
+                                      chunk_size=args.fetch_chunk, metrics=metrics)
+        idx = -1
+        async for exam_id, details in details_iter:
+            idx += 1
+            exam = pending_by_id[exam_id]
             patient = exam.get('patient', {}) or {}
             patient_name = patient.get('fullName', '') or 'Unknown'
 
-            print(f"\n[{idx+1}/{len(pending_exams)}] {patient_name} ({exam_id})")
-
-            # Fetch exam details via API to get dataPath and image UUIDs
-            details = await fetch_exam_images(page, exam_id)
+            print(f"\n[{idx+1}/{len(pending_by_id)}] {patient_name} ({exam_id})")
 
             image_list = details.get('examDataList', [])
             data_path = details.get('dataPath', 'https://d25chn8x2vrs37.cloudfront.net')
 
             # Filter: only COLOR and ANTERIOR
-            useful_images = [img for img in image_list if img.get('type') in ('COLOR', 'ANTERIOR')]
+            useful_images = select_useful_images(details)
             redfree_count = sum(1 for img in image_list if img.get('type') == 'REDFREE')
             total_count_img = len(image_list)
 
@@ -545,7 +497,7 @@ async def main():
                 # Yield to asyncio event loop before each blocking download
                 # to prevent Playwright context timeout
                 await asyncio.sleep(0)
-                ok, size = download_image(img_url, filepath, cookies, headers)
+                ok, size = download_image(img_url, filepath, cookies, headers, metrics)
                 if ok:
                     exam_dl += 1
                     total_dl += 1
@@ -560,17 +512,8 @@ async def main():
             print(f"  Result: {exam_dl}/{len(useful_images)} ({exam_existed} existed, {exam_dl - exam_existed} new)")
 
             # Save exam detail in download state
-            dl_state['exam_details'][exam_id] = {
-                'patient_name': patient_name,
-                'folder_name': folder,
-                'expected_images': len(useful_images),
-                'downloaded_images': exam_dl,
-                'download_date': datetime.now().isoformat(),
-                'image_details': [
-                    {'uuid': img['uuid'], 'type': img.get('type'), 'laterality': img.get('imageLaterality', '')}
-                    for img in useful_images
-                ],
-            }
+            dl_state['exam_details'][exam_id] = exam_details_record(patient_name, exam_id, useful_images)
+            dl_state['exam_details'][exam_id]['downloaded_images'] = exam_dl
 
             if exam_dl >= len(useful_images):
                 dl_state['downloaded_exams'].append(exam_id)
@@ -582,9 +525,6 @@ async def main():
             dl_state['stats']['total_bytes'] = dl_state['stats'].get('total_bytes', 0) + session_bytes
             save_json(dl_state, dl_state_file)
 
-            # Brief pause to not hammer the API
-            await asyncio.sleep(0.5)
-
             # Keepalive: ping the page to prevent Playwright context timeout
             try:
                 await page.evaluate("() => document.title")
@@ -600,8 +540,17 @@ async def main():
                 except:
                     pass
 
+        # Exams whose /examData/list fetch failed were never yielded (left pending)
+        details_failed = len(pending_by_id) - (idx + 1)
+        if details_failed:
+            print(f"\nExam details failed for {details_failed} exams; they stay pending for the next run")
+
         await browser.close()
 
+    # A complete, failure-free pass has consumed every feed change so far
+    if not args.start_exam and not args.max_exams and not total_failed and not details_failed:
+        feed.ack('download')
+
     # Final summary
     completed = len(dl_state['downloaded_exams'])
     total_exams = len(all_exams)
@@ -616,6 +565,7 @@ async def main():
     print(f"    New downloads:  {total_dl}")
     print(f"    Already existed:{total_skipped}")
     print(f"    Failed:         {total_failed}")
+    print(f"    Details failed: {details_failed}")
     print(f"    Bytes:          {session_bytes / (1024*1024):.1f} MB")
     print(f"  Files:")
     print(f"    Images:         {download_dir}")
@@ -623,10 +573,12 @@ async def main():
     print(f"    Staging state:  {staging_state_file}")
     print(f"{'=' * 60}")
 
+    metrics.close()
+
     if completed < total_exams:
         print(f"\nTo resume: python download_staging_images.py --email \"{args.email}\" --password \"xxx\" --resume")
     print(f"\nNext: python bytescale_uploader.py (after adapting for staging downloads)")
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    profile_main(main, 'download_staging_images')
@@ -1,5 +1,6 @@
 import os
 import asyncio
+import argparse
 import json
 import time
 from datetime import date
@@ -10,6 +11,10 @@ from playwright.async_api import async_playwright
 from tqdm.asyncio import tqdm
 from dotenv import load_dotenv
 
+from completeness import LocalInventory, exam_is_complete
+from telemetry import Metrics, host_of
+from profiling import profile_main
+
 # Load configuration
 load_dotenv()
 
@@ -18,11 +23,23 @@ EYERCLOUD_SENHA = os.getenv('EYERCLOUD_SENHA')
 EYERCLOUD_DOMAIN = os.getenv('EYERCLOUD_DOMAIN', 'https://eyercloud.com')
 DOWNLOAD_DIR = os.getenv('PASTA_DADOS', 'downloads')
 STATE_FILE = "download_state.json"
+CDN_BASE = os.getenv('EYERCLOUD_CDN_BASE', 'https://d25chn8x2vrs37.cloudfront.net')
 
 HEADERS_BASE = {
     'Accept': 'application/json, text/plain, */*',
 }
 
+# Clinics crawled at the same time, each on its own API session
+CLINIC_CONCURRENCY = 3
+# Images downloaded at the same time within one exam
+IMAGE_CONCURRENCY = 4
+
+# examData/list calls made vs. avoided by the local completeness precheck
+API_CALLS = {'fetched': 0, 'skipped': 0}
+# Replaced by an enabled Metrics in main() unless --no-metrics
+METRICS = Metrics('downloader', enabled=False)
+API_HOST = host_of(EYERCLOUD_DOMAIN)
+
 def load_state():
     if os.path.exists(STATE_FILE):
         with open(STATE_FILE, 'r') as f:
@@ -43,6 +60,24 @@ async def login(page):
     print('Login successful.')
     return page.request
 
+async def open_clinic_session(playwright, clinic_id):
+    """Separate API session selected on one clinic.
+
+    clinic/change is server-side session state, so clinics can only be crawled
+    concurrently if each one logs in on its own request context. Returns None
+    if the API login is refused.
+    """
+    request = await playwright.request.new_context(extra_http_headers=HEADERS_BASE)
+    response = await request.post(
+        f"{EYERCLOUD_DOMAIN}/api/v2/eyercloud/auth/login",
+        data={"email": EYERCLOUD_USUARIO, "password": EYERCLOUD_SENHA},
+    )
+    if not response.ok:
+        await request.dispose()
+        return None
+    await set_clinic(request, clinic_id)
+    return request
+
 async def get_clinics(request):
     response = await request.post(f"{EYERCLOUD_DOMAIN}/api/v2/eyercloud/clinic/list")
     data = await response.json()
@@ -58,12 +93,16 @@ async def fetch_exams(request, page_num=1):
         "statusFilter": "all",
         "page": str(page_num)
     }
-    response = await request.fetch(f"{EYERCLOUD_DOMAIN}/api/v2/eyercloud/exam/filter", method="post", data=payload)
-    return await response.json()
+    with METRICS.timer('listing', API_HOST) as op:
+        response = await request.fetch(f"{EYERCLOUD_DOMAIN}/api/v2/eyercloud/exam/filter", method="post", data=payload)
+        op['ok'] = response.ok
+        return await response.json()
 
 async def fetch_exam_details(request, exam_id):
-    response = await request.get(f"{EYERCLOUD_DOMAIN}/api/v2/eyercloud/examData/list", params={"id": exam_id})
-    return await response.json()
+    with METRICS.timer('details', API_HOST) as op:
+        response = await request.get(f"{EYERCLOUD_DOMAIN}/api/v2/eyercloud/examData/list", params={"id": exam_id})
+        op['ok'] = response.ok
+        return await response.json()
 
 async def get_cloudfront_base(page):
     # Wait for a thumbnail to appear to ensure data is loaded
@@ -77,24 +116,31 @@ async def get_cloudfront_base(page):
         return f"{parsed.scheme}://{parsed.netloc}"
     except Exception:
         # Fallback to a known CloudFront URL if detection fails
-        return "https://d25chn8x2vrs37.cloudfront.net"
+        return CDN_BASE
 
 async def download_image(request, url, filepath, referrer):
     if os.path.exists(filepath):
         return False
     
     os.makedirs(os.path.dirname(filepath), exist_ok=True)
-    response = await request.get(url, headers={"Referer": referrer})
-    
+    with METRICS.timer('cdn', host_of(url)) as op:
+        response = await request.get(url, headers={"Referer": referrer})
+        op['ok'] = response.status == 200
+        content = await response.body() if op['ok'] else b''
+        op['bytes'] = len(content)
+
     if response.status == 200:
-        content = await response.body()
-        async with aiofiles.open(filepath, mode='wb') as f:
-            await f.write(content)
+        with METRICS.timer('disk') as op:
+            async with aiofiles.open(filepath, mode='wb') as f:
+                await f.write(content)
+            op['bytes'] = len(content)
         return True
     return False
 
-async def process_exam(request, exam, cloudfront_base, state, referrer, clinic_name):
+async def process_exam(request, exam, cloudfront_base, state, referrer, clinic_name, image_concurrency=IMAGE_CONCURRENCY,
+                       inventory=None):
     exam_id = exam['id']
+    inventory = inventory or LocalInventory(DOWNLOAD_DIR)
     
     patient_data = exam.get('patient', {})
     patient_name = (patient_data.get('fullName') or exam.get('patientFullName') or exam.get('patientName') or 'Unknown_Patient').replace(' ', '_').replace('/', '-')
@@ -103,13 +149,20 @@ async def process_exam(request, exam, cloudfront_base, state, referrer, clinic_n
     if 'exam_details' not in state:
         state['exam_details'] = {}
         
-    # Get image list if missing or if we need it
+    # Get image list if missing or if we need it. Exams whose known images are
+    # all on disk are complete even if the run that fetched them was cut short.
     image_list = []
-    if exam_id not in state.get('downloaded_exams', []) or 'image_list' not in state['exam_details'].get(exam_id, {}):
+    previous = state['exam_details'].get(exam_id, {})
+    if 'image_list' in previous and (exam_id in state['downloaded_exams']
+                                     or exam_is_complete(previous, inventory, folder_name=f"{patient_name}_{exam_id}")):
+        image_list = previous.get('image_list', [])
+        if exam_id not in state['downloaded_exams']:
+            state['downloaded_exams'].append(exam_id)
+        API_CALLS['skipped'] += 1
+    else:
         details = await fetch_exam_details(request, exam_id)
         image_list = details.get('examDataList', [])
-    else:
-        image_list = state['exam_details'][exam_id].get('image_list', [])
+        API_CALLS['fetched'] += 1
 
     anamnesis = patient_data.get('anamnesis') or {}
     
@@ -151,32 +204,72 @@ async def process_exam(request, exam, cloudfront_base, state, referrer, clinic_n
         return 0
 
     exam_folder = os.path.join(DOWNLOAD_DIR, f"{patient_name}_{exam_id}")
-    downloaded_count = 0
-    
-    for img_data in image_list:
+    semaphore = asyncio.Semaphore(image_concurrency)
+
+    async def fetch_image(img_data):
         uuid = img_data['uuid']
-        img_url = f"{cloudfront_base}/{uuid}"
-        filepath = os.path.join(exam_folder, f"{uuid}.jpg")
-        
-        if await download_image(request, img_url, filepath, referrer):
-            downloaded_count += 1
-            
+        async with semaphore:
+            return await download_image(request, f"{cloudfront_base}/{uuid}",
+                                        os.path.join(exam_folder, f"{uuid}.jpg"), referrer)
+
+    results = await asyncio.gather(*(fetch_image(img_data) for img_data in image_list))
+    downloaded_count = sum(results)
+
     state['downloaded_exams'].append(exam_id)
     return downloaded_count
 
-async def main():
+async def crawl_clinic(request, clinic_name, cloudfront_base, state, referrer, image_concurrency, inventory=None):
+    """Walk every exam page of the clinic currently selected on `request`."""
+    inventory = inventory or LocalInventory(DOWNLOAD_DIR)
+    page_num = 1
+    all_seen_ids = set()
+    total_images = 0
+
+    while True:
+        data = await fetch_exams(request, page_num)
+        exams = data.get('result', [])
+        if not exams:
+            break
+
+        # Double check pagination
+        current_page_ids = {e['id'] for e in exams}
+        if current_page_ids.issubset(all_seen_ids):
+            break
+        all_seen_ids.update(current_page_ids)
+
+        print(f"  [{clinic_name}] Processing page {page_num} ({len(exams)} exams)...")
+
+        # Using tqdm for progress tracking
+        tasks = [process_exam(request, exam, cloudfront_base, state, referrer, clinic_name, image_concurrency,
+                              inventory)
+                 for exam in exams]
+        results = await tqdm.gather(*tasks, desc=f"    Downloading {clinic_name}", leave=False)
+
+        total_images += sum(results)
+        save_state(state) # Save frequently
+
+        page_num += 1
+        await asyncio.sleep(0.5) # Modest throttle
+
+    return total_images
+
+async def main(args):
     if not EYERCLOUD_USUARIO or not EYERCLOUD_SENHA:
         print("ERROR: Please set EYERCLOUD_USUARIO and EYERCLOUD_SENHA in .env file.")
         return
 
+    global METRICS
+    METRICS = Metrics('downloader', enabled=not args.no_metrics)
     state = load_state()
     
     async with async_playwright() as p:
+        METRICS.mark('login')
         browser = await p.chromium.launch(headless=True)
         context = await browser.new_context(locale='pt-BR')
         page = await context.new_page()
         
-        request = await login(page)
+        with METRICS.timer('login', host_of(EYERCLOUD_DOMAIN)):
+            request = await login(page)
         clinics = await get_clinics(request)
         
         print(f"Found {len(clinics)} clinic(s).")
@@ -184,43 +277,49 @@ async def main():
         cloudfront_base = await get_cloudfront_base(page)
         print(f"Detected Image Base URL: {cloudfront_base}")
         
-        total_images = 0
-        
-        for clinic in clinics:
+        referrer = page.url
+        METRICS.mark('clinics')
+        clinic_slots = asyncio.Semaphore(max(1, args.clinic_concurrency))
+        # Clinics without their own session fall back to the shared page.request, one at a time
+        shared_lock = asyncio.Lock()
+
+        async def run_clinic(clinic):
             clinic_id = clinic['id']
             clinic_name = clinic['name']
-            print(f"\nProcessing Clinic: {clinic_name}")
-            await set_clinic(request, clinic_id)
-            
-            page_num = 1
-            all_seen_ids = set()
-            
-            while True:
-                data = await fetch_exams(request, page_num)
-                exams = data.get('result', [])
-                if not exams:
-                    break
-                
-                # Double check pagination
-                current_page_ids = {e['id'] for e in exams}
-                if current_page_ids.issubset(all_seen_ids):
-                    break
-                all_seen_ids.update(current_page_ids)
-                
-                print(f"  Processing page {page_num} ({len(exams)} exams)...")
-                
-                # Using tqdm for progress tracking
-                tasks = [process_exam(request, exam, cloudfront_base, state, page.url, clinic_name) for exam in exams]
-                results = await tqdm.gather(*tasks, desc=f"    Downloading {clinic_name}", leave=False)
-                
-                total_images += sum(results)
-                save_state(state) # Save frequently
-                
-                page_num += 1
-                await asyncio.sleep(0.5) # Modest throttle
+            async with clinic_slots:
+                isolated = None
+                if len(clinics) > 1 and args.clinic_concurrency > 1:
+                    isolated = await open_clinic_session(p, clinic_id)
+                    if isolated is None:
+                        print(f"  [{clinic_name}] API login refused - using the shared session")
+                if isolated is not None:
+                    print(f"\nProcessing Clinic: {clinic_name} (own session)")
+                    try:
+                        return await crawl_clinic(isolated, clinic_name, cloudfront_base, state,
+                                                  referrer, args.image_concurrency)
+                    finally:
+                        await isolated.dispose()
+                async with shared_lock:
+                    print(f"\nProcessing Clinic: {clinic_name}")
+                    await set_clinic(request, clinic_id)
+                    return await crawl_clinic(request, clinic_name, cloudfront_base, state,
+                                              referrer, args.image_concurrency)
+
+        results = await asyncio.gather(*(run_clinic(clinic) for clinic in clinics))
+        total_images = sum(results)
+        save_state(state)
 
         await browser.close()
         print(f"\nFinished! Total new images downloaded: {total_images}")
+        print(f"examData/list calls: {API_CALLS['fetched']} made, {API_CALLS['skipped']} skipped (complete on disk/state)")
+        METRICS.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description='EyerCloud downloader (all clinics of the account)')
+    parser.add_argument('--clinic-concurrency', type=int, default=CLINIC_CONCURRENCY,
+                        help=f'Clinics crawled at the same time, each with its own session (default: {CLINIC_CONCURRENCY})')
+    parser.add_argument('--image-concurrency', type=int, default=IMAGE_CONCURRENCY,
+                        help=f'Parallel image downloads per exam (default: {IMAGE_CONCURRENCY})')
+    parser.add_argument('--no-metrics', action='store_true',
+                        help='Do not write the telemetry timeline/textfile under metrics/')
+    profile_main(lambda: main(parser.parse_args()), 'downloader')
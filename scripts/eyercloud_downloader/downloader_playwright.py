@@ -38,6 +38,9 @@ except ImportError:
     print("=" * 60)
     exit(1)
 
+from browser_batch import fetch_exam_data_batch
+from auth_probe import probe_auth, invalidate
+
 # --- CONFIGURAÇÃO ---
 DOWNLOAD_DIR = Path("downloads")
 STATE_FILE = Path("download_state.json")
@@ -263,27 +266,11 @@ async def fetch_exams_via_api(page, current_page=1):
     return result
 
 
-async def fetch_exam_details(page, exam_id):
-    """Busca os detalhes de um exame específico."""
-    result = await page.evaluate('''async (examId) => {
-        const response = await fetch(`https://eyercloud.com/api/v2/eyercloud/examData/list?id=${examId}`, {
-            method: "GET",
-            headers: {
-                "Accept": "application/json"
-            },
-            credentials: "include"
-        });
-        
-        const text = await response.text();
-        try {
-            return JSON.parse(text);
-        } catch (e) {
-            console.log("Erro ao parsear detalhes do exame:", text.substring(0, 200));
-            return { examDataList: [] };
-        }
-    }''', exam_id)
-    
-    return result
+async def fetch_exam_details_batch(page, exam_ids):
+    """Busca os detalhes de vários exames em um único page.evaluate (pool de fetches no navegador).
+
+    Exames cuja busca falhou ficam fora do dict e continuam pendentes."""
+    return await fetch_exam_data_batch(page, exam_ids)
 
 
 async def download_image(page, url, filepath):
@@ -400,22 +387,16 @@ async def main():
         
         page = await context.new_page()
         
+        # Valida a sessão salva com uma única chamada de API (cache até os cookies expirarem)
+        is_logged_in = probe_auth(AUTH_STATE_FILE)
+        
         print("🔗 Acessando EyerCloud...")
         try:
-            await page.goto(f"{BASE_URL}/exam", wait_until="load", timeout=60000)
+            await page.goto(f"{BASE_URL}/exam", wait_until="domcontentloaded", timeout=60000)
         except Exception as e:
             print(f"⚠️ Aviso de navegação: {e}")
-        await asyncio.sleep(5)
         
-        is_logged_in = False
-        try:
-            page_content = await page.content()
-            is_logged_in = "Acessar exame" in page_content or "exam-card" in page_content or "patient" in page_content.lower()
-        except:
-            # Se der erro de navegação, provavelmente está redirecionando para login
-            is_logged_in = False
-        
-        if not is_logged_in or "login" in page.url.lower():
+        if not is_logged_in:
             print("\n" + "=" * 60)
             print("🔐 FAÇA LOGIN NO NAVEGADOR")
             print("   1. Complete o login com seu email e senha")
@@ -426,6 +407,7 @@ async def main():
             await asyncio.get_event_loop().run_in_executor(None, input, "\n>>> Pressione ENTER após fazer login... ")
             
             await context.storage_state(path=str(AUTH_STATE_FILE))
+            invalidate(AUTH_STATE_FILE)
             print("💾 Sessão salva para uso futuro!")
         else:
             print("✅ Já está logado!")
@@ -481,6 +463,8 @@ async def main():
                     
                     print(f"   Encontrados {len(exam_data)} exames na tela")
                     
+                    details_by_id = await fetch_exam_details_batch(page, [e['id'] for e in exam_data])
+                    
                     for exam in exam_data:
                         exam_id = exam['id']
                         patient_name = exam['name']
@@ -490,8 +474,11 @@ async def main():
                         #     print(f"  ⏭️ Já baixado: {exam_id[:8]}...")
                         #     continue
                         
-                        # Busca detalhes do exame via API
-                        details = await fetch_exam_details(page, exam_id)
+                        # Detalhes do exame (já buscados em lote acima)
+                        details = details_by_id.get(exam_id)
+                        if details is None:
+                            print(f"  ⚠️ Sem detalhes para {exam_id[:8]}... (erro na busca) - fica pendente")
+                            continue
                         
                         # Usa o nome do paciente do DOM (mais confiável)
                         safe_name = re.sub(r'[<>:"/\\|?*]', '_', patient_name)
@@ -620,6 +607,10 @@ async def main():
                     break
                 all_seen_ids.update(current_ids)
                 
+                details_by_id = await fetch_exam_details_batch(
+                    page, [e['id'] for e in exams if e['id'] not in state['downloaded_exams']]
+                )
+                
                 for exam in exams:
                     exam_id = exam['id']
                     
@@ -641,7 +632,10 @@ async def main():
                     
                     print(f"\n  👤 {patient_name} ({exam_id[:8]}...)")
                     
-                    details = await fetch_exam_details(page, exam_id)
+                    details = details_by_id.get(exam_id)
+                    if details is None:
+                        print(f"  ⚠️ Sem detalhes para {exam_id[:8]}... (erro na busca) - fica pendente")
+                        continue
                     
                     image_list = details.get('examDataList', [])
                     expected_count = len(image_list)
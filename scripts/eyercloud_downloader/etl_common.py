@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Shared helpers for the EyerCloud ETL scripts.
+=============================================
+Account file names, JSON state I/O and the exam_details record that the
+download scripts used to redefine one copy each. Standard library only:
+importing it costs nothing, so neuroapp_etl.py can use it for report and
+preview commands without loading Playwright, requests or pandas.
+
+    from etl_common import Account, load_json, save_json
+    acct = Account("mozaniareis@usp.br")
+    dl_state = load_json(acct.dl_state_file, {})
+"""
+
+import re
+import json
+from pathlib import Path
+from datetime import datetime
+
+from text_normalize import normalize_name
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+USEFUL_TYPES = ('COLOR', 'ANTERIOR')
+# Never downloaded; dropped from staging_state['exam_images'] and the exam feed alike
+SKIPPED_TYPES = ('REDFREE',)
+DEFAULT_DATA_PATH = 'https://d25chn8x2vrs37.cloudfront.net'
+
+
+def sanitize_email(email):
+    return re.sub(r'[^a-zA-Z0-9]', '_', email.split('@')[0])
+
+
+def safe_folder_name(patient_name, exam_id):
+    safe = re.sub(r'[<>:"/\\|?*]', '_', patient_name).replace(' ', '_')
+    return f"{safe}_{exam_id[:8]}"
+
+
+def load_json(path, default=None):
+    path = Path(path)
+    if path.exists():
+        return json.loads(path.read_text(encoding='utf-8'))
+    return default
+
+
+def save_json(data, path):
+    """Write through a .tmp file, so an interrupted run never leaves half a state file."""
+    path = Path(path)
+    tmp = path.with_suffix('.tmp')
+    tmp.write_text(json.dumps(data, indent=2, ensure_ascii=False, default=str), encoding='utf-8')
+    tmp.replace(path)
+
+
+class Account:
+    """File layout of one staging account (paths relative to this folder, like the scripts)."""
+
+    def __init__(self, email):
+        self.email = email
+        self.email_safe = sanitize_email(email)
+        self.download_dir = Path("downloads_staging") / self.email_safe
+        self.staging_state_file = Path(f"staging_state_{self.email_safe}.json")
+        self.dl_state_file = Path(f"staging_download_state_{self.email_safe}.json")
+        self.checkpoint_file = Path(f"pipeline_checkpoint_{self.email_safe}.json")
+        self.auth_file = Path(f"auth_state_{self.email_safe}.json")
+        self.mapping_file = PROJECT_ROOT / f"bytescale_mapping_staging_{self.email_safe}.json"
+        self.upload_progress_file = PROJECT_ROOT / f"bytescale_upload_staging_{self.email_safe}_progress.json"
+
+    @classmethod
+    def discover(cls):
+        """Every account with a staging state in this folder."""
+        accounts = []
+        for path in sorted(Path('.').glob('staging_state_*.json')):
+            email = (load_json(path, {}) or {}).get('email')
+            if email:
+                accounts.append(cls(email))
+        return accounts
+
+    def new_dl_state(self):
+        return {
+            'email': self.email,
+            'downloaded_exams': [],
+            'exam_details': {},
+            'stats': {'total_images': 0, 'total_bytes': 0},
+        }
+
+    def new_staging_state(self):
+        return {
+            'email': self.email,
+            'fetched_at': None,
+            'patients': {},
+            'exams': {},
+            'exam_images': {},
+        }
+
+
+class UnionFind:
+    """Disjoint sets over 0..n-1; each root is the smallest index of its set."""
+
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+def tracked_images(images):
+    """Image records minus SKIPPED_TYPES: the one filter behind exam_images and the exam feed."""
+    return [img for img in images or []
+            if isinstance(img, dict) and (img.get('type') or 'UNKNOWN').upper() not in SKIPPED_TYPES]
+
+
+def useful_images(details, useful_types=USEFUL_TYPES):
+    return [img for img in details.get('examDataList', []) if img.get('type') in useful_types]
+
+
+def exam_details_record(patient_name, exam_id, images):
+    """The download_state exam_details entry for one exam's (useful) images."""
+    return {
+        'patient_name': patient_name,
+        'folder_name': safe_folder_name(patient_name, exam_id),
+        'expected_images': len(images),
+        'download_date': datetime.now().isoformat(),
+        'image_details': [
+            {'uuid': img['uuid'], 'type': img.get('type'), 'laterality': img.get('imageLaterality', '')}
+            for img in images
+        ],
+    }
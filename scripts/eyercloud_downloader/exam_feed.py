@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Exam inventory change feed between crawls.
+==========================================
+Instead of rebuilding full id lists (eyercloud_active_ids.json,
+_existing_ids.json, ...) and comparing them by hand, every crawl is folded
+into a compact per-account inventory:
+
+    exam_id -> [patient_id, date, image_count, images_hash]
+
+and the difference against the previous crawl is appended to a change log
+as one entry {seq, at, added, removed, modified}. Downstream steps
+(download, upload, DB sync, ...) each keep their own cursor into the log
+and consume only what changed since they last ran.
+
+Files, per account under exam_feed/<account>/:
+    inventory.json    latest compact inventory
+    changes.jsonl     one line per crawl that changed something
+    cursors.json      consumer -> last acknowledged seq
+
+Usage:
+    cd scripts/eyercloud_downloader
+    python exam_feed.py update --email "x@y.com" --from-staging staging_state_x.json
+    python exam_feed.py update --email "x@y.com" --from-snapshot metadata_snapshots/x/latest.json
+    python exam_feed.py status --email "x@y.com"
+    python exam_feed.py pending --email "x@y.com" --consumer upload
+    python exam_feed.py ack --email "x@y.com" --consumer upload
+
+From other scripts:
+    from exam_feed import ExamFeed, inventory_from_exams
+    feed = ExamFeed(email)
+    change = feed.update(inventory_from_exams(all_exams))
+    changed = feed.pending('download')          # {'added': [...], 'removed': [...], 'modified': [...]}
+    ...
+    feed.ack('download')
+"""
+
+import json
+import hashlib
+import argparse
+from pathlib import Path
+from datetime import datetime
+
+from etl_common import sanitize_email, tracked_images
+
+FEED_DIR = Path("exam_feed")
+FEED_VERSION = 1
+
+
+def images_hash(uuids):
+    """Order-independent short hash of an exam's image UUIDs."""
+    digest = hashlib.sha1('\n'.join(sorted(uuids)).encode('utf-8')).hexdigest()
+    return digest[:12]
+
+
+# --- inventory builders (one per crawl source) ---
+
+def inventory_from_exams(exams):
+    """Raw exam records (Sails socket / exam/filter / exam/list) -> inventory.
+
+    Images go through etl_common.tracked_images (REDFREE dropped), the filter
+    record_staging_metadata applies, so both sources hash the same set.
+
+    Sources without image lists get count/hash None, which never counts as a
+    modification on its own (see diff_inventories).
+    """
+    inventory = {}
+    for exam in exams:
+        eid = exam.get('id') or exam.get('_id')
+        if not eid:
+            continue
+        patient = exam.get('patient')
+        pid = (patient.get('id', '') if isinstance(patient, dict)
+               else patient if isinstance(patient, str) else exam.get('patientId', ''))
+        images = exam.get('examImages')
+        if isinstance(images, list):
+            uuids = [img.get('uuid', '') for img in tracked_images(images)]
+            count, digest = len(uuids), images_hash(uuids)
+        else:
+            count, digest = None, None
+        inventory[eid] = [pid or '', exam.get('date') or exam.get('examDate') or '', count, digest]
+    return inventory
+
+
+def inventory_from_staging_state(staging_state):
+    """staging_state_*.json -> inventory (same image filter as inventory_from_exams)."""
+    exam_images = staging_state.get('exam_images', {})
+    inventory = {}
+    for eid, exam in staging_state.get('exams', {}).items():
+        uuids = [img.get('uuid', '') for img in tracked_images(exam_images.get(eid))]
+        inventory[eid] = [exam.get('patientId', ''), exam.get('examDate', ''), len(uuids), images_hash(uuids)]
+    return inventory
+
+
+def inventory_from_snapshot(snapshot):
+    """metadata_snapshot.py snapshot -> inventory (no image data)."""
+    return {
+        eid: [exam.get('patientId', ''), exam.get('date', ''), None, None]
+        for eid, exam in snapshot.get('exams', {}).items()
+    }
+
+
+def inventory_from_id_list(ids):
+    """Legacy id dumps (eyercloud_ids_active.json, _existing_ids.json) -> inventory."""
+    if isinstance(ids, dict):
+        return {eid: ['', (info or {}).get('date') or '', None, None] for eid, info in ids.items()}
+    return {eid: ['', '', None, None] for eid in ids}
+
+
+def diff_inventories(old, new):
+    """(added, removed, modified) exam ids between two inventories.
+
+    Unknown fields (empty patient/date, None count/hash) on either side are
+    not compared, so a crawl from a poorer source does not flag everything.
+    """
+    added = sorted(set(new) - set(old))
+    removed = sorted(set(old) - set(new))
+    modified = sorted(
+        eid for eid in set(old) & set(new)
+        if any(_known(a) and _known(b) and a != b for a, b in zip(old[eid], new[eid]))
+    )
+    return added, removed, modified
+
+
+def _known(value):
+    return value not in ('', None)
+
+
+def merge_entry(old, new):
+    """Keep known values from the previous inventory where the new source has none."""
+    return [n if _known(n) else o for o, n in zip(old, new)]
+
+
+class ExamFeed:
+    def __init__(self, email, root=FEED_DIR):
+        self.account = sanitize_email(email) if email else 'default'
+        self.dir = Path(root) / self.account
+        self.inventory_file = self.dir / "inventory.json"
+        self.changes_file = self.dir / "changes.jsonl"
+        self.cursors_file = self.dir / "cursors.json"
+
+    def _load(self, path, default):
+        if path.exists():
+            return json.loads(path.read_text(encoding='utf-8'))
+        return default
+
+    def inventory(self):
+        data = self._load(self.inventory_file, None)
+        return data['exams'] if data else {}
+
+    def changes(self, after=0):
+        if not self.changes_file.exists():
+            return []
+        with open(self.changes_file, 'r', encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        return [e for e in entries if e['seq'] > after]
+
+    def last_seq(self):
+        entries = self.changes()
+        return entries[-1]['seq'] if entries else 0
+
+    def update(self, inventory, source='', partial=False):
+        """Fold one crawl into the feed. Returns the change entry (or None if nothing changed).
+
+        partial=True means the crawl did not cover the whole account (e.g. one
+        clinic), so exams missing from it are not reported as removed.
+        """
+        old = self.inventory()
+        added, removed, modified = diff_inventories(old, inventory)
+        if partial:
+            removed = []
+
+        merged = {} if not partial else dict(old)
+        for eid, entry in inventory.items():
+            merged[eid] = merge_entry(old[eid], entry) if eid in old else entry
+
+        self.dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.inventory_file.with_suffix('.tmp')
+        tmp.write_text(json.dumps({
+            'version': FEED_VERSION, 'updated_at': datetime.now().isoformat(),
+            'source': source, 'exams': merged,
+        }), encoding='utf-8')
+        tmp.replace(self.inventory_file)
+
+        if not (added or removed or modified):
+            return None
+        entry = {
+            'seq': self.last_seq() + 1,
+            'at': datetime.now().isoformat(),
+            'source': source,
+            'added': added,
+            'removed': removed,
+            'modified': modified,
+        }
+        with open(self.changes_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+        return entry
+
+    def pending(self, consumer):
+        """Net change since `consumer` last acked: {'seq', 'added', 'removed', 'modified'}."""
+        cursor = self.cursor(consumer)
+        state = {}  # eid -> 'added' | 'removed' | 'modified'
+        seq = cursor
+        for entry in self.changes(after=cursor):
+            seq = entry['seq']
+            for eid in entry['added']:
+                state[eid] = 'modified' if state.get(eid) == 'removed' else 'added'
+            for eid in entry['modified']:
+                state.setdefault(eid, 'modified')
+            for eid in entry['removed']:
+                if state.get(eid) == 'added':
+                    del state[eid]
+                else:
+                    state[eid] = 'removed'
+        result = {'seq': seq, 'added': [], 'removed': [], 'modified': []}
+        for eid, kind in sorted(state.items()):
+            result[kind].append(eid)
+        return result
+
+    def ack(self, consumer, seq=None):
+        cursors = self._load(self.cursors_file, {})
+        cursors[consumer] = self.last_seq() if seq is None else seq
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.cursors_file.write_text(json.dumps(cursors, indent=2), encoding='utf-8')
+
+    def cursor(self, consumer):
+        """Last seq `consumer` acked (0 if it never did)."""
+        return self._load(self.cursors_file, {}).get(consumer, 0)
+
+    def is_new(self, consumer):
+        """True if the consumer has never acked, i.e. it must process everything once."""
+        return consumer not in self._load(self.cursors_file, {})
+
+
+def print_change(change):
+    if change is None:
+        print("  No changes since the previous crawl.")
+        return
+    print(f"  Change #{change['seq']}: +{len(change['added'])} added, "
+          f"-{len(change['removed'])} removed, ~{len(change['modified'])} modified")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Exam inventory change feed')
+    parser.add_argument('command', choices=['update', 'status', 'pending', 'ack'])
+    parser.add_argument('--email', default=None, help='Account the feed belongs to')
+    parser.add_argument('--from-staging', default=None, help='staging_state_*.json to fold in')
+    parser.add_argument('--from-snapshot', default=None, help='metadata_snapshot.py snapshot to fold in')
+    parser.add_argument('--from-ids', default=None, help='Legacy id dump (list or {id: {...}})')
+    parser.add_argument('--partial', action='store_true', help='Source covers only part of the account')
+    parser.add_argument('--consumer', default=None, help='Consumer name for pending/ack')
+    parser.add_argument('--seq', type=int, default=None, help='Ack up to this seq (default: latest)')
+    parser.add_argument('--output', default=None, help='pending: write the id lists here as JSON')
+    args = parser.parse_args()
+
+    feed = ExamFeed(args.email)
+
+    print("=" * 60)
+    print(f"  Exam change feed -- {args.command} ({feed.account})")
+    print("=" * 60)
+
+    if args.command == 'update':
+        sources = [(args.from_staging, inventory_from_staging_state),
+                   (args.from_snapshot, inventory_from_snapshot),
+                   (args.from_ids, inventory_from_id_list)]
+        chosen = [(path, build) for path, build in sources if path]
+        if len(chosen) != 1:
+            print("ERROR: give exactly one of --from-staging, --from-snapshot, --from-ids")
+            return
+        path, build = chosen[0]
+        inventory = build(json.loads(Path(path).read_text(encoding='utf-8')))
+        print(f"  Source: {path} ({len(inventory)} exams)")
+        print_change(feed.update(inventory, source=str(path), partial=args.partial))
+        return
+
+    if args.command == 'status':
+        inventory = feed.inventory()
+        changes = feed.changes()
+        cursors = feed._load(feed.cursors_file, {})
+        print(f"  Exams in inventory: {len(inventory)}")
+        print(f"  Change entries:     {len(changes)} (latest seq {feed.last_seq()})")
+        for entry in changes[-5:]:
+            print(f"    #{entry['seq']} {entry['at'][:19]} +{len(entry['added'])} "
+                  f"-{len(entry['removed'])} ~{len(entry['modified'])}  {entry['source']}")
+        for consumer, seq in sorted(cursors.items()):
+            print(f"  Consumer {consumer:<12} at seq {seq} ({feed.last_seq() - seq} entries behind)")
+        return
+
+    if not args.consumer:
+        print("ERROR: --consumer is required")
+        return
+
+    if args.command == 'pending':
+        pending = feed.pending(args.consumer)
+        print(f"  Up to seq {pending['seq']}: +{len(pending['added'])} added, "
+              f"-{len(pending['removed'])} removed, ~{len(pending['modified'])} modified")
+        if args.output:
+            Path(args.output).write_text(json.dumps(pending, indent=2), encoding='utf-8')
+            print(f"  Saved: {args.output}")
+        return
+
+    feed.ack(args.consumer, args.seq)
+    print(f"  {args.consumer} acked up to seq {args.seq if args.seq is not None else feed.last_seq()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the EyerCloud API and its CloudFront image host.
+===================================================================
+Serves a synthetic, deterministic account so the downloaders can be
+exercised and benchmarked without touching the production accounts:
+
+    POST /api/v2/eyercloud/auth/login       {email, password} -> session cookie
+    POST /api/v2/eyercloud/clinic/list      -> {result: [clinics]}
+    POST /api/v2/eyercloud/clinic/change    {id}
+    POST /api/v2/eyercloud/exam/filter      {page, ...}  -> {result, totalCount}  (current clinic)
+    POST /api/v2/eyercloud/exam/list        {page}       -> {result, totalCount}
+    POST /api/v2/eyercloud/patient/list     {page}       -> {result, totalCount}
+    GET|POST /api/v2/eyercloud/examData/list?id=...      -> {examDataList, dataPath, exam}
+    GET  /cdn/<uuid>                        synthetic JPEG (valid SOI/EOI, decodable header)
+    GET  /login, /exam                      minimal pages for the Playwright login of downloader.py
+
+Knobs:
+    --patients / --exams-per-patient / --images-per-exam / --clinics   dataset size
+    --images N                  shortcut: size the dataset to about N images
+    --latency-ms, --jitter-ms   delay for API calls;  --cdn-latency-ms for images
+    --cdn-bandwidth-mbps        shared egress cap for images (token bucket)
+    --pagination                exact | repeat-last | overlap  (see PAGINATION_MODES)
+    --rate-limit, --burst       per-session API rate limit -> HTTP 429 + Retry-After
+    --error-rate                fraction of API calls answered with HTTP 503
+
+Usage:
+    cd scripts/eyercloud_downloader
+    python eyercloud_standin.py --port 8766 --images 10000 --latency-ms 120 --rate-limit 20
+
+    # then point the downloaders at it
+    EYERCLOUD_DOMAIN=http://127.0.0.1:8766 EYERCLOUD_CDN_BASE=http://127.0.0.1:8766/cdn python downloader.py
+    EYERCLOUD_DOMAIN=http://127.0.0.1:8766 python auth_probe.py auth_state.json --force
+    EYERCLOUD_APP_URL=http://127.0.0.1:8766 EYERCLOUD_DOMAIN=http://127.0.0.1:8766 \
+        python metadata_snapshot.py crawl --email x@y.com --password x
+
+The Sails WebSocket listing (download_staging_images.py, ingest_pipeline.py)
+is not emulated; the API-based paths above are.
+
+From Python (benchmarks):
+    from eyercloud_standin import start_standin
+    server, base_url = start_standin(images=1000, latency_ms=50)
+"""
+
+import json
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from datetime import date, timedelta
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+API_PREFIX = '/api/v2/eyercloud'
+PAGE_SIZE = 20
+SESSION_COOKIE = 'sails.sid'
+IMAGE_TYPES = ('COLOR', 'COLOR', 'ANTERIOR', 'REDFREE')
+PAGINATION_MODES = {
+    'exact': 'pages past the end are empty',
+    'repeat-last': 'pages past the end repeat the last page (as exam/filter does)',
+    'overlap': 'each page repeats the last record of the previous one',
+}
+
+FIRST_NAMES = ('ANA', 'MARIA', 'JOSE', 'JOAO', 'ANTONIO', 'FRANCISCA', 'CARLOS', 'PAULO', 'LUCIA',
+               'MARCOS', 'LUIZ', 'HELENA', 'PEDRO', 'APARECIDA', 'SEBASTIAO', 'RAIMUNDA', 'CONCEICAO')
+LAST_NAMES = ('SILVA', 'SANTOS', 'OLIVEIRA', 'SOUZA', 'RODRIGUES', 'FERREIRA', 'ALVES', 'PEREIRA',
+              'LIMA', 'GOMES', 'COSTA', 'RIBEIRO', 'MARTINS', 'CARVALHO', 'ARAUJO', 'MELO', 'BARBOSA')
+ANAMNESIS_FLAGS = ('diabetes', 'hypertension', 'cholesterol', 'smoker', 'diabeticRetinopathy',
+                   'dmri', 'glaucoma', 'cataract', 'pterygium', 'lowVisualAcuity')
+
+
+# --- synthetic data ---
+
+def object_id(*parts):
+    """24-hex id shaped like the Mongo ids the real API returns."""
+    return hashlib.sha1('/'.join(map(str, parts)).encode('utf-8')).hexdigest()[:24]
+
+
+def cpf_with_check_digits(base9):
+    digits = [int(d) for d in base9]
+    for length in (9, 10):
+        total = sum(d * w for d, w in zip(digits, range(length + 1, 1, -1)))
+        digits.append((total * 10 % 11) % 10)
+    return ''.join(map(str, digits))
+
+
+def synthetic_jpeg(key, size):
+    """A valid 8x8 grayscale baseline JPEG padded to ~size bytes with COM segments."""
+    header = (
+        b'\xff\xd8'
+        + b'\xff\xdb\x00\x43\x00' + b'\x01' * 64                                    # DQT
+        + b'\xff\xc0\x00\x0b\x08\x00\x08\x00\x08\x01\x01\x11\x00'                  # SOF0 8x8, 1 comp
+        + b'\xff\xc4\x00\x14\x00' + b'\x01' + b'\x00' * 15 + b'\x00'               # DHT DC: '0' -> 0
+        + b'\xff\xc4\x00\x14\x10' + b'\x01' + b'\x00' * 15 + b'\x00'               # DHT AC: '0' -> EOB
+    )
+    scan = b'\xff\xda\x00\x08\x01\x01\x00\x00\x3f\x00' + b'\x3f' + b'\xff\xd9'  # DC 0, EOB, padding
+    seed = hashlib.sha256(key.encode('utf-8')).digest()
+    padding = bytearray()
+    remaining = max(0, size - len(header) - len(scan))
+    while remaining > 4:
+        chunk = min(remaining - 4, 65533)
+        body = (seed * (chunk // len(seed) + 1))[:chunk]
+        padding += b'\xff\xfe' + (chunk + 2).to_bytes(2, 'big') + body
+        remaining -= chunk + 4
+    return header + bytes(padding) + scan
+
+
+class Dataset:
+    """Deterministic synthetic account: clinics -> patients -> exams -> images."""
+
+    def __init__(self, patients=100, exams_per_patient=2, images_per_exam=5, clinics=1,
+                 image_kb=200, seed=0):
+        rng = random.Random(seed)
+        self.image_size = int(image_kb * 1024)
+        self.clinics = [{'id': object_id(seed, 'clinic', c), 'name': f"Clinica Sintetica {c + 1}"}
+                        for c in range(max(1, clinics))]
+        self.patients = []
+        self.exams = []
+        self.images = {}        # exam_id -> [examData]
+        self.image_owner = {}   # uuid -> exam_id
+        start = date(2019, 1, 1)
+
+        for p in range(patients):
+            clinic = self.clinics[p % len(self.clinics)]
+            name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}"
+            patient = {
+                'id': object_id(seed, 'patient', p),
+                'fullName': name,
+                'document2': cpf_with_check_digits(f"{rng.randrange(10 ** 9):09d}"),
+                'birthday': (date(1930, 1, 1) + timedelta(days=rng.randrange(80 * 365))).isoformat(),
+                'gender': rng.choice(('M', 'F')),
+                'anamnesis': {flag: rng.random() < 0.15 for flag in ANAMNESIS_FLAGS},
+                'clinic': clinic['id'],
+            }
+            self.patients.append(patient)
+            for e in range(exams_per_patient):
+                exam_id = object_id(seed, 'exam', p, e)
+                exam = {
+                    'id': exam_id,
+                    'date': (start + timedelta(days=rng.randrange(6 * 365))).isoformat() + 'T10:00:00.000Z',
+                    'patient': patient,
+                    'patientId': patient['id'],
+                    'clinic': clinic,
+                    'status': 'closed',
+                }
+                self.exams.append(exam)
+                images = []
+                for i in range(images_per_exam):
+                    image_uuid = str(uuid.UUID(hashlib.md5(f"{exam_id}/{i}".encode()).hexdigest()))
+                    images.append({
+                        'uuid': image_uuid,
+                        'type': IMAGE_TYPES[i % len(IMAGE_TYPES)],
+                        'imageLaterality': 'OD' if i % 2 == 0 else 'OS',
+                        'examId': exam_id,
+                        'createdAt': exam['date'],
+                    })
+                    self.image_owner[image_uuid] = exam_id
+                self.images[exam_id] = images
+
+        # Newest first, like the real listings
+        self.exams.sort(key=lambda x: x['date'], reverse=True)
+        self.exams_by_id = {e['id']: e for e in self.exams}
+        self.exams_by_clinic = {c['id']: [e for e in self.exams if e['clinic']['id'] == c['id']]
+                                for c in self.clinics}
+
+    @classmethod
+    def for_image_count(cls, images, images_per_exam=5, exams_per_patient=2, **kwargs):
+        patients = max(1, -(-images // (images_per_exam * exams_per_patient)))
+        return cls(patients=patients, exams_per_patient=exams_per_patient,
+                   images_per_exam=images_per_exam, **kwargs)
+
+    @property
+    def image_count(self):
+        return len(self.image_owner)
+
+    def image_bytes(self, image_uuid):
+        return synthetic_jpeg(image_uuid, self.image_size)
+
+
+def paginate(records, page, mode):
+    """One page of `records` (1-based page numbers) under a pagination mode."""
+    page = max(1, page)
+    if mode == 'overlap' and page > 1:
+        start = (page - 1) * PAGE_SIZE - 1
+    else:
+        start = (page - 1) * PAGE_SIZE
+    if start >= len(records):
+        if mode == 'repeat-last' and records:
+            last_page = (len(records) - 1) // PAGE_SIZE
+            return records[last_page * PAGE_SIZE:]
+        return []
+    return records[start:start + PAGE_SIZE]
+
+
+# --- server ---
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(1.0, burst or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        """0 if a token was taken, else seconds until the next one."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class StandinConfig:
+    def __init__(self, dataset, latency_ms=0, jitter_ms=0, cdn_latency_ms=0, cdn_bandwidth_mbps=0,
+                 pagination='repeat-last', rate_limit=0, burst=0, error_rate=0.0,
+                 email=None, password=None, seed=None):
+        self.dataset = dataset
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.cdn_latency = cdn_latency_ms / 1000
+        self.cdn_bandwidth = cdn_bandwidth_mbps * 1024 * 1024 / 8  # bytes/s, 0 = unlimited
+        self.pagination = pagination
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.error_rate = error_rate
+        self.email = email
+        self.password = password
+        self.random = random.Random(seed)
+        self.sessions = {}   # token -> {'email', 'clinic', 'bucket'}
+        self._lock = threading.Lock()
+        self._link_free_at = 0.0
+        self.counters = {'requests': 0, 'rate_limited': 0, 'errors': 0, 'images': 0, 'bytes': 0}
+        self.endpoints = {}
+
+    def count(self, endpoint, key='requests', amount=1):
+        with self._lock:
+            self.counters[key] += amount
+            if key == 'requests':
+                self.endpoints[endpoint] = self.endpoints.get(endpoint, 0) + 1
+
+    def delay(self, base):
+        with self._lock:
+            extra = self.random.uniform(0, self.jitter) if self.jitter else 0
+        if base or extra:
+            time.sleep(base + extra)
+
+    def throttle(self, nbytes):
+        """Serialize transfer time on a shared link of `cdn_bandwidth` bytes/s."""
+        if not self.cdn_bandwidth:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._link_free_at)
+            self._link_free_at = start + nbytes / self.cdn_bandwidth
+            wait = self._link_free_at - now
+        time.sleep(wait)
+
+    def should_fail(self):
+        with self._lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    def retry_after(self, session_key):
+        """Seconds the caller must wait (0 = allowed) under the per-session rate limit."""
+        if not self.rate_limit:
+            return 0.0
+        with self._lock:
+            bucket = self.sessions.setdefault(session_key, {}).get('bucket')
+            if bucket is None:
+                bucket = self.sessions[session_key]['bucket'] = TokenBucket(self.rate_limit, self.burst)
+            return bucket.take()
+
+
+LOGIN_PAGE = """<!doctype html><html><body><div id="app">
+<form id="f"><input placeholder="Email" name="email"><input placeholder="Senha" name="password" type="password"><button type="submit">Entrar</button></form>
+<script>
+document.getElementById('f').addEventListener('submit', async (ev) => {
+  ev.preventDefault();
+  const body = {email: ev.target.email.value, password: ev.target.password.value};
+  const r = await fetch('/api/v2/eyercloud/auth/login', {method: 'POST', credentials: 'include',
+    headers: {'Content-Type': 'application/json'}, body: JSON.stringify(body)});
+  if (r.ok) location.href = '/exam';
+});
+</script></div></body></html>"""
+
+EXAM_PAGE = """<!doctype html><html><body><div id="app">
+<a class="thumbnail-box" href="{cdn}/{uuid}">Acessar exame</a>
+</div></body></html>"""
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    server_version = "EyerCloudStandin/1.0"
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; with Nagle on, the body waits
+    # for the client's delayed ACK (~40 ms on every keep-alive request)
+    disable_nagle_algorithm = True
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def _send(self, status, data, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_json(self, status, body, headers=None):
+        self._send(status, json.dumps(body).encode('utf-8'), 'application/json', headers)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        raw = self.rfile.read(length) if length else b''
+        if not raw:
+            return {}
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return {k: v[0] for k, v in parse_qs(raw.decode('utf-8', 'replace')).items()}
+
+    def _session_token(self):
+        for part in self.headers.get('Cookie', '').split(';'):
+            name, _, value = part.strip().partition('=')
+            if name == SESSION_COOKIE:
+                return value
+        return None
+
+    def _base_url(self):
+        return f"http://{self.headers.get('Host', 'localhost')}"
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_POST(self):
+        self._route('POST')
+
+    def _route(self, method):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        body = self._body() if method == 'POST' else {}
+
+        if url.path.startswith('/cdn/'):
+            return self._image(url.path[len('/cdn/'):])
+        if url.path in ('/', '/login'):
+            return self._send(200, LOGIN_PAGE.encode('utf-8'), 'text/html; charset=utf-8')
+        if url.path.startswith('/exam') and not url.path.startswith(API_PREFIX):
+            first = next(iter(self.config.dataset.image_owner), '')
+            page = EXAM_PAGE.format(cdn=f"{self._base_url()}/cdn", uuid=first)
+            return self._send(200, page.encode('utf-8'), 'text/html; charset=utf-8')
+        if not url.path.startswith(API_PREFIX):
+            return self._send_json(404, {'error': 'not_found', 'path': url.path})
+
+        endpoint = url.path[len(API_PREFIX):]
+        config = self.config
+        config.count(endpoint)
+        config.delay(config.latency)
+
+        token = self._session_token()
+        if endpoint == '/auth/login':
+            return self._login(body)
+        session = config.sessions.get(token) if token else None
+        if session is None or 'email' not in session:
+            return self._send_json(401, {'error': 'unauthorized'})
+
+        wait = config.retry_after(token)
+        if wait:
+            config.count(endpoint, 'rate_limited')
+            return self._send_json(429, {'error': 'too_many_requests'},
+                                   {'Retry-After': str(max(1, round(wait)))})
+        if config.should_fail():
+            config.count(endpoint, 'errors')
+            return self._send_json(503, {'error': 'injected_error'})
+
+        dataset = config.dataset
+        page = int(body.get('page') or params.get('page') or 1)
+        if endpoint == '/clinic/list':
+            return self._send_json(200, {'result': dataset.clinics})
+        if endpoint == '/clinic/change':
+            clinic_id = body.get('id')
+            if clinic_id not in dataset.exams_by_clinic:
+                return self._send_json(400, {'error': 'unknown clinic'})
+            session['clinic'] = clinic_id
+            return self._send_json(200, {'result': 'ok'})
+        if endpoint == '/exam/filter':
+            records = dataset.exams_by_clinic[session['clinic']]
+            return self._send_json(200, {'result': paginate(records, page, config.pagination),
+                                         'totalCount': len(records)})
+        if endpoint == '/exam/list':
+            return self._send_json(200, {'result': paginate(dataset.exams, page, config.pagination),
+                                         'totalCount': len(dataset.exams)})
+        if endpoint == '/patient/list':
+            return self._send_json(200, {'result': paginate(dataset.patients, page, config.pagination),
+                                         'totalCount': len(dataset.patients)})
+        if endpoint == '/examData/list':
+            exam_id = params.get('id') or body.get('id')
+            exam = dataset.exams_by_id.get(exam_id)
+            if exam is None:
+                return self._send_json(404, {'error': 'exam not found'})
+            return self._send_json(200, {
+                'examDataList': dataset.images[exam_id],
+                'dataPath': f"{self._base_url()}/cdn",
+                'exam': exam,
+            })
+        return self._send_json(404, {'error': 'not_found', 'path': url.path})
+
+    def _login(self, body):
+        config = self.config
+        email, password = body.get('email'), body.get('password')
+        if not email or (config.email and email != config.email) or (config.password and password != config.password):
+            return self._send_json(401, {'error': 'invalid credentials'})
+        token = uuid.uuid4().hex
+        with config._lock:
+            config.sessions[token] = {'email': email, 'clinic': config.dataset.clinics[0]['id']}
+        self._send_json(200, {'result': {'email': email}},
+                        {'Set-Cookie': f"{SESSION_COOKIE}={token}; Path=/; HttpOnly"})
+
+    def _image(self, image_uuid):
+        config = self.config
+        config.count('/cdn')
+        image_uuid = image_uuid.split('?')[0].removesuffix('.jpg')
+        if image_uuid not in config.dataset.image_owner:
+            # CloudFront answers unknown keys with an XML error page
+            return self._send(403, b'<?xml version="1.0"?><Error><Code>AccessDenied</Code></Error>',
+                              'application/xml')
+        config.delay(config.cdn_latency)
+        data = config.dataset.image_bytes(image_uuid)
+        config.throttle(len(data))
+        config.count('/cdn', 'images')
+        config.count('/cdn', 'bytes', len(data))
+        self._send(200, data, 'image/jpeg')
+
+
+def start_standin(host='127.0.0.1', port=0, verbose=False, dataset=None, images=None, **config):
+    """Start the stand-in in a background thread. Returns (server, base_url)."""
+    if dataset is None:
+        dataset = Dataset.for_image_count(images) if images else Dataset()
+    server = ThreadingHTTPServer((host, port), StandinHandler)
+    server.daemon_threads = True
+    server.config = StandinConfig(dataset, **config)
+    server.verbose = verbose
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local EyerCloud API + CloudFront stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--images', type=int, default=0, help='Size the dataset to about N images')
+    parser.add_argument('--patients', type=int, default=100)
+    parser.add_argument('--exams-per-patient', type=int, default=2)
+    parser.add_argument('--images-per-exam', type=int, default=5)
+    parser.add_argument('--clinics', type=int, default=1)
+    parser.add_argument('--image-kb', type=float, default=200, help='Size of each synthetic JPEG')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Delay added to every API call')
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--cdn-latency-ms', type=float, default=0, help='Delay added to every image GET')
+    parser.add_argument('--cdn-bandwidth-mbps', type=float, default=0, help='Shared image egress cap (0 = unlimited)')
+    parser.add_argument('--pagination', choices=sorted(PAGINATION_MODES), default='repeat-last')
+    parser.add_argument('--rate-limit', type=float, default=0, help='API requests/s per session (0 = unlimited)')
+    parser.add_argument('--burst', type=float, default=0, help='Rate-limit bucket size (default: = rate)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of API calls answered with 503')
+    parser.add_argument('--email', default=None, help='Only accept this login (default: any)')
+    parser.add_argument('--password', default=None, help='Only accept this password (default: any)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help='Log every request')
+    args = parser.parse_args()
+
+    dataset_options = {'clinics': args.clinics, 'image_kb': args.image_kb, 'seed': args.seed,
+                       'images_per_exam': args.images_per_exam, 'exams_per_patient': args.exams_per_patient}
+    if args.images:
+        dataset = Dataset.for_image_count(args.images, **dataset_options)
+    else:
+        dataset = Dataset(patients=args.patients, **dataset_options)
+
+    server, base_url = start_standin(
+        args.host, args.port, args.verbose, dataset=dataset,
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, cdn_latency_ms=args.cdn_latency_ms,
+        cdn_bandwidth_mbps=args.cdn_bandwidth_mbps, pagination=args.pagination,
+        rate_limit=args.rate_limit, burst=args.burst, error_rate=args.error_rate,
+        email=args.email, password=args.password, seed=args.seed,
+    )
+    print("=" * 65)
+    print("  EyerCloud stand-in")
+    print(f"  Listening:  {base_url}")
+    print(f"  Dataset:    {len(dataset.clinics)} clinics, {len(dataset.patients)} patients, "
+          f"{len(dataset.exams)} exams, {dataset.image_count} images ({args.image_kb:g} KB each)")
+    print(f"  Latency:    API {args.latency_ms} ms (+{args.jitter_ms} jitter), CDN {args.cdn_latency_ms} ms")
+    print(f"  Pagination: {args.pagination} ({PAGINATION_MODES[args.pagination]})")
+    print(f"  Rate limit: {args.rate_limit or 'none'}{' req/s per session' if args.rate_limit else ''}")
+    print(f"  Errors:     {args.error_rate:.1%} -> HTTP 503")
+    print("=" * 65)
+    print(f"\n  EYERCLOUD_DOMAIN={base_url}\n")
+    try:
+        while True:
+            time.sleep(10)
+            c = server.config.counters
+            print(f"  requests {c['requests']}  429s {c['rate_limited']}  errors {c['errors']}  "
+                  f"images {c['images']}  {c['bytes'] / (1024 * 1024):.1f} MB")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@ Fetch anamnesis (disease data) from EyerCloud patient API.
 Uses POST /patient/list with pagination to get all 451 patients.
 Updates download_state.json with real disease data from anamnesis field.
 
+Superseded by metadata_snapshot.py (`apply --only anamnesis`).
+
 Usage:
     cd scripts/eyercloud_downloader
     python fetch_anamnesis.py
@@ -19,6 +21,9 @@ except ImportError:
     print("pip install playwright && playwright install chromium")
     exit(1)
 
+from browser_bootstrap import login_eyercloud
+from text_normalize import normalize_name
+
 STATE_FILE = Path("download_state.json")
 ANAMNESIS_FILE = Path("anamnesis_data.json")
 AUTH_STATE_FILE = Path("auth_state.json")
@@ -37,15 +42,6 @@ def save_state(state):
     STATE_FILE.write_text(json.dumps(state, indent=2, ensure_ascii=False, default=str), encoding='utf-8')
 
 
-def normalize(name):
-    import unicodedata
-    name = name.upper().strip()
-    name = unicodedata.normalize('NFD', name)
-    name = ''.join(c for c in name if unicodedata.category(c) != 'Mn')
-    name = ' '.join(name.split())
-    return name
-
-
 async def main():
     state = load_state()
     print(f"=== Fetch Anamnesis from EyerCloud Patient API ===\n")
@@ -62,23 +58,11 @@ async def main():
 
         page = await context.new_page()
 
-        # Open EyerCloud login page
-        print("Opening EyerCloud...")
-        await page.goto(BASE_URL, timeout=60000)
-
-        print("\n" + "=" * 50)
-        print("  FACA LOGIN NO NAVEGADOR")
-        print("  Voce tem 15 segundos...")
-        print("=" * 50 + "\n")
-
-        for i in range(15, 0, -1):
-            print(f"  Aguardando... {i}s", end='\r')
-            await asyncio.sleep(1)
-        print("  Tempo esgotado! Continuando...     ")
-
-        # Save session for next time
-        await context.storage_state(path=str(AUTH_STATE_FILE))
-        print("Session saved!\n")
+        # Saved session is checked with one API call; the browser login only runs if it fails
+        if not await login_eyercloud(page, None, None, AUTH_STATE_FILE):
+            print("FATAL: Could not login.")
+            await browser.close()
+            return
 
         # Fetch all patients page by page
         all_patients = []
@@ -150,7 +134,7 @@ async def main():
             name = pat.get('fullName', '')
             if not name:
                 continue
-            norm = normalize(name)
+            norm = normalize_name(name)
             anamnesis = pat.get('anamnesis', {}) or {}
             other = pat.get('otherDisease', '')
 
@@ -170,7 +154,7 @@ async def main():
             patient_name = detail.get('patient_name', '')
             if not patient_name:
                 continue
-            norm = normalize(patient_name)
+            norm = normalize_name(patient_name)
             cloud_data = name_to_anamnesis.get(norm)
             if not cloud_data:
                 continue
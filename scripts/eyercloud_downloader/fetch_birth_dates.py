@@ -2,6 +2,8 @@
 """
 Fetch birth dates from EyerCloud patient/list API
 Updates download_state.json with birthday field
+
+Superseded by metadata_snapshot.py (`apply --only birthday`).
 """
 import asyncio
 import json
@@ -14,6 +16,9 @@ except ImportError:
     print("pip install playwright && playwright install chromium")
     exit(1)
 
+from browser_bootstrap import login_eyercloud
+from text_normalize import normalize_name
+
 STATE_FILE = Path("download_state.json")
 AUTH_STATE_FILE = Path("auth_state.json")
 BASE_URL = "https://ec2.eyercloud.com"
@@ -41,23 +46,11 @@ async def fetch_birth_dates():
 
         page = await context.new_page()
 
-        # Open EyerCloud login page
-        print("Opening EyerCloud...")
-        await page.goto(BASE_URL, timeout=60000)
-
-        print("\n" + "=" * 60)
-        print("  FACA LOGIN NO NAVEGADOR")
-        print("  Voce tem 30 segundos...")
-        print("=" * 60 + "\n")
-
-        for i in range(30, 0, -1):
-            print(f"  Aguardando... {i}s", end='\r')
-            await asyncio.sleep(1)
-        print("  Tempo esgotado! Continuando...     ")
-
-        # Save session for next time
-        await context.storage_state(path=str(AUTH_STATE_FILE))
-        print("Session saved!\n")
+        # Saved session is checked with one API call; the browser login only runs if it fails
+        if not await login_eyercloud(page, None, None, AUTH_STATE_FILE):
+            print("FATAL: Could not login.")
+            await browser.close()
+            return
 
         # Navigate to exams page to ensure session is active
         print("Navigating to exams page...")
@@ -117,15 +110,6 @@ async def fetch_birth_dates():
 
     print(f'\nFetched {len(all_patients)} patients total\n')
 
-    # Normalize name function
-    def normalize(name):
-        import unicodedata
-        name = name.upper().strip()
-        name = unicodedata.normalize('NFD', name)
-        name = ''.join(c for c in name if unicodedata.category(c) != 'Mn')
-        name = ' '.join(name.split())
-        return name
-
     # Update download_state with birth dates
     updates_count = 0
     missing_count = 0
@@ -141,7 +125,7 @@ async def fetch_birth_dates():
         if not patient_name:
             continue
 
-        norm_name = normalize(patient_name)
+        norm_name = normalize_name(patient_name)
 
         # Find matching exam in state by normalized patient name
         matched = False
@@ -150,7 +134,7 @@ async def fetch_birth_dates():
             if not exam_patient_name:
                 continue
 
-            exam_norm_name = normalize(exam_patient_name)
+            exam_norm_name = normalize_name(exam_patient_name)
 
             if exam_norm_name == norm_name:
                 matched = True
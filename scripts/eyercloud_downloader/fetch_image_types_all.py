@@ -5,12 +5,21 @@ Updates image_types.json with UUID -> type mapping for every image.
 
 This replaces the old fetch_image_types.py which only covered ~400 exams.
 
+Incremental by default: an exam is skipped when its UUID list is known
+locally (staging state, download states, or a previous run recorded in
+image_types_exams.json) and every one of those UUIDs is already typed.
+Use --full to call /examData/list for every exam anyway.
+
 Usage:
     cd scripts/eyercloud_downloader
     python fetch_image_types_all.py
+    python fetch_image_types_all.py --concurrency 16 --chunk-size 100
+    python fetch_image_types_all.py --full
+    python fetch_image_types_all.py --email "user@example.com" --password "pass"
 """
 
 import asyncio
+import argparse
 import json
 from pathlib import Path
 from datetime import datetime
@@ -21,15 +30,53 @@ except ImportError:
     print("pip install playwright && playwright install chromium")
     exit(1)
 
+from browser_batch import iter_exam_results, DEFAULT_CONCURRENCY, DEFAULT_CHUNK_SIZE
+from browser_bootstrap import open_browser, login_eyercloud, auth_file_for
+
 TYPES_FILE = Path("image_types.json")
-AUTH_STATE_FILE = Path("auth_state.json")
-BASE_URL = "https://ec2.eyercloud.com"
+EXAM_UUIDS_FILE = Path("image_types_exams.json")
 EXAM_API_URL = "https://eyercloud.com/api/v2/eyercloud/exam/list"
 EXAMDATA_API_URL = "https://eyercloud.com/api/v2/eyercloud/examData/list"
 PAGE_SIZE = 20
 
 
-async def main():
+def load_known_exam_uuids():
+    """exam_id -> set of image UUIDs, from every local state that lists them."""
+    known = {}
+
+    def add(exam_id, images):
+        uuids = {img['uuid'] for img in images if isinstance(img, dict) and img.get('uuid')}
+        if uuids:
+            known.setdefault(exam_id, set()).update(uuids)
+
+    if EXAM_UUIDS_FILE.exists():
+        for exam_id, uuids in json.loads(EXAM_UUIDS_FILE.read_text(encoding='utf-8')).items():
+            known.setdefault(exam_id, set()).update(uuids)
+    for path in Path('.').glob('staging_state_*.json'):
+        for exam_id, images in json.loads(path.read_text(encoding='utf-8')).get('exam_images', {}).items():
+            add(exam_id, images)
+    for path in [Path('download_state.json'), *Path('.').glob('staging_download_state_*.json')]:
+        if not path.exists():
+            continue
+        for exam_id, details in json.loads(path.read_text(encoding='utf-8')).get('exam_details', {}).items():
+            add(exam_id, details.get('image_list', []) + details.get('image_details', []))
+    return known
+
+
+def plan_incremental(all_exams, known, types):
+    """Split exams into (to_fetch, skipped): skipped = every known UUID already typed."""
+    to_fetch, skipped = [], []
+    for exam in all_exams:
+        uuids = known.get(exam['id'])
+        if uuids and all(u in types for u in uuids):
+            skipped.append(exam)
+        else:
+            to_fetch.append(exam)
+    return to_fetch, skipped
+
+
+async def main(args):
+    auth_file = auth_file_for(args.email)
     # Load existing types
     existing_types = {}
     if TYPES_FILE.exists():
@@ -37,38 +84,15 @@ async def main():
     print(f"Existing image_types.json has {len(existing_types)} entries\n")
 
     async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=False)
-
-        if AUTH_STATE_FILE.exists():
-            context = await browser.new_context(storage_state=str(AUTH_STATE_FILE))
-            print("Using saved auth session")
-        else:
-            context = await browser.new_context()
-            print("No saved session - will need to login")
-
-        page = await context.new_page()
+        browser, context, page = await open_browser(p, auth_file)
 
-        print("Opening EyerCloud...")
-        await page.goto(BASE_URL, timeout=60000)
-
-        print("\n" + "=" * 60)
-        print("  FACA LOGIN NO NAVEGADOR")
-        print("  Voce tem 30 segundos...")
-        print("=" * 60 + "\n")
-
-        for i in range(30, 0, -1):
-            print(f"  Aguardando... {i}s", end='\r')
-            await asyncio.sleep(1)
-        print("  Tempo esgotado! Continuando...     ")
-
-        await context.storage_state(path=str(AUTH_STATE_FILE))
+        # Saved session, then credentials, then a manual login in the browser
+        if not await login_eyercloud(page, args.email, args.password, auth_file):
+            print("FATAL: Could not login.")
+            await browser.close()
+            return
         print("Session saved!\n")
 
-        # Navigate to exams page
-        print("Navigating to exams page...")
-        await page.goto("https://eyercloud.com/exams", timeout=60000)
-        await asyncio.sleep(2)
-
         # Step 1: Fetch all exam IDs
         print("=== Step 1: Fetching all exam IDs ===\n")
         all_exams = []
@@ -118,6 +142,14 @@ async def main():
 
         print(f"\nTotal exams found: {len(all_exams)}\n")
 
+        skipped = []
+        if not args.full:
+            known = load_known_exam_uuids()
+            all_exams, skipped = plan_incremental(all_exams, known, existing_types)
+            total = len(all_exams) + len(skipped)
+            print(f"Incremental: {len(skipped)} skipped / {len(all_exams)} to fetch "
+                  f"({len(skipped) / total:.0%} skipped)\n" if total else "Incremental: no exams\n")
+
         # Step 2: For each exam, fetch image types
         print("=== Step 2: Fetching image types per exam ===\n")
         all_types = dict(existing_types)  # Start with existing
@@ -127,68 +159,56 @@ async def main():
         anterior_count = 0
         errors = 0
 
-        for i, exam in enumerate(all_exams):
-            exam_id = exam['id']
-            patient = exam['patient']
-
-            print(f"  [{i+1}/{len(all_exams)}] {patient[:40]:40s} ({exam_id})...", end=' ')
-
-            try:
-                result = await page.evaluate(f"""
-                    async () => {{
-                        const resp = await fetch('{EXAMDATA_API_URL}?id={exam_id}', {{
-                            method: 'POST',
-                            credentials: 'include',
-                            headers: {{'Content-Type': 'application/json'}},
-                            body: '{{}}'
-                        }});
-                        if (!resp.ok) return {{ error: resp.status }};
-                        return await resp.json();
-                    }}
-                """)
-
-                if isinstance(result, dict) and 'error' in result:
-                    print(f"ERROR {result['error']}")
-                    errors += 1
-                    continue
-
-                images = result.get('examDataList', [])
-                exam_new = 0
-                for img in images:
-                    uuid = img.get('uuid', '')
-                    img_type = img.get('type', 'UNKNOWN')
-                    if uuid and uuid not in all_types:
-                        all_types[uuid] = img_type
-                        new_count += 1
-                        exam_new += 1
-
-                    if img_type == 'REDFREE':
-                        redfree_count += 1
-                    elif img_type == 'COLOR':
-                        color_count += 1
-                    elif img_type == 'ANTERIOR':
-                        anterior_count += 1
-
-                print(f"{len(images)} images ({exam_new} new)")
-
-                # Save periodically every 50 exams
-                if (i + 1) % 50 == 0:
-                    TYPES_FILE.write_text(json.dumps(all_types, indent=2, ensure_ascii=False), encoding='utf-8')
-                    print(f"    [saved {len(all_types)} entries]")
-
-                await asyncio.sleep(0.2)
-
-            except Exception as e:
-                print(f"EXCEPTION: {e}")
+        exam_uuids = json.loads(EXAM_UUIDS_FILE.read_text(encoding='utf-8')) if EXAM_UUIDS_FILE.exists() else {}
+        patients = {exam['id']: exam['patient'] for exam in all_exams}
+        i = 0
+        async for result in iter_exam_results(page, patients, url=EXAMDATA_API_URL, concurrency=args.concurrency,
+                                              chunk_size=args.chunk_size, method='POST'):
+            i += 1
+            exam_id = result['id']
+            patient = patients[exam_id]
+
+            if result['error'] or not isinstance(result['data'], dict):
+                print(f"  [{i}/{len(all_exams)}] {patient[:40]:40s} ({exam_id})... ERROR {result['error']}")
                 errors += 1
+                continue
+
+            images = result['data'].get('examDataList', [])
+            exam_uuids[exam_id] = [img['uuid'] for img in images if img.get('uuid')]
+            exam_new = 0
+            for img in images:
+                uuid = img.get('uuid', '')
+                img_type = img.get('type', 'UNKNOWN')
+                if uuid and uuid not in all_types:
+                    all_types[uuid] = img_type
+                    new_count += 1
+                    exam_new += 1
+
+                if img_type == 'REDFREE':
+                    redfree_count += 1
+                elif img_type == 'COLOR':
+                    color_count += 1
+                elif img_type == 'ANTERIOR':
+                    anterior_count += 1
+
+            print(f"  [{i}/{len(all_exams)}] {patient[:40]:40s} ({exam_id})... {len(images)} images ({exam_new} new)")
+
+            # Save periodically every 50 exams
+            if i % 50 == 0:
+                TYPES_FILE.write_text(json.dumps(all_types, indent=2, ensure_ascii=False), encoding='utf-8')
+                EXAM_UUIDS_FILE.write_text(json.dumps(exam_uuids), encoding='utf-8')
+                print(f"    [saved {len(all_types)} entries]")
 
         await browser.close()
 
     # Final save
     TYPES_FILE.write_text(json.dumps(all_types, indent=2, ensure_ascii=False), encoding='utf-8')
+    EXAM_UUIDS_FILE.write_text(json.dumps(exam_uuids), encoding='utf-8')
 
     print(f"\n=== SUMMARY ===")
     print(f"Total exams processed: {len(all_exams)}")
+    if not args.full:
+        print(f"Skipped (already typed): {len(skipped)}  -- skipped/fetched {len(skipped)}/{len(all_exams)}")
     print(f"Total image types in file: {len(all_types)}")
     print(f"New types added: {new_count}")
     print(f"Errors: {errors}")
@@ -202,4 +222,14 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description='Fetch image types for all exams')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'/examData/list requests in flight inside the browser (default: {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f'Exams per page.evaluate call (default: {DEFAULT_CHUNK_SIZE})')
+    parser.add_argument('--email', default=None,
+                        help='Account login (reuses auth_state_<login>.json; default: auth_state.json)')
+    parser.add_argument('--password', default=None, help='Password for automatic login')
+    parser.add_argument('--full', action='store_true',
+                        help='Fetch every exam, even those whose UUIDs are all already typed')
+    asyncio.run(main(parser.parse_args()))
@@ -8,6 +8,8 @@ The patient endpoint (/patient/list) has the complete data.
 This script fetches ALL fields from the patient endpoint and saves to patient_details.json.
 Also updates download_state.json with cpf/gender for each exam.
 
+Superseded by metadata_snapshot.py (one crawl, then `apply --write-legacy`).
+
 Usage:
     cd scripts/eyercloud_downloader
     python fetch_patient_details.py
@@ -24,6 +26,9 @@ except ImportError:
     print("pip install playwright && playwright install chromium")
     exit(1)
 
+from browser_bootstrap import login_eyercloud
+from text_normalize import normalize_name
+
 STATE_FILE = Path("download_state.json")
 DETAILS_FILE = Path("patient_details.json")
 AUTH_STATE_FILE = Path("auth_state.json")
@@ -32,15 +37,6 @@ API_URL = "https://eyercloud.com/api/v2/eyercloud/patient/list"
 PAGE_SIZE = 20  # EyerCloud returns 20 per page
 
 
-def normalize(name):
-    import unicodedata
-    name = name.upper().strip()
-    name = unicodedata.normalize('NFD', name)
-    name = ''.join(c for c in name if unicodedata.category(c) != 'Mn')
-    name = ' '.join(name.split())
-    return name
-
-
 def load_state():
     if STATE_FILE.exists():
         return json.loads(STATE_FILE.read_text(encoding='utf-8'))
@@ -67,23 +63,11 @@ async def main():
 
         page = await context.new_page()
 
-        # Open EyerCloud login page
-        print("Opening EyerCloud...")
-        await page.goto(BASE_URL, timeout=60000)
-
-        print("\n" + "=" * 60)
-        print("  FACA LOGIN NO NAVEGADOR")
-        print("  Voce tem 30 segundos...")
-        print("=" * 60 + "\n")
-
-        for i in range(30, 0, -1):
-            print(f"  Aguardando... {i}s", end='\r')
-            await asyncio.sleep(1)
-        print("  Tempo esgotado! Continuando...     ")
-
-        # Save session for next time
-        await context.storage_state(path=str(AUTH_STATE_FILE))
-        print("Session saved!\n")
+        # Saved session is checked with one API call; the browser login only runs if it fails
+        if not await login_eyercloud(page, None, None, AUTH_STATE_FILE):
+            print("FATAL: Could not login.")
+            await browser.close()
+            return
 
         # Navigate to exams page to ensure session is active
         print("Navigating to exams page...")
@@ -190,7 +174,7 @@ async def main():
         name = detail['name']
         if not name:
             continue
-        norm = normalize(name)
+        norm = normalize_name(name)
         # Keep the one with most data (prefer entries with cpf and gender)
         existing = name_to_details.get(norm)
         if not existing:
@@ -211,7 +195,7 @@ async def main():
         patient_name = exam_data.get('patient_name', '')
         if not patient_name:
             continue
-        norm = normalize(patient_name)
+        norm = normalize_name(patient_name)
         cloud_data = name_to_details.get(norm)
         if not cloud_data:
             continue
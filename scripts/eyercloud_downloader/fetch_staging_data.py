@@ -24,7 +24,6 @@ import asyncio
 import json
 import re
 import sys
-import unicodedata
 import argparse
 from pathlib import Path
 from datetime import datetime
@@ -35,9 +34,12 @@ except ImportError:
     print("pip install playwright && playwright install chromium")
     sys.exit(1)
 
+from browser_bootstrap import open_browser, login_eyercloud, open_exam_page, auth_file_for
+from auth_probe import API_BASE
+from text_normalize import normalize_name
+
 # --- Config ---
-BASE_URL = "https://ec2.eyercloud.com"
-PATIENT_API = "https://eyercloud.com/api/v2/eyercloud/patient/list"
+PATIENT_API = f"{API_BASE}/patient/list"  # EYERCLOUD_DOMAIN, like auth_probe / browser_batch
 # Exam endpoint is called via Sails WebSocket, not HTTP
 EXAM_WS_PATH = "/api/v2/eyercloud/exam/filter-20-last-with-examdata-and-params"
 PAGE_SIZE = 20
@@ -48,17 +50,6 @@ def sanitize_email(email):
     return re.sub(r'[^a-zA-Z0-9]', '_', email.split('@')[0])
 
 
-def normalize_name(name):
-    """Normalize patient name: uppercase, remove accents, single spaces."""
-    if not name:
-        return ''
-    name = name.upper().strip()
-    name = unicodedata.normalize('NFD', name)
-    name = ''.join(c for c in name if unicodedata.category(c) != 'Mn')
-    name = ' '.join(name.split())
-    return name
-
-
 def load_state(state_file):
     if state_file.exists():
         return json.loads(state_file.read_text(encoding='utf-8'))
@@ -78,65 +69,6 @@ def save_state(state, state_file):
     )
 
 
-async def login_eyercloud(page, email, password):
-    """Login to EyerCloud and return True if successful."""
-    print(f"Navigating to {BASE_URL}...")
-    await page.goto(BASE_URL, timeout=60000)
-    await asyncio.sleep(2)
-
-    # Check if already logged in
-    if '/exam' in page.url:
-        print("Already logged in!")
-        return True
-
-    # Fill login form
-    print(f"Logging in as {email}...")
-    try:
-        email_field = page.get_by_placeholder("Email")
-        await email_field.fill(email)
-
-        password_field = page.get_by_placeholder("Senha")
-        await password_field.fill(password)
-        await password_field.press("Enter")
-
-        # Wait for redirect to exam page
-        await page.wait_for_url("**/exam**", timeout=15000)
-        print("Login successful!")
-        return True
-    except Exception as e:
-        print(f"Login failed: {e}")
-        print("Waiting 30s for manual login...")
-        for i in range(30, 0, -1):
-            print(f"  {i}s...", end='\r')
-            await asyncio.sleep(1)
-        if '/exam' in page.url or '/patient' in page.url:
-            print("\nManual login detected!")
-            return True
-        return False
-
-
-async def wait_for_sails_socket(page, timeout=30):
-    """Wait until the Sails.js WebSocket is connected."""
-    print("Waiting for Sails WebSocket connection...", end=' ')
-    for i in range(timeout):
-        is_connected = await page.evaluate("""
-            () => {
-                try {
-                    const app = document.querySelector('#app')?.__vue_app__;
-                    if (!app) return false;
-                    const io = app.config.globalProperties.$io;
-                    return io?.socket?.isConnected() || false;
-                } catch(e) { return false; }
-            }
-        """)
-        if is_connected:
-            print("connected!")
-            return True
-        await asyncio.sleep(1)
-    print("TIMEOUT!")
-    return False
-
-
 async def fetch_exams_via_socket(page, save_callback=None):
     """Fetch ALL exams via Sails WebSocket with pagination.
 
@@ -469,7 +401,7 @@ async def main():
 
     email_safe = sanitize_email(args.email)
     state_file = Path(f"staging_state_{email_safe}.json")
-    auth_file = Path(f"auth_state_{email_safe}.json")
+    auth_file = auth_file_for(args.email)
 
     print(f"=" * 60)
     print(f"  EyerCloud → Staging Fetcher (Sails WebSocket)")
@@ -492,33 +424,18 @@ async def main():
     state['email'] = args.email
 
     async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=False)
+        browser, context, page = await open_browser(p, auth_file)
 
-        if auth_file.exists():
-            context = await browser.new_context(storage_state=str(auth_file))
-            print("Using saved auth session")
-        else:
-            context = await browser.new_context()
-
-        page = await context.new_page()
-
-        # Login
-        logged_in = await login_eyercloud(page, args.email, args.password)
+        # Login (saves auth state)
+        logged_in = await login_eyercloud(page, args.email, args.password, auth_file)
         if not logged_in:
             print("FATAL: Could not login. Exiting.")
             await browser.close()
             sys.exit(1)
-
-        # Save auth state
-        await context.storage_state(path=str(auth_file))
         print("Auth state saved.\n")
 
-        # Navigate to exam page and wait for Sails socket
-        print("Navigating to exam page...")
-        await page.goto(f"{BASE_URL}/exam", timeout=60000)
-        await asyncio.sleep(3)
-
-        socket_ready = await wait_for_sails_socket(page)
+        # Wait for Sails socket on the exam page
+        socket_ready = await open_exam_page(page)
         if not socket_ready:
             print("FATAL: Sails WebSocket did not connect. Exiting.")
             await browser.close()
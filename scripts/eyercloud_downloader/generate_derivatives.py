@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Generate thumbnails and previews for uploaded fundus images.
+============================================================
+The Laudo terminal and Results pages load full-resolution images for every
+thumbnail. This script makes two fixed-size derivatives per image (JPEG and
+WebP each), uploads them next to the original and records their URLs in the
+mapping:
+
+    /neuroapp/patients/FOLDER/UUID.jpg           (original)
+    /neuroapp/patients/FOLDER/UUID_thumb.jpg     (256px,  + .webp)
+    /neuroapp/patients/FOLDER/UUID_preview.jpg   (1024px, + .webp)
+
+Decoding uses the JPEG draft mode, so libjpeg downscales in the DCT domain
+(1/2, 1/4, 1/8) before the final resize -- most of the decode work is
+skipped. Work runs in a process pool.
+
+Regeneration is incremental: derivatives_index.json maps each source
+content hash (sha256) to its uploaded derivatives, and a (path, size, mtime)
+cache avoids re-hashing unchanged files. Only new content is processed.
+
+Usage:
+    cd scripts/eyercloud_downloader
+    python generate_derivatives.py --mapping ../../bytescale_mapping_v2.json --dry-run
+    python generate_derivatives.py --mapping ../../bytescale_mapping_v2.json
+    python generate_derivatives.py --mapping ../../bytescale_mapping_staging_mozaniareis.json \\
+        --downloads downloads_staging/mozaniareis --workers 8
+"""
+
+import os
+import io
+import hashlib
+import argparse
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from bytescale_backend import get_backend
+from etl_common import load_json, save_json
+
+INDEX_FILE = Path("derivatives_index.json")
+OUTPUT_DIR = Path("derivatives")
+
+# kind -> longest side in pixels
+SIZES = {
+    'thumb': 256,
+    'preview': 1024,
+}
+FORMATS = {
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', {'quality': 78, 'method': 4}),
+}
+
+_done_hashes = frozenset()
+
+
+def derivative_filename(uuid, kind, ext):
+    return f"{uuid}_{kind}.{ext}"
+
+
+def is_derivative_filename(filename):
+    stem = filename.rsplit('.', 1)[0]
+    return any(stem.endswith(f"_{kind}") for kind in SIZES)
+
+
+def file_sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _init_worker(done_hashes):
+    global _done_hashes
+    _done_hashes = done_hashes
+
+
+def render_derivatives(src_path, out_dir, uuid):
+    """Worker: hash the source and write every derivative not already known.
+
+    Returns (sha256, {'thumb.jpg': local_path, ...}) -- the dict is empty when
+    the hash was already processed in an earlier run.
+    """
+    from PIL import Image
+
+    data = Path(src_path).read_bytes()
+    sha = file_sha256(data)
+    if sha in _done_hashes:
+        return sha, {}
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    outputs = {}
+
+    # Largest first: draft() can only shrink, so re-open per size
+    for kind, size in sorted(SIZES.items(), key=lambda kv: -kv[1]):
+        img = Image.open(io.BytesIO(data))
+        # DCT-domain downscale to the smallest scale still >= target size
+        img.draft('RGB', (size, size))
+        img = img.convert('RGB')
+        img.thumbnail((size, size), Image.LANCZOS, reducing_gap=2.0)
+        for ext, (fmt, options) in FORMATS.items():
+            target = out_dir / derivative_filename(uuid, kind, ext)
+            img.save(target, fmt, **options)
+            outputs[f"{kind}.{ext}"] = str(target)
+
+    return sha, outputs
+
+
+def resolve_local_path(folder_name, img, downloads_dirs):
+    local = img.get('local_path', '')
+    if local and os.path.exists(local):
+        return Path(local)
+    for base in downloads_dirs:
+        candidate = Path(base) / folder_name / img.get('filename', '')
+        if candidate.is_file():
+            return candidate
+    return None
+
+
+def apply_derivatives(img, entry):
+    """Record derivative URLs on a mapping image entry."""
+    urls = entry['urls']
+    img['content_hash'] = entry['sha256']
+    img['derivatives'] = {
+        kind: {ext: urls.get(f"{kind}.{ext}", '') for ext in FORMATS}
+        for kind in SIZES
+    }
+    img['thumbnail_url'] = urls.get('thumb.jpg', '')
+    img['preview_url'] = urls.get('preview.jpg', '')
+
+
+def upload_derivatives(backend, outputs, bytescale_folder):
+    urls = {}
+    for key, local_path in outputs.items():
+        result = backend.upload(local_path, bytescale_folder, Path(local_path).name)
+        if not result:
+            return None
+        urls[key] = result.get('fileUrl') or backend.file_url(result.get('filePath', ''))
+    return urls
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate and upload thumbnails/previews')
+    parser.add_argument('--mapping', required=True, help='Mapping JSON to read and update in place')
+    parser.add_argument('--downloads', action='append', default=None,
+                        help='Where to find originals when local_path is missing (repeatable)')
+    parser.add_argument('--backend', default=None, help="'bytescale' (default) or 'local:<dir>'")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4, help='Process pool size')
+    parser.add_argument('--limit', type=int, default=0, help='Process at most N new images (0=all)')
+    parser.add_argument('--dry-run', action='store_true', help='Render locally, do not upload or save')
+    args = parser.parse_args()
+
+    mapping_path = Path(args.mapping)
+    mapping = load_json(mapping_path)
+    if mapping is None:
+        print(f"ERROR: Mapping not found: {mapping_path}")
+        return
+    downloads_dirs = args.downloads or ['downloads']
+    backend = get_backend(args.backend)
+
+    index = load_json(INDEX_FILE, None) or {'hashes': {}, 'files': {}}
+    done_hashes = frozenset(index['hashes'])
+
+    print("=" * 65)
+    print("  Derivative generator (thumbnails / previews)")
+    print(f"  Mapping:  {mapping_path}")
+    print(f"  Index:    {INDEX_FILE} ({len(done_hashes)} hashes done)")
+    print(f"  Workers:  {args.workers}")
+    print("=" * 65)
+    if args.dry_run:
+        print("*** DRY-RUN MODE -- nothing uploaded or saved ***\n")
+
+    # Phase 1: decide what needs work without touching file contents
+    todo = []
+    reused = 0
+    missing = 0
+    for folder_name, record in mapping.items():
+        if not isinstance(record, dict):
+            continue
+        for img in record.get('images', []):
+            src = resolve_local_path(folder_name, img, downloads_dirs)
+            if src is None:
+                missing += 1
+                continue
+            st = src.stat()
+            cached = index['files'].get(str(src))
+            if cached and cached[0] == st.st_size and cached[1] == st.st_mtime and cached[2] in index['hashes']:
+                apply_derivatives(img, index['hashes'][cached[2]])
+                reused += 1
+                continue
+            uuid = img.get('uuid') or Path(img.get('filename', src.name)).stem
+            todo.append((folder_name, record, img, src, uuid))
+
+    if args.limit > 0:
+        todo = todo[:args.limit]
+    print(f"Up to date: {reused} | No local file: {missing} | To process: {len(todo)}\n")
+
+    # Phase 2: render in the process pool, upload from the parent as results arrive
+    rendered = uploaded = errors = 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                             initargs=(done_hashes,)) as pool:
+        futures = {
+            pool.submit(render_derivatives, str(src), str(OUTPUT_DIR / folder_name), uuid):
+                (folder_name, record, img, src)
+            for folder_name, record, img, src, uuid in todo
+        }
+        for i, future in enumerate(as_completed(futures)):
+            # Checkpoint before the continue paths below, so cached/dedup runs save too
+            if i and i % 50 == 0:
+                print(f"   ... {i}/{len(todo)} processed")
+                if not args.dry_run:
+                    save_json(index, INDEX_FILE)
+                    save_json(mapping, mapping_path)
+            folder_name, record, img, src = futures[future]
+            try:
+                sha, outputs = future.result()
+            except Exception as e:
+                errors += 1
+                print(f"   FAIL {src.name}: {e}")
+                continue
+
+            st = src.stat()
+            index['files'][str(src)] = [st.st_size, st.st_mtime, sha]
+
+            if not outputs:
+                # Same content already processed under another path
+                if sha in index['hashes']:
+                    apply_derivatives(img, index['hashes'][sha])
+                continue
+            rendered += 1
+
+            if args.dry_run:
+                continue
+            folder = record.get('bytescale_folder') or img.get('bytescale_path', '').rsplit('/', 1)[0]
+            urls = upload_derivatives(backend, outputs, folder)
+            if urls is None:
+                errors += 1
+                continue
+            entry = {'sha256': sha, 'urls': urls, 'created_at': datetime.now().isoformat()}
+            index['hashes'][sha] = entry
+            apply_derivatives(img, entry)
+            uploaded += 1
+
+    if not args.dry_run:
+        save_json(index, INDEX_FILE)
+        save_json(mapping, mapping_path)
+
+    print("=" * 65)
+    print("  SUMMARY")
+    print("=" * 65)
+    print(f"  Reused (unchanged):   {reused}")
+    print(f"  Rendered:             {rendered}")
+    print(f"  Uploaded:             {uploaded}")
+    print(f"  Missing local file:   {missing}")
+    print(f"  Errors:               {errors}")
+    print("=" * 65)
+
+
+if __name__ == "__main__":
+    main()
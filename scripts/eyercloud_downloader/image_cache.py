@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Disk-budgeted local image cache over downloads/ and downloads_staging/.
+======================================================================
+downloads/ and downloads_staging/<account>/ only ever grow, even after every
+image is safely on Bytescale. This cache keeps them under a disk budget:
+
+    - only images confirmed uploaded (present in a mapping with a Bytescale
+      URL) are ever evicted -- anything not yet uploaded is never touched;
+    - eviction is LRU by last access (recorded by the cache, since filesystem
+      atime is unreliable);
+    - an evicted image is fetched back from the Bytescale CDN on demand, to
+      the same local path, so url_to_local_path() callers keep working.
+
+Index and hit/miss counters live in image_cache_index.json.
+
+Usage:
+    cd scripts/eyercloud_downloader
+    python image_cache.py status
+    python image_cache.py evict --budget 40GB --dry-run
+    python image_cache.py evict --budget 40GB
+    python image_cache.py fetch https://upcdn.io/W142icY/raw/neuroapp/patients/X/UUID.jpg
+
+From other scripts:
+    from image_cache import ImageCache
+    cache = ImageCache.default()
+    path = cache.get(url)        # local Path, fetched from the CDN if evicted
+"""
+
+import os
+import re
+import json
+import time
+import argparse
+import threading
+from pathlib import Path
+
+from etl_common import load_json
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = SCRIPT_DIR.parent.parent
+INDEX_FILE = SCRIPT_DIR / "image_cache_index.json"
+
+# Local roots, each holding FOLDER/UUID.jpg
+DEFAULT_ROOTS = [
+    PROJECT_ROOT / "downloads",
+    SCRIPT_DIR / "downloads",
+]
+STAGING_ROOTS = [PROJECT_ROOT / "downloads_staging", SCRIPT_DIR / "downloads_staging"]
+
+# Mappings that prove an image is on Bytescale: {folder: {'images': [...]}}
+DEFAULT_MAPPINGS = [
+    PROJECT_ROOT / "bytescale_mapping_v2.json",
+    SCRIPT_DIR / "bytescale_mapping_v2.json",
+    SCRIPT_DIR / "bytescale_mapping_reconciled.json",
+]
+DEFAULT_BUDGET = os.getenv('IMAGE_CACHE_BUDGET', '50GB')
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png')
+
+
+def parse_size(text):
+    """'50GB' / '500 MB' / '1024' -> bytes."""
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMGT]?)B?\s*', str(text).upper())
+    if not match:
+        raise ValueError(f"Invalid size: {text!r}")
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** ' KMGT'.index(unit or ' '))
+
+
+def format_size(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+
+class ImageCache:
+    def __init__(self, roots, mappings, budget_bytes, index_file=INDEX_FILE):
+        self.roots = [Path(r) for r in roots]
+        self.budget = budget_bytes
+        self.index_file = Path(index_file)
+        self._lock = threading.Lock()
+
+        index = load_json(self.index_file, None) or {}
+        self.access = index.get('access', {})      # local path -> last access (epoch)
+        self.stats = index.get('stats', {'hits': 0, 'misses': 0, 'fetched_bytes': 0,
+                                         'evicted_files': 0, 'evicted_bytes': 0})
+
+        # url <-> local path for every image some mapping says is uploaded
+        self.url_to_path = {}
+        self.path_to_url = {}
+        self.images = {}  # local path -> its mapping entry (bytescale_path, urls, type)
+        for mapping_path in mappings:
+            self._load_mapping(mapping_path)
+
+    @classmethod
+    def default(cls, budget=DEFAULT_BUDGET):
+        roots = [r for r in DEFAULT_ROOTS if r.exists()] or DEFAULT_ROOTS[:1]
+        mappings = list(DEFAULT_MAPPINGS)
+        # Staging accounts: downloads_staging/<account>/ + bytescale_mapping_staging_<account>.json
+        for staging in STAGING_ROOTS:
+            if staging.exists():
+                for account_dir in staging.iterdir():
+                    if account_dir.is_dir():
+                        roots.append(account_dir)
+                        mappings.append(PROJECT_ROOT / f"bytescale_mapping_staging_{account_dir.name}.json")
+        return cls(roots, mappings, parse_size(budget))
+
+    def _load_mapping(self, mapping_path):
+        mapping = load_json(mapping_path, None)
+        if not isinstance(mapping, dict):
+            return
+        for folder_name, record in mapping.items():
+            if not isinstance(record, dict):
+                continue
+            for img in record.get('images', []):
+                url = img.get('bytescale_url') or img.get('cdn_url')
+                filename = img.get('filename')
+                if not url or not filename:
+                    continue
+                local = self._resolve(folder_name, filename)
+                self.url_to_path[url] = local
+                self.path_to_url[str(local)] = url
+                self.images[str(local)] = img
+
+    def _resolve(self, folder_name, filename):
+        """Existing local file under any root, else where it would go in the first root."""
+        for root in self.roots:
+            candidate = root / folder_name / filename
+            if candidate.exists():
+                return candidate
+        return self.roots[0] / folder_name / filename
+
+    # --- access ---
+
+    def touch(self, path):
+        with self._lock:
+            self.access[str(path)] = time.time()
+
+    def get(self, url):
+        """Local path for a CDN URL; fetches it back if it was evicted. None if unknown."""
+        path = self.url_to_path.get(url)
+        if path is None:
+            return None
+        if path.exists():
+            with self._lock:
+                self.stats['hits'] += 1
+            self.touch(path)
+            return path
+
+        with self._lock:
+            self.stats['misses'] += 1
+        if not self._fetch(url, path):
+            return None
+        self.touch(path)
+        return path
+
+    def _fetch(self, url, path):
+        import requests
+        try:
+            resp = requests.get(url, timeout=60)
+        except Exception as e:
+            print(f"   FAIL fetch {url}: {e}")
+            return False
+        if resp.status_code != 200:
+            print(f"   FAIL fetch {url}: HTTP {resp.status_code}")
+            return False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + '.part')
+        tmp.write_bytes(resp.content)
+        os.replace(tmp, path)
+        with self._lock:
+            self.stats['fetched_bytes'] += len(resp.content)
+        return True
+
+    # --- inventory / eviction ---
+
+    def scan(self):
+        """All local images: list of (path, size, last_access, uploaded)."""
+        entries = []
+        for root in self.roots:
+            if not root.exists():
+                continue
+            for folder in root.iterdir():
+                if not folder.is_dir():
+                    continue
+                for f in folder.iterdir():
+                    if not (f.is_file() and f.suffix.lower() in IMAGE_SUFFIXES):
+                        continue
+                    st = f.stat()
+                    key = str(f)
+                    last = self.access.get(key, st.st_mtime)
+                    entries.append((f, st.st_size, last, key in self.path_to_url))
+        return entries
+
+    def evict(self, budget=None, dry_run=False):
+        """Delete least-recently-used uploaded images until usage <= budget."""
+        budget = self.budget if budget is None else budget
+        entries = self.scan()
+        usage = sum(size for _, size, _, _ in entries)
+        evicted = []
+        if usage <= budget:
+            return usage, evicted
+
+        for path, size, _, uploaded in sorted(entries, key=lambda e: e[2]):
+            if usage <= budget:
+                break
+            if not uploaded:
+                continue
+            if not dry_run:
+                path.unlink(missing_ok=True)
+                with self._lock:
+                    self.access.pop(str(path), None)
+                    self.stats['evicted_files'] += 1
+                    self.stats['evicted_bytes'] += size
+            usage -= size
+            evicted.append((path, size))
+        return usage, evicted
+
+    def hit_rate(self):
+        total = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / total if total else 0.0
+
+    def save(self):
+        with self._lock:
+            data = {'access': self.access, 'stats': self.stats}
+        tmp = self.index_file.with_suffix('.tmp')
+        tmp.write_text(json.dumps(data, ensure_ascii=False), encoding='utf-8')
+        os.replace(tmp, self.index_file)
+
+    def report(self):
+        entries = self.scan()
+        usage = sum(size for _, size, _, _ in entries)
+        uploaded = [e for e in entries if e[3]]
+        print(f"  Roots:            {len(self.roots)}")
+        print(f"  Local images:     {len(entries)} ({format_size(usage)})")
+        print(f"  Evictable:        {len(uploaded)} ({format_size(sum(e[1] for e in uploaded))})")
+        print(f"  Not yet uploaded: {len(entries) - len(uploaded)}")
+        print(f"  Budget:           {format_size(self.budget)}")
+        print(f"  Hits / misses:    {self.stats['hits']} / {self.stats['misses']} "
+              f"(hit rate {self.hit_rate():.1%})")
+        print(f"  Fetched back:     {format_size(self.stats['fetched_bytes'])}")
+        print(f"  Evicted (total):  {self.stats['evicted_files']} files, "
+              f"{format_size(self.stats['evicted_bytes'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Disk-budgeted local image cache')
+    parser.add_argument('command', choices=['status', 'evict', 'fetch'])
+    parser.add_argument('urls', nargs='*', help='CDN URLs for "fetch"')
+    parser.add_argument('--budget', default=DEFAULT_BUDGET, help=f'Disk budget (default: {DEFAULT_BUDGET})')
+    parser.add_argument('--dry-run', action='store_true', help='Show what would be evicted')
+    args = parser.parse_args()
+
+    cache = ImageCache.default(args.budget)
+
+    print("=" * 65)
+    print(f"  Image cache -- {args.command}")
+    print("=" * 65)
+
+    if args.command == 'status':
+        cache.report()
+        return
+
+    if args.command == 'fetch':
+        for url in args.urls:
+            path = cache.get(url)
+            print(f"  {'OK  ' if path else 'FAIL'} {url}\n       -> {path}")
+        cache.save()
+        print(f"\n  Hit rate: {cache.hit_rate():.1%}")
+        return
+
+    usage, evicted = cache.evict(dry_run=args.dry_run)
+    freed = sum(size for _, size in evicted)
+    for path, size in evicted[:20]:
+        print(f"  {'WOULD EVICT' if args.dry_run else 'EVICTED'} {path} ({format_size(size)})")
+    if len(evicted) > 20:
+        print(f"  ... and {len(evicted) - 20} more")
+    if not args.dry_run:
+        cache.save()
+    print(f"\n  Evicted {len(evicted)} files, freed {format_size(freed)}")
+    print(f"  Usage now {format_size(usage)} / budget {format_size(cache.budget)}")
+    if usage > cache.budget:
+        print("  Over budget: the remaining files are not uploaded yet and are kept.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Perceptual-hash duplicate detector for local images (all accounts).
+===================================================================
+The same capture reaches us under different UUIDs through different logins
+(and sometimes twice under one login), which is what fix_duplicate_images.js,
+cleanup_duplicate_exams.js and find_duplicates.js keep cleaning up after the
+fact, in the DB. This finds them on disk, before upload and AutoMorph:
+
+    1. every original .jpg under downloads/ and downloads_staging/<login>/
+       is hashed in a process pool: a 64-bit pHash (DCT of a 32x32 grey
+       thumbnail) and a 256-bit dHash (horizontal gradient of a 17x16 one).
+       JPEGs are decoded in draft mode (1/8 scale), so a 2-4 MB fundus photo
+       costs a few ms instead of a full decode;
+    2. hashes are kept in image_hashes.json by (path, size, mtime), so a
+       re-run only hashes new or changed files;
+    3. images with identical (pHash, dHash) collapse into one node; each
+       node looks up its dHash neighbours (<= --max-dhash of 256 bits) in a
+       multi-index hash of the nodes seen so far -- a few dict lookups per
+       image instead of all pairs -- and a neighbour is a duplicate when the
+       pHash agrees too (<= --max-phash of 64 bits);
+    4. clusters (union-find) go to duplicate_images.json, with one image kept
+       per cluster and the rest listed under "skip" (and under "aliases",
+       each pointing at the copy kept in its place).
+
+Fundus photos share a lot of global structure (dark border, disc, vessels):
+distinct photos often land within a few bits of each other on a 64-bit hash,
+which is why the 256-bit dHash does the search and pHash only confirms.
+(A BK-tree on the 64-bit pHash was tried first: at the radius needed for
+resized copies it visits most of the tree.) The defaults catch re-encodes and
+resized re-uploads of the same capture, not the other eye or a second shot
+of the same eye.
+
+upload_staging_images.py --skip-duplicates does not upload the "skip" list;
+it maps each skipped copy to the upload of the kept one instead, so its exam
+still has every image in bytescale_mapping_staging_<login>.json.
+
+Usage:
+    cd scripts/eyercloud_downloader
+    python image_dedup.py                                 # every known download dir
+    python image_dedup.py --root downloads_staging/x --state staging_download_state_x.json
+    python image_dedup.py --max-phash 12 --max-dhash 16 --show 20
+    python image_dedup.py --workers 8 --full              # ignore the hash cache
+"""
+
+import os
+import math
+import time
+import argparse
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+from etl_common import UnionFind, load_json, save_json
+from jpeg_scrub import discover_targets, iter_images, folder_to_exam
+from profiling import profile_main
+
+HASH_FILE = Path("image_hashes.json")
+DUPLICATES_FILE = Path("duplicate_images.json")
+CHUNK_SIZE = 64
+SAVE_EVERY = 5000  # hashes between cache checkpoints
+DEFAULT_MAX_PHASH = 10
+DEFAULT_MAX_DHASH = 12
+
+PHASH_SIZE = 32
+PHASH_LOW = 8
+DHASH_SIZE = 16
+# Rows 0..7 of the 32-point DCT-II basis; only the low-frequency 8x8 block is kept
+_DCT = [[math.cos(math.pi * (2 * x + 1) * u / (2 * PHASH_SIZE)) for x in range(PHASH_SIZE)]
+        for u in range(PHASH_LOW)]
+
+
+def _bits(flags):
+    value = 0
+    for flag in flags:
+        value = (value << 1) | bool(flag)
+    return value
+
+
+def _grey(img, size):
+    from PIL import Image
+    resample = getattr(Image, 'Resampling', Image).LANCZOS
+    return img.resize(size, resample).tobytes()  # mode 'L': one byte per pixel
+
+
+def phash(img):
+    """64-bit pHash: low 8x8 DCT coefficients of a 32x32 grey image vs their median."""
+    px = _grey(img, (PHASH_SIZE, PHASH_SIZE))
+    rows = [px[y * PHASH_SIZE:(y + 1) * PHASH_SIZE] for y in range(PHASH_SIZE)]
+    # separable DCT: along x for every row, then along y for the 8 kept columns
+    by_row = [[sum(c * p for c, p in zip(basis, row)) for basis in _DCT] for row in rows]
+    coeffs = [sum(_DCT[v][y] * by_row[y][u] for y in range(PHASH_SIZE))
+              for v in range(PHASH_LOW) for u in range(PHASH_LOW)]
+    median = sorted(coeffs)[len(coeffs) // 2]
+    return _bits(c > median for c in coeffs)
+
+
+def dhash(img):
+    """256-bit dHash: is each pixel of a 17x16 grey image darker than its right neighbour."""
+    n = DHASH_SIZE
+    px = _grey(img, (n + 1, n))
+    return _bits(px[y * (n + 1) + x] < px[y * (n + 1) + x + 1] for y in range(n) for x in range(n))
+
+
+def hash_image(path):
+    """Worker: (phash, dhash) as hex strings, or (None, reason)."""
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(path) as img:
+            img.draft('L', (PHASH_SIZE * 2, PHASH_SIZE * 2))
+            img = img.convert('L')
+            return f"{phash(img):016x}", f"{dhash(img):064x}"
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError) as e:
+        return None, f"decode failed: {e}"
+
+
+def _hash_entry(entry):
+    path, size, mtime = entry
+    ph, dh = hash_image(path)
+    return path, size, mtime, ph, dh
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class MultiIndex:
+    """Multi-index hashing: exact Hamming range search for one fixed radius.
+
+    The bits are split into radius + 1 blocks; two values within the radius
+    must agree exactly on at least one block (pigeonhole), so each block is a
+    plain dict lookup. Blocks take every (radius + 1)-th bit rather than a
+    contiguous run, so each one samples the whole image -- contiguous blocks
+    over the dark border would all fall into one bucket.
+    """
+
+    def __init__(self, bits, radius):
+        self.radius = radius
+        blocks = radius + 1
+        self.masks = [sum(1 << i for i in range(j, bits, blocks)) for j in range(blocks)]
+        self.tables = [{} for _ in self.masks]
+
+    def add(self, value, payload):
+        entry = (value, payload)  # one object shared by every block table
+        for mask, table in zip(self.masks, self.tables):
+            table.setdefault(value & mask, []).append(entry)
+
+    def query(self, value):
+        """(distance, payload) of every stored entry within the radius."""
+        found = []
+        seen = set()  # entries, not values: equal values may carry different payloads
+        for mask, table in zip(self.masks, self.tables):
+            for entry in table.get(value & mask, ()):
+                if id(entry) in seen:
+                    continue
+                seen.add(id(entry))
+                other, payload = entry
+                d = hamming(value, other)
+                if d <= self.radius:
+                    found.append((d, payload))
+        return found
+
+
+def find_clusters(hashes, max_phash=DEFAULT_MAX_PHASH, max_dhash=DEFAULT_MAX_DHASH):
+    """Groups of keys whose images are near-duplicates.
+
+    hashes: {key: (phash_int, dhash_int)}. Returns (clusters, comparisons), each
+    cluster a list of keys in input order, largest clusters first.
+    """
+    keys = list(hashes)
+    nodes = {}  # identical (phash, dhash) -> member indexes
+    for i, key in enumerate(keys):
+        nodes.setdefault(hashes[key], []).append(i)
+
+    uf = UnionFind(len(keys))
+    for members in nodes.values():
+        for i in members[1:]:
+            uf.union(members[0], i)
+
+    index = MultiIndex(DHASH_SIZE * DHASH_SIZE, max_dhash)
+    comparisons = 0
+    for (ph, dh), members in nodes.items():
+        for _, (other_ph, other_first) in index.query(dh):
+            comparisons += 1
+            if hamming(ph, other_ph) <= max_phash:
+                uf.union(members[0], other_first)
+        index.add(dh, (ph, members[0]))
+
+    groups = {}
+    for i in range(len(keys)):
+        groups.setdefault(uf.find(i), []).append(keys[i])
+    clusters = [g for g in groups.values() if len(g) > 1]
+    clusters.sort(key=lambda g: -len(g))
+    return clusters, comparisons
+
+
+def duplicate_aliases(report):
+    """{skipped path: kept path} of a duplicate_images.json report.
+
+    Read from the clusters, so reports written before "aliases" existed work too.
+    """
+    aliases = {}
+    for cluster in report.get('clusters', []):
+        for member in cluster.get('members', []):
+            if member['path'] != cluster['keep']:
+                aliases[member['path']] = cluster['keep']
+    return aliases
+
+
+def describe(path, owner, exam_maps):
+    root, state_file = owner[path]
+    folder_name = Path(path).parent.name
+    return {
+        'path': path,
+        'account': 'legacy' if Path(root).name == 'downloads' else Path(root).name,
+        'folder_name': folder_name,
+        'exam_id': exam_maps[state_file].get(folder_name),
+        'uuid': Path(path).stem,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find near-duplicate images across all local downloads')
+    parser.add_argument('--root', default=None, help='Download dir to scan (default: all known)')
+    parser.add_argument('--state', default=None, help='State file of --root (for exam ids)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4)
+    parser.add_argument('--full', action='store_true', help='Ignore the hash cache and re-hash every file')
+    parser.add_argument('--max-phash', type=int, default=DEFAULT_MAX_PHASH,
+                        help='Max pHash distance of a duplicate (of 64 bits)')
+    parser.add_argument('--max-dhash', type=int, default=DEFAULT_MAX_DHASH,
+                        help='dHash search radius (of 256 bits)')
+    parser.add_argument('--show', type=int, default=5, help='Print the N largest clusters')
+    args = parser.parse_args()
+
+    if args.root:
+        targets = [(Path(args.root), Path(args.state) if args.state else None)]
+    else:
+        targets = discover_targets()
+    if not targets:
+        print("No download directories found.")
+        return
+
+    cache = {} if args.full else load_json(HASH_FILE, {})
+
+    print("=" * 60)
+    print("  Perceptual-hash duplicate detector")
+    print(f"  pHash <= {args.max_phash}, dHash <= {args.max_dhash}")
+    print("=" * 60)
+
+    started = time.perf_counter()
+    total = 0
+    todo = []
+    owner = {}  # path -> (root, state_file)
+    for root, state_file in targets:
+        count = 0
+        for path, size, mtime in iter_images(root):
+            count += 1
+            owner[path] = (root, state_file)
+            hit = cache.get(path)
+            if not (hit and hit[0] == size and hit[1] == mtime):
+                todo.append((path, size, mtime))
+        total += count
+        print(f"  {root}: {count} images")
+
+    print(f"  Cached: {total - len(todo)} | To hash: {len(todo)} ({args.workers} workers)")
+
+    hashed = 0
+    if todo:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            for path, size, mtime, ph, dh in pool.map(_hash_entry, todo, chunksize=CHUNK_SIZE):
+                cache[path] = [size, mtime, ph, dh]
+                hashed += 1
+                if hashed % SAVE_EVERY == 0:
+                    print(f"   ... {hashed}/{len(todo)} hashed")
+                    save_json(cache, HASH_FILE)
+    # Files that are gone would never match again
+    for path in [p for p in cache if p not in owner and (args.root is None or p.startswith(str(args.root)))]:
+        del cache[path]
+    save_json(cache, HASH_FILE)
+    hash_elapsed = time.perf_counter() - started
+
+    hashes = {}
+    unreadable = 0
+    for path in owner:
+        _, _, ph, dh = cache[path]
+        if ph is None:
+            unreadable += 1
+            continue
+        hashes[path] = (int(ph, 16), int(dh, 16))
+
+    t0 = time.perf_counter()
+    clusters, comparisons = find_clusters(hashes, args.max_phash, args.max_dhash)
+    cluster_elapsed = time.perf_counter() - t0
+
+    exam_maps = {}
+    for _, state_file in targets:
+        if state_file not in exam_maps:
+            exam_maps[state_file] = folder_to_exam(load_json(state_file, {}) if state_file else {})
+
+    report = []
+    skip = []
+    aliases = {}
+    for group in clusters:
+        members = [describe(path, owner, exam_maps) for path in group]
+        # Keep the copy from the legacy tree / first account in sorted order
+        members.sort(key=lambda m: (m['account'] != 'legacy', m['account'], m['path']))
+        keep = members[0]['path']
+        accounts = sorted({m['account'] for m in members})
+        report.append({
+            'keep': keep,
+            'accounts': accounts,
+            'cross_account': len(accounts) > 1,
+            'exams': sorted({m['exam_id'] or m['folder_name'] for m in members}),
+            'members': members,
+        })
+        skip.extend(m['path'] for m in members[1:])
+        aliases.update((m['path'], keep) for m in members[1:])
+
+    save_json({
+        'generated_at': datetime.now().isoformat(),
+        'max_phash': args.max_phash,
+        'max_dhash': args.max_dhash,
+        'clusters': report,
+        'skip': skip,
+        'aliases': aliases,
+    }, DUPLICATES_FILE)
+
+    cross = sum(1 for c in report if c['cross_account'])
+    print("=" * 60)
+    print(f"  Images:         {total} ({unreadable} unreadable)")
+    print(f"  Hashed now:     {hashed} in {hash_elapsed:.1f}s")
+    print(f"  Clustering:     {len(hashes)} images, {comparisons} candidate pairs in {cluster_elapsed:.2f}s")
+    print(f"  Clusters:       {len(report)} ({cross} across accounts)")
+    print(f"  Redundant:      {len(skip)} -> {DUPLICATES_FILE}")
+    print("=" * 60)
+    for cluster in report[:args.show]:
+        print(f"\n  {len(cluster['members'])} copies, accounts: {', '.join(cluster['accounts'])}")
+        for member in cluster['members']:
+            mark = 'keep' if member['path'] == cluster['keep'] else 'skip'
+            print(f"    [{mark}] {member['account']:<20} {member['folder_name']}/{member['uuid']}")
+
+
+if __name__ == "__main__":
+    profile_main(main, 'image_dedup')
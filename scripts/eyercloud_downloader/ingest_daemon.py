@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Long-running ingestion daemon with scheduled incremental syncs.
+===============================================================
+Runs ingest_pipeline.py on a schedule for every configured account instead of
+someone launching it by hand. Each cycle is the same list -> /examData/list ->
+download -> verify -> upload -> map flow, but:
+
+    - the browser of each account stays open between cycles, so a cycle only
+      re-checks the Sails socket instead of logging in again;
+    - the listing is incremental: it stops at the first socket page with no
+      unknown exam (newest first); every --full-every cycles it lists the
+      whole account to pick up changed/removed exams;
+    - exams left incomplete by earlier cycles are retried on the next one.
+
+A local HTTP endpoint reports what the daemon is doing:
+
+    GET /health   200 if every account synced within 3 intervals, else 503
+    GET /status   per account: state, last/next sync, last result,
+                  stage queue depths and counts of the running cycle
+
+Accounts come from daemon_accounts.json (passwords from .env):
+
+    {"accounts": [
+        {"email": "mozaniareis@usp.br", "password_env": "EYERCLOUD_SENHA_MOZANIA",
+         "interval_minutes": 5, "args": ["--derivatives"]}
+    ]}
+
+"args" are extra ingest_pipeline.py options for that account.
+
+Usage:
+    cd scripts/eyercloud_downloader
+    python ingest_daemon.py
+    python ingest_daemon.py --config daemon_accounts.json --port 8790
+    python ingest_daemon.py --once              # one cycle per account, then exit
+    curl http://127.0.0.1:8790/status
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import threading
+from pathlib import Path
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+
+from download_staging_images import async_playwright, sanitize_email, load_json, save_json
+from browser_bootstrap import open_browser, login_eyercloud, open_exam_page, wait_for_sails_socket
+from ingest_pipeline import IngestPipeline, build_parser
+from exam_feed import ExamFeed
+from telemetry import Metrics
+from profiling import profile_main
+
+load_dotenv()
+
+DEFAULT_CONFIG = Path("daemon_accounts.json")
+STATUS_FILE = Path("daemon_status.json")
+DEFAULT_PORT = 8790
+DEFAULT_INTERVAL = 5  # minutes
+FULL_LISTING_EVERY = 12  # cycles
+FEED_CONSUMER = 'daemon'
+
+
+def load_accounts(config_file):
+    config = load_json(config_file)
+    if not config or not config.get('accounts'):
+        print(f"ERROR: no accounts in {config_file}")
+        sys.exit(1)
+
+    accounts = []
+    for entry in config['accounts']:
+        password = entry.get('password') or os.getenv(entry.get('password_env', ''), '')
+        if not password:
+            print(f"ERROR: no password for {entry['email']} (set {entry.get('password_env', 'password_env')})")
+            sys.exit(1)
+        accounts.append({
+            'email': entry['email'],
+            'password': password,
+            'interval': float(entry.get('interval_minutes', DEFAULT_INTERVAL)) * 60,
+            'args': list(entry.get('args', [])),
+        })
+    return accounts
+
+
+class AccountWorker:
+    """One account: a warm browser session plus the schedule of its sync cycles."""
+
+    def __init__(self, account, full_every, metrics, saved=None):
+        self.email = account['email']
+        self.email_safe = sanitize_email(self.email)
+        self.interval = account['interval']
+        self.full_every = full_every
+        self.metrics = metrics
+        self.args = build_parser().parse_args(
+            ['--email', self.email, '--password', account['password']] + account['args'])
+        self.auth_file = Path(f"auth_state_{self.email_safe}.json")
+
+        saved = saved or {}
+        self.state = 'starting'
+        self.cycles = 0
+        self.last_sync_started = saved.get('last_sync_started')
+        self.last_sync_finished = saved.get('last_sync_finished')
+        self.last_success = saved.get('last_success')
+        self.last_result = saved.get('last_result')
+        self.last_error = saved.get('last_error')
+        self.next_run = None
+        self.pipeline = None
+
+        self.browser = None
+        self.context = None
+        self.page = None
+
+    # --- session ---
+
+    async def ensure_session(self, playwright):
+        """Reuse the open page when its socket is still connected, otherwise log in again."""
+        if self.page is not None:
+            if '/login' not in self.page.url and await wait_for_sails_socket(self.page, timeout=5):
+                return
+            print(f"[{self.email}] Session went cold, logging in again")
+            await self.close_session()
+
+        self.state = 'login'
+        self.browser, self.context, self.page = await open_browser(playwright, self.auth_file)
+        if not await login_eyercloud(self.page, self.email, self.args.password, self.auth_file):
+            raise RuntimeError('login failed')
+        if not await open_exam_page(self.page):
+            raise RuntimeError('Sails WebSocket not connected')
+
+    async def close_session(self):
+        if self.browser is not None:
+            try:
+                await self.browser.close()
+            except Exception:
+                pass
+        self.browser = self.context = self.page = None
+
+    # --- cycle ---
+
+    async def cycle(self, playwright):
+        self.last_sync_started = datetime.now().isoformat()
+        await self.ensure_session(playwright)
+
+        self.state = 'syncing'
+        incremental = self.cycles % self.full_every != 0
+        metrics = Metrics(f"ingest_daemon_{self.email_safe}", enabled=self.metrics)
+        pipeline = IngestPipeline(self.args, metrics=metrics)
+        self.pipeline = pipeline
+        try:
+            await pipeline.sync(self.page, self.context, incremental=incremental)
+        finally:
+            # Whatever was queued before a failure still gets uploaded and mapped
+            await pipeline.drain()
+            metrics.close(quiet=True)
+            self.pipeline = None
+
+        stages = {s.name: {'ok': s.processed, 'failed': s.failed} for s in pipeline.stages}
+        failed = sum(s.failed for s in pipeline.stages) + pipeline.details_failed
+        if failed == 0 and not self.args.dry_run:
+            ExamFeed(self.email).ack(FEED_CONSUMER)
+        self.cycles += 1
+        return {
+            'listing': 'incremental' if incremental else 'full',
+            'pending_exams': pipeline.pending_exams,
+            'mapped': stages.get('map', {}).get('ok', 0),
+            'failed': failed,
+            'details_failed': pipeline.details_failed,
+            'stages': stages,
+            'seconds': round(time.perf_counter() - pipeline.started_at, 1),
+        }
+
+    async def run(self, playwright, stop, slots, once=False):
+        while not stop.is_set():
+            async with slots:
+                if stop.is_set():
+                    break
+                try:
+                    self.last_result = await self.cycle(playwright)
+                    self.last_success = self.last_sync_finished = datetime.now().isoformat()
+                    self.last_error = None
+                    self.state = 'idle'
+                    print(f"[{self.email}] Cycle done: {self.last_result['mapped']} mapped, "
+                          f"{self.last_result['failed']} failed ({self.last_result['seconds']}s)")
+                except Exception as e:
+                    self.last_sync_finished = datetime.now().isoformat()
+                    self.last_error = f"{type(e).__name__}: {e}"
+                    self.state = 'error'
+                    print(f"[{self.email}] Cycle failed: {self.last_error}")
+                    await self.close_session()
+
+            if once:
+                break
+            self.next_run = (datetime.now() + timedelta(seconds=self.interval)).isoformat()
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.next_run = None
+
+        await self.close_session()
+        self.state = 'stopped'
+
+    # --- status ---
+
+    def healthy(self):
+        """Last successful sync within 3 intervals (or the first one still running cleanly)."""
+        if self.state == 'error' or not self.last_success:
+            return self.state in ('starting', 'login', 'syncing') and not self.last_error
+        age = (datetime.now() - datetime.fromisoformat(self.last_success)).total_seconds()
+        return age < 3 * self.interval
+
+    def status(self):
+        status = {
+            'state': self.state,
+            'interval_seconds': self.interval,
+            'cycles': self.cycles,
+            'session_open': self.page is not None,
+            'last_sync_started': self.last_sync_started,
+            'last_sync_finished': self.last_sync_finished,
+            'last_success': self.last_success,
+            'next_run': self.next_run,
+            'last_result': self.last_result,
+            'last_error': self.last_error,
+            'healthy': self.healthy(),
+        }
+        pipeline = self.pipeline
+        if pipeline is not None:
+            status['current'] = {
+                'pending_exams': pipeline.pending_exams,
+                'elapsed_seconds': round(time.perf_counter() - pipeline.started_at, 1),
+                'queues': {s.name: {'depth': s.inbox.qsize(), 'ok': s.processed, 'failed': s.failed}
+                           for s in pipeline.stages},
+            }
+        try:
+            status['feed_pending'] = len(ExamFeed(self.email).pending(FEED_CONSUMER)['added'])
+        except Exception:
+            status['feed_pending'] = None
+        return status
+
+    def saved_state(self):
+        return {
+            'last_sync_started': self.last_sync_started,
+            'last_sync_finished': self.last_sync_finished,
+            'last_success': self.last_success,
+            'last_result': self.last_result,
+            'last_error': self.last_error,
+        }
+
+
+class Daemon:
+    def __init__(self, accounts, full_every=FULL_LISTING_EVERY, metrics=False, max_parallel=1):
+        saved = load_json(STATUS_FILE) or {}
+        self.started_at = datetime.now()
+        self.workers = [AccountWorker(a, full_every, metrics, saved.get('accounts', {}).get(a['email']))
+                        for a in accounts]
+        self.max_parallel = max_parallel
+
+    def status(self):
+        return {
+            'started_at': self.started_at.isoformat(),
+            'uptime_seconds': round((datetime.now() - self.started_at).total_seconds()),
+            'healthy': all(w.healthy() for w in self.workers),
+            'accounts': {w.email: w.status() for w in self.workers},
+        }
+
+    def save_status(self):
+        save_json({
+            'updated_at': datetime.now().isoformat(),
+            'accounts': {w.email: w.saved_state() for w in self.workers},
+        }, STATUS_FILE)
+
+    async def _save_periodically(self, stop):
+        while not stop.is_set():
+            self.save_status()
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=30)
+            except asyncio.TimeoutError:
+                pass
+        self.save_status()
+
+    async def run(self, once=False):
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:  # Windows
+                pass
+
+        # Cycles share the upload backend and derivatives index; run them one at a time by default
+        slots = asyncio.Semaphore(self.max_parallel)
+        async with async_playwright() as p:
+            saver = asyncio.create_task(self._save_periodically(stop))
+            await asyncio.gather(*(w.run(p, stop, slots, once) for w in self.workers))
+            stop.set()
+            await saver
+
+
+def make_handler(daemon):
+    class StatusHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split('?')[0].rstrip('/')
+            status = daemon.status()
+            if path == '/health':
+                body = {'status': 'ok' if status['healthy'] else 'degraded',
+                        'uptime_seconds': status['uptime_seconds']}
+                code = 200 if status['healthy'] else 503
+            elif path in ('', '/status'):
+                body, code = status, 200
+            else:
+                body, code = {'error': 'not found'}, 404
+            data = json.dumps(body, indent=2, default=str).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StatusHandler
+
+
+def start_status_server(daemon, host, port):
+    server = ThreadingHTTPServer((host, port), make_handler(daemon))
+    threading.Thread(target=server.serve_forever, name='status-server', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scheduled incremental ingestion for every configured account')
+    parser.add_argument('--config', type=Path, default=DEFAULT_CONFIG, help='Accounts file (JSON)')
+    parser.add_argument('--host', default='127.0.0.1', help='Status endpoint address')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Status endpoint port (0 = disabled)')
+    parser.add_argument('--full-every', type=int, default=FULL_LISTING_EVERY,
+                        help='List the whole account every N cycles (incremental otherwise)')
+    parser.add_argument('--max-parallel', type=int, default=1, help='Accounts syncing at the same time')
+    parser.add_argument('--metrics', action='store_true', help='Write telemetry under metrics/ for every cycle')
+    parser.add_argument('--once', action='store_true', help='Run one cycle per account and exit')
+    args = parser.parse_args()
+
+    daemon = Daemon(load_accounts(args.config), full_every=max(1, args.full_every),
+                    metrics=args.metrics, max_parallel=max(1, args.max_parallel))
+
+    print("=" * 65)
+    print("  EyerCloud Ingestion Daemon")
+    for w in daemon.workers:
+        print(f"  {w.email:<35} every {w.interval / 60:g} min")
+    print(f"  Full listing every {args.full_every} cycles")
+    if args.port:
+        server = start_status_server(daemon, args.host, args.port)
+        print(f"  Status:     http://{args.host}:{server.server_address[1]}/status")
+    print("=" * 65)
+
+    asyncio.run(daemon.run(once=args.once))
+    print("Daemon stopped.")
+
+
+if __name__ == '__main__':
+    profile_main(main, 'ingest_daemon')
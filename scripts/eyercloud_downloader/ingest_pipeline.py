@@ -0,0 +1,553 @@
+#!/usr/bin/env python3
+"""
+Streaming ingestion pipeline: download -> verify -> upload -> map.
+==================================================================
+Replaces the manual sequence download_staging_images.py ->
+upload_staging_images.py -> mapping fixes for a new login. Each image flows
+through four stages connected by bounded queues, so the first uploads start
+seconds after the first downloads:
+
+    [browser: list + /examData/list] -> download -> verify -> upload -> map
+
+    download  N threads, CDN GET with the browser session cookies
+    verify    N threads, JPEG SOI/EOI + minimum size
+    upload    N threads, Bytescale (or any bytescale_backend)
+    derive    optional (--derivatives): thumbnails/previews in a process pool
+    map       1 thread, owns mapping + checkpoint + download state
+
+The checkpoint records every UUID that reached the map stage, so an
+interrupted run resumes where it stopped (files already on disk skip the
+download, mapped UUIDs are skipped entirely).
+
+Usage:
+    cd scripts/eyercloud_downloader
+    python ingest_pipeline.py --email "mozaniareis@usp.br" --password "xxx"
+    python ingest_pipeline.py --email "mozaniareis@usp.br" --password "xxx" --resume
+    python ingest_pipeline.py --email "..." --password "..." --download-workers 12 --upload-workers 6
+    python ingest_pipeline.py --email "..." --password "..." --backend local:/tmp/fake_bytescale
+    python ingest_pipeline.py --email "..." --password "..." --derivatives
+    python ingest_pipeline.py --email "..." --password "..." --cache-budget 40GB
+    python ingest_pipeline.py --email "..." --password "..." --resume --work-queue work_queue.json
+
+Output (same files the separate scripts produced):
+    downloads_staging/{email_safe}/PATIENT_EXAMID/UUID.jpg
+    staging_state_{email_safe}.json
+    staging_download_state_{email_safe}.json
+    ../../bytescale_mapping_staging_{email_safe}.json
+    pipeline_checkpoint_{email_safe}.json
+"""
+
+import sys
+import time
+import queue
+import asyncio
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+from download_staging_images import (
+    async_playwright, login_eyercloud, fetch_all_exam_ids_via_socket,
+    record_staging_metadata, exams_from_staging_state, download_image,
+)
+from etl_common import (
+    Account, load_json, save_json, useful_images as select_useful_images, exam_details_record,
+    USEFUL_TYPES, DEFAULT_DATA_PATH,
+)
+from upload_staging_images import sanitize_folder_name
+from bytescale_backend import get_backend
+from browser_batch import iter_exam_data, DEFAULT_CONCURRENCY
+from browser_bootstrap import open_browser, open_exam_page, BASE_URL
+from auth_probe import API_BASE
+from exam_feed import ExamFeed, inventory_from_exams, print_change
+from reconcile_sources import queue_for
+from jpeg_scrub import check_markers as verify_jpeg
+from telemetry import Metrics, host_of
+from profiling import profile_main
+import generate_derivatives
+
+MIN_IMAGE_BYTES = 1000
+
+_STOP = object()
+
+
+class Stage:
+    """A pool of worker threads reading from a bounded inbox."""
+
+    def __init__(self, name, workers, handler, inbox, outbox=None, metrics=None, host='local'):
+        self.name = name
+        self.metrics = metrics
+        self.host = host
+        self.workers = workers
+        self.handler = handler
+        self.inbox = inbox
+        self.outbox = outbox
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _run(self):
+        while True:
+            job = self.inbox.get()
+            if job is _STOP:
+                return
+            started = time.perf_counter()
+            try:
+                ok = self.handler(job)
+            except Exception as e:
+                job['error'] = f"{self.name}: {e}"
+                ok = False
+            elapsed = time.perf_counter() - started
+            if self.metrics is not None:
+                self.metrics.observe(self.name, elapsed, self.host, job.get('bytes', 0), ok)
+            with self._lock:
+                self.busy_seconds += elapsed
+                if ok:
+                    self.processed += 1
+                else:
+                    self.failed += 1
+            if ok and self.outbox is not None:
+                self.outbox.put(job)
+            elif not ok:
+                self.on_failure(job)
+
+    def on_failure(self, job):
+        pass
+
+    def close(self):
+        """Wait for the inbox to drain and all workers to exit."""
+        for _ in self._threads:
+            self.inbox.put(_STOP)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+
+class IngestPipeline:
+    def __init__(self, args, metrics=None):
+        self.args = args
+        self.account = Account(args.email)
+        self.email_safe = self.account.email_safe
+        self.download_dir = self.account.download_dir
+        self.staging_state_file = self.account.staging_state_file
+        self.dl_state_file = self.account.dl_state_file
+        self.checkpoint_file = self.account.checkpoint_file
+        self.mapping_file = self.account.mapping_file
+        self.auth_file = self.account.auth_file
+        self.backend = get_backend(args.backend)
+        self.metrics = metrics or Metrics('ingest_pipeline', enabled=not args.no_metrics)
+        backend_host = host_of(getattr(self.backend, 'api_base', ''))
+
+        self.dl_state = load_json(self.dl_state_file) or self.account.new_dl_state()
+        self.staging_state = load_json(self.staging_state_file) or self.account.new_staging_state()
+        self.checkpoint = load_json(self.checkpoint_file) or {'mapped': [], 'failed': {}}
+        self.mapping = load_json(self.mapping_file) or {}
+        # Mapped here or by upload_staging_images.py (incl. duplicates aliased to a kept copy)
+        self.mapped = set(self.checkpoint['mapped'])
+        self.mapped.update(img['uuid'] for record in self.mapping.values() for img in record.get('images', []))
+        # --work-queue: only these exams, and these UUIDs even if the checkpoint has them
+        self.queue_exams, self.queue_uuids = None, set()
+        if args.work_queue:
+            self.queue_exams, self.queue_uuids = queue_for(load_json(args.work_queue, {}), args.email)
+
+        # Shared between the browser thread and the workers
+        self.cookies = {}
+        self.headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)',
+            'Referer': f'{BASE_URL}/',
+        }
+        self.remaining_per_exam = {}
+        self.state_lock = threading.Lock()
+        self.bytes_downloaded = 0
+        self.first_upload_at = None
+        self.pending_exams = 0
+        self.details_failed = 0  # exams whose /examData/list fetch failed (left pending)
+        self.started_at = time.perf_counter()
+
+        q = args.queue_size
+        self.download_q = queue.Queue(maxsize=q)
+        self.verify_q = queue.Queue(maxsize=q)
+        self.upload_q = queue.Queue(maxsize=q)
+        self.map_q = queue.Queue(maxsize=q)
+        self.queues = [self.download_q, self.verify_q, self.upload_q]
+        self.stages = [
+            Stage('download', args.download_workers, self.do_download, self.download_q, self.verify_q,
+                  self.metrics),
+            Stage('verify', args.verify_workers, self.do_verify, self.verify_q, self.upload_q, self.metrics),
+        ]
+
+        self.derive_pool = None
+        self.derivatives_index = None
+        if args.derivatives:
+            self.derivatives_index = (load_json(generate_derivatives.INDEX_FILE)
+                                      or {'hashes': {}, 'files': {}})
+            self.derive_pool = ProcessPoolExecutor(
+                max_workers=args.derive_workers,
+                initializer=generate_derivatives._init_worker,
+                initargs=(frozenset(self.derivatives_index['hashes']),),
+            )
+            self.derive_q = queue.Queue(maxsize=q)
+            self.queues.append(self.derive_q)
+            self.stages += [
+                Stage('upload', args.upload_workers, self.do_upload, self.upload_q, self.derive_q,
+                      self.metrics, backend_host),
+                Stage('derive', args.derive_workers, self.do_derive, self.derive_q, self.map_q, self.metrics),
+            ]
+        else:
+            self.stages.append(Stage('upload', args.upload_workers, self.do_upload, self.upload_q, self.map_q,
+                                     self.metrics, backend_host))
+
+        self.queues.append(self.map_q)
+        self.stages.append(Stage('map', 1, self.do_map, self.map_q, metrics=self.metrics))
+        for stage in self.stages:
+            stage.on_failure = self.record_failure
+
+    # --- stage handlers (worker threads) ---
+
+    def do_download(self, job):
+        path = job['path']
+        existed = path.exists() and path.stat().st_size > MIN_IMAGE_BYTES
+        ok, size = download_image(job['url'], path, self.cookies, self.headers, self.metrics)
+        if ok and not existed:
+            job['bytes'] = size
+            with self.state_lock:
+                self.bytes_downloaded += size
+        if not ok:
+            job['error'] = 'download failed'
+        return ok
+
+    def do_verify(self, job):
+        ok, reason = verify_jpeg(job['path'])
+        if not ok:
+            job['error'] = f"verify: {reason}"
+            job['path'].unlink(missing_ok=True)
+        return ok
+
+    def do_upload(self, job):
+        if self.args.dry_run:
+            job['result'] = {'filePath': f"{job['bytescale_folder']}/{job['path'].name}", 'fileUrl': ''}
+            return True
+        result = self.backend.upload(job['path'], job['bytescale_folder'], job['path'].name)
+        if not result:
+            job['error'] = 'upload failed'
+            return False
+        job['result'] = result
+        if self.first_upload_at is None:
+            self.first_upload_at = time.perf_counter()
+        return True
+
+    def do_derive(self, job):
+        out_dir = generate_derivatives.OUTPUT_DIR / job['folder_name']
+        future = self.derive_pool.submit(generate_derivatives.render_derivatives,
+                                         str(job['path']), str(out_dir), job['uuid'])
+        sha, outputs = future.result()
+        job['content_hash'] = sha
+        if not outputs or self.args.dry_run:
+            return True
+        urls = generate_derivatives.upload_derivatives(self.backend, outputs, job['bytescale_folder'])
+        if urls is None:
+            job['error'] = 'derivative upload failed'
+            return False
+        job['derivatives'] = {'sha256': sha, 'urls': urls, 'created_at': datetime.now().isoformat()}
+        return True
+
+    def do_map(self, job):
+        folder_name = job['folder_name']
+        result = job['result']
+        entry = self.mapping.setdefault(folder_name, {
+            'patient_name': job['patient_name'],
+            'exam_id': job['exam_id'],
+            'folder_name': folder_name,
+            'bytescale_folder': job['bytescale_folder'],
+            'images': [],
+        })
+        image = {
+            'uuid': job['uuid'],
+            'filename': job['path'].name,
+            'type': job['type'],
+            'bytescale_path': result.get('filePath', ''),
+            'bytescale_url': result.get('fileUrl', ''),
+            'cdn_url': self.backend.file_url(result.get('filePath', '')),
+            'upload_date': datetime.now().isoformat(),
+        }
+        entry['images'] = [img for img in entry['images'] if img.get('uuid') != job['uuid']]
+        entry['images'].append(image)
+
+        if self.derivatives_index is not None:
+            sha = job.get('content_hash')
+            derived = job.get('derivatives') or self.derivatives_index['hashes'].get(sha)
+            if derived:
+                self.derivatives_index['hashes'][sha] = derived
+                generate_derivatives.apply_derivatives(image, derived)
+
+        with self.state_lock:
+            self.mapped.add(job['uuid'])
+            self.checkpoint['failed'].pop(job['uuid'], None)
+            remaining = self.remaining_per_exam.get(job['exam_id'], 0) - 1
+            self.remaining_per_exam[job['exam_id']] = remaining
+            if remaining == 0 and job['exam_id'] not in self.dl_state['downloaded_exams']:
+                self.dl_state['downloaded_exams'].append(job['exam_id'])
+
+        if len(self.mapped) % self.args.checkpoint_every == 0:
+            self.save_checkpoint()
+            self.print_progress()
+        return True
+
+    def record_failure(self, job):
+        with self.state_lock:
+            self.checkpoint['failed'][job['uuid']] = {
+                'exam_id': job['exam_id'],
+                'error': job.get('error', 'unknown'),
+                'at': datetime.now().isoformat(),
+            }
+        print(f"    FAIL {job['uuid'][:12]}... {job.get('error', '')}")
+
+    # --- persistence ---
+
+    def save_checkpoint(self):
+        if self.args.dry_run:
+            return
+        with self.state_lock:
+            self.checkpoint['mapped'] = sorted(self.mapped)
+            self.checkpoint['updated_at'] = datetime.now().isoformat()
+            save_json(self.checkpoint, self.checkpoint_file)
+            save_json(self.dl_state, self.dl_state_file)
+        save_json(self.mapping, self.mapping_file)
+        if self.derivatives_index is not None:
+            save_json(self.derivatives_index, generate_derivatives.INDEX_FILE)
+
+    def print_progress(self):
+        counts = ' | '.join(f"{s.name} {s.processed}" for s in self.stages)
+        depths = ' '.join(f"{q.qsize()}" for q in self.queues)
+        print(f"  [{time.perf_counter() - self.started_at:6.0f}s] {counts} | queues {depths}")
+        sys.stdout.flush()
+
+    # --- producer (browser) ---
+
+    def jobs_for_exam(self, exam, details):
+        exam_id = exam['id']
+        patient = exam.get('patient', {}) or {}
+        patient_name = patient.get('fullName', '') or 'Unknown'
+        data_path = details.get('dataPath', DEFAULT_DATA_PATH)
+        useful_images = select_useful_images(details, USEFUL_TYPES)
+        record = exam_details_record(patient_name, exam_id, useful_images)
+        folder = record['folder_name']
+        bytescale_folder = f"/neuroapp/staging/patients/{sanitize_folder_name(patient_name)}"
+
+        with self.state_lock:
+            self.dl_state['exam_details'][exam_id] = record
+            pending = [img for img in useful_images
+                       if img['uuid'] not in self.mapped or img['uuid'] in self.queue_uuids]
+            self.remaining_per_exam[exam_id] = len(pending)
+            if not pending and exam_id not in self.dl_state['downloaded_exams']:
+                self.dl_state['downloaded_exams'].append(exam_id)
+
+        return [{
+            'exam_id': exam_id,
+            'uuid': img['uuid'],
+            'type': img.get('type'),
+            'url': f"{data_path}/{img['uuid']}",
+            'path': self.download_dir / folder / f"{img['uuid']}.jpg",
+            'folder_name': folder,
+            'patient_name': patient_name,
+            'bytescale_folder': bytescale_folder,
+        } for img in pending]
+
+    async def produce(self, page, context, all_exams):
+        loop = asyncio.get_running_loop()
+        if self.queue_exams is not None:
+            pending_exams = [e for e in all_exams if e['id'] in self.queue_exams]
+        else:
+            pending_exams = [e for e in all_exams if e['id'] not in self.dl_state['downloaded_exams']]
+        if self.args.max_exams > 0:
+            pending_exams = pending_exams[:self.args.max_exams]
+        self.pending_exams = len(pending_exams)
+        print(f"Pending exams: {len(pending_exams)} of {len(all_exams)}\n")
+
+        pending_by_id = {e['id']: e for e in pending_exams}
+        idx = -1
+        async for exam_id, details in iter_exam_data(page, pending_by_id,
+                                                     concurrency=self.args.fetch_concurrency,
+                                                     metrics=self.metrics):
+            idx += 1
+            for job in self.jobs_for_exam(pending_by_id[exam_id], details):
+                # Blocks (off the event loop) when the download queue is full
+                await loop.run_in_executor(None, self.download_q.put, job)
+
+            if (idx + 1) % 50 == 0:
+                await self.refresh_cookies(context)
+                try:
+                    await page.evaluate("() => document.title")
+                except Exception:
+                    pass
+        self.details_failed = len(pending_by_id) - (idx + 1)
+        if self.details_failed:
+            print(f"Exam details failed for {self.details_failed} exams; they stay pending for the next run")
+
+    def start(self):
+        self.download_dir.mkdir(parents=True, exist_ok=True)
+        for stage in self.stages:
+            stage.start()
+
+    async def list_exams(self, page, incremental=False):
+        """Exam list for this run: staging state (--resume) or the socket listing.
+
+        incremental=True stops the listing at the first page with no unknown
+        exam and returns every exam in the staging state, so exams left
+        incomplete by earlier runs are retried too.
+        """
+        if self.args.resume and self.staging_state.get('exams'):
+            all_exams = exams_from_staging_state(self.staging_state)
+            print(f"Resuming with {len(all_exams)} exams from staging state")
+            return all_exams
+
+        known = set(self.staging_state['exams']) if incremental else None
+        with self.metrics.timer('listing', host=host_of(API_BASE)):
+            all_exams, _ = await fetch_all_exam_ids_via_socket(page, known_ids=known)
+        record_staging_metadata(self.staging_state, all_exams)
+        self.staging_state['fetched_at'] = datetime.now().isoformat()
+        if self.args.dry_run:
+            print(f"Dry run: listed {len(all_exams)} exams; staging state and exam feed not saved")
+        else:
+            save_json(self.staging_state, self.staging_state_file)
+            print_change(ExamFeed(self.args.email).update(
+                inventory_from_exams(all_exams), source='ingest_pipeline', partial=incremental))
+        if incremental:
+            return exams_from_staging_state(self.staging_state)
+        return all_exams
+
+    async def refresh_cookies(self, context):
+        cookies_list = await context.cookies()
+        self.cookies = {c['name']: c['value'] for c in cookies_list}
+
+    async def drain(self):
+        # Drain stage by stage: each close() waits for its inbox to empty
+        self.metrics.mark('drain')
+        loop = asyncio.get_running_loop()
+        for stage in self.stages:
+            await loop.run_in_executor(None, stage.close)
+        if self.derive_pool is not None:
+            self.derive_pool.shutdown()
+        self.save_checkpoint()
+
+    async def sync(self, page, context, incremental=False):
+        """One pass over an already logged-in page: list, produce, drain."""
+        self.start()
+        self.metrics.mark('listing')
+        all_exams = await self.list_exams(page, incremental)
+        await self.refresh_cookies(context)
+        self.metrics.mark('produce')
+        await self.produce(page, context, all_exams)
+        await self.drain()
+        return all_exams
+
+    async def run(self):
+        self.start()
+
+        async with async_playwright() as p:
+            self.metrics.mark('login')
+            browser, context, page = await open_browser(p, self.auth_file)
+
+            with self.metrics.timer('login', host=host_of(BASE_URL)) as op:
+                op['ok'] = await login_eyercloud(page, self.args.email, self.args.password, self.auth_file)
+            if not op['ok']:
+                print("FATAL: Could not login.")
+                await browser.close()
+                sys.exit(1)
+
+            if not await open_exam_page(page):
+                print("FATAL: Sails WebSocket not connected.")
+                await browser.close()
+                sys.exit(1)
+
+            self.metrics.mark('listing')
+            all_exams = await self.list_exams(page)
+            await self.refresh_cookies(context)
+
+            self.metrics.mark('produce')
+            await self.produce(page, context, all_exams)
+            await browser.close()
+
+        await self.drain()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Streaming download -> verify -> upload -> map pipeline')
+    parser.add_argument('--email', required=True, help='EyerCloud login email')
+    parser.add_argument('--password', required=True, help='EyerCloud password')
+    parser.add_argument('--resume', action='store_true', help='Reuse exam list from staging state')
+    parser.add_argument('--backend', default=None, help="'bytescale' (default) or 'local:<dir>'")
+    parser.add_argument('--fetch-concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='/examData/list requests in flight inside the browser')
+    parser.add_argument('--download-workers', type=int, default=8)
+    parser.add_argument('--verify-workers', type=int, default=2)
+    parser.add_argument('--upload-workers', type=int, default=4)
+    parser.add_argument('--derivatives', action='store_true', help='Also generate and upload thumbnails/previews')
+    parser.add_argument('--derive-workers', type=int, default=4, help='Process pool size for --derivatives')
+    parser.add_argument('--queue-size', type=int, default=64, help='Capacity of each inter-stage queue')
+    parser.add_argument('--checkpoint-every', type=int, default=25, help='Save checkpoint every N mapped images')
+    parser.add_argument('--max-exams', type=int, default=0, help='Process at most N pending exams (0=all)')
+    parser.add_argument('--cache-budget', default=None,
+                        help='After the run, evict uploaded images until local images fit this budget (e.g. 40GB)')
+    parser.add_argument('--dry-run', action='store_true', help='Download and verify, but do not upload or save')
+    parser.add_argument('--work-queue', default=None,
+                        help="Only process this account's download/upload items of a reconcile_sources.py work queue")
+    parser.add_argument('--no-metrics', action='store_true',
+                        help='Do not write the telemetry timeline/textfile under metrics/')
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+
+    pipeline = IngestPipeline(args)
+
+    print("=" * 65)
+    print("  EyerCloud Ingestion Pipeline")
+    print(f"  Login:      {args.email}")
+    print(f"  Output:     {pipeline.download_dir}")
+    print(f"  Mapping:    {pipeline.mapping_file}")
+    print(f"  Checkpoint: {pipeline.checkpoint_file} ({len(pipeline.mapped)} already mapped)")
+    print(f"  Workers:    download {args.download_workers}, verify {args.verify_workers}, "
+          f"upload {args.upload_workers} (queues of {args.queue_size})")
+    print("=" * 65)
+    if args.dry_run:
+        print("*** DRY-RUN MODE -- no uploads, no state written ***\n")
+
+    asyncio.run(pipeline.run())
+
+    elapsed = time.perf_counter() - pipeline.started_at
+    print(f"\n{'=' * 65}")
+    print("  PIPELINE SUMMARY")
+    print(f"{'=' * 65}")
+    for stage in pipeline.stages:
+        print(f"  {stage.name:<10} ok {stage.processed:>6}  failed {stage.failed:>4}  "
+              f"busy {stage.busy_seconds:8.1f}s")
+    print(f"  Downloaded:  {pipeline.bytes_downloaded / (1024 * 1024):.1f} MB")
+    if pipeline.first_upload_at is not None:
+        print(f"  First upload after {pipeline.first_upload_at - pipeline.started_at:.1f}s")
+    print(f"  Wall time:   {elapsed:.1f}s")
+    print(f"  Failed UUIDs in checkpoint: {len(pipeline.checkpoint['failed'])} (re-run to retry)")
+    print(f"{'=' * 65}")
+    pipeline.metrics.close()
+
+    if args.cache_budget and not args.dry_run:
+        from image_cache import ImageCache, format_size
+        cache = ImageCache.default(args.cache_budget)
+        usage, evicted = cache.evict()
+        cache.save()
+        print(f"Cache: evicted {len(evicted)} uploaded files, local images now {format_size(usage)}")
+
+    print("\nNext: node scripts/import_staging_images.js --execute")
+
+
+if __name__ == '__main__':
+    profile_main(main, 'ingest_pipeline')
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Parallel JPEG integrity scrub with targeted re-download.
+========================================================
+The downloaders only check `size > 1000`, so truncated files and HTML error
+pages saved as .jpg get through and are only noticed when AutoMorph drops
+them. This scrub checks every local image in a process pool:
+
+    - SOI marker (FF D8) at the start, EOI marker (FF D9) near the end;
+    - not an HTML/JSON error body;
+    - header-only decode with Pillow (format, mode and dimensions).
+
+Results are cached in scrub_cache.json by (path, size, mtime), so a repeated
+scrub only reads new or changed files. Failures go to scrub_failures.json.
+
+With --requeue each failed file is moved to scrub_quarantine/ and its exam is
+removed from downloaded_exams in the matching state file. The existing
+downloaders skip files already on disk, so their next run re-fetches only
+the quarantined images:
+    downloads/                  + download_state.json                -> downloader.py / download_missing_48.py
+    downloads_staging/<login>/  + staging_download_state_<login>.json -> download_staging_images.py --resume
+
+Usage:
+    cd scripts/eyercloud_downloader
+    python jpeg_scrub.py                                  # every known download dir
+    python jpeg_scrub.py --root downloads_staging/x --state staging_download_state_x.json
+    python jpeg_scrub.py --workers 8 --requeue
+    python jpeg_scrub.py --full                           # ignore the cache
+"""
+
+import os
+import time
+import argparse
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+from etl_common import load_json, save_json
+
+CACHE_FILE = Path("scrub_cache.json")
+FAILURES_FILE = Path("scrub_failures.json")
+QUARANTINE_DIR = Path("scrub_quarantine")
+MIN_IMAGE_BYTES = 1000
+CHUNK_SIZE = 64
+SAVE_EVERY = 5000  # results between cache checkpoints
+
+
+def check_markers(path):
+    """Structural check: size, SOI at start, EOI near the end, no text body."""
+    path = Path(path)
+    try:
+        size = path.stat().st_size
+        if size <= MIN_IMAGE_BYTES:
+            return False, f"too small ({size} bytes)"
+        with open(path, 'rb') as f:
+            head = f.read(16)
+            f.seek(max(0, size - 32))
+            tail = f.read()
+    except OSError as e:
+        return False, str(e)
+    if head[:2] != b'\xff\xd8':
+        if head.lstrip()[:1] in (b'<', b'{'):
+            return False, "HTML/JSON error page"
+        return False, "missing SOI marker"
+    if b'\xff\xd9' not in tail:
+        return False, "missing EOI marker (truncated?)"
+    return True, ''
+
+
+def check_image(path):
+    """Worker: markers, then a header-only decode (no pixel data is read)."""
+    ok, reason = check_markers(path)
+    if not ok:
+        return ok, reason
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(path) as img:
+            if img.format != 'JPEG':
+                return False, f"decoded as {img.format}"
+            width, height = img.size
+            if width == 0 or height == 0:
+                return False, "zero dimensions"
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError) as e:
+        return False, f"header decode failed: {e}"
+    return True, ''
+
+
+def _check_entry(entry):
+    path, size, mtime = entry
+    ok, reason = check_image(path)
+    return path, size, mtime, ok, reason
+
+
+# --- targets ---
+
+def discover_targets():
+    """(download_dir, state_file) pairs the downloaders write to."""
+    targets = []
+    if Path("downloads").is_dir():
+        targets.append((Path("downloads"), Path("download_state.json")))
+    staging = Path("downloads_staging")
+    if staging.is_dir():
+        for sub in sorted(p for p in staging.iterdir() if p.is_dir()):
+            targets.append((sub, Path(f"staging_download_state_{sub.name}.json")))
+    return targets
+
+
+def iter_images(root):
+    """(path, size, mtime) of every original .jpg under root (derivatives excluded)."""
+    for folder in os.scandir(root):
+        if not folder.is_dir():
+            continue
+        with os.scandir(folder.path) as it:
+            for entry in it:
+                name = entry.name
+                if not entry.is_file() or not name.lower().endswith('.jpg'):
+                    continue
+                if name.rsplit('.', 1)[0].endswith(('_thumb', '_preview')):
+                    continue
+                st = entry.stat()
+                yield entry.path, st.st_size, st.st_mtime
+
+
+def folder_to_exam(state):
+    return {d.get('folder_name'): eid for eid, d in state.get('exam_details', {}).items() if d.get('folder_name')}
+
+
+def requeue(failures):
+    """Quarantine failed files and un-mark their exams so the downloaders re-fetch them."""
+    by_state = {}
+    for failure in failures:
+        src = Path(failure['path'])
+        if src.exists():
+            target = QUARANTINE_DIR / Path(failure['root']).name / src.parent.name / src.name
+            target.parent.mkdir(parents=True, exist_ok=True)
+            src.replace(target)
+            failure['quarantined'] = str(target)
+        if failure.get('exam_id') and failure.get('state_file'):
+            by_state.setdefault(failure['state_file'], set()).add(failure['exam_id'])
+
+    for state_file, exam_ids in by_state.items():
+        state = load_json(state_file)
+        if state is None:
+            continue
+        before = len(state.get('downloaded_exams', []))
+        state['downloaded_exams'] = [eid for eid in state.get('downloaded_exams', []) if eid not in exam_ids]
+        save_json(state, state_file)
+        print(f"  {state_file}: {before - len(state['downloaded_exams'])} exams re-queued for download")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check local JPEGs and queue broken ones for re-download')
+    parser.add_argument('--root', default=None, help='Download dir to scrub (default: all known)')
+    parser.add_argument('--state', default=None, help='State file of --root (for --requeue)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4)
+    parser.add_argument('--full', action='store_true', help='Ignore the cache and re-check every file')
+    parser.add_argument('--requeue', action='store_true',
+                        help='Quarantine failures and remove their exams from downloaded_exams')
+    args = parser.parse_args()
+
+    if args.root:
+        targets = [(Path(args.root), Path(args.state) if args.state else None)]
+    else:
+        targets = discover_targets()
+    if not targets:
+        print("No download directories found.")
+        return
+
+    cache = {} if args.full else load_json(CACHE_FILE, {})
+
+    print("=" * 60)
+    print("  JPEG integrity scrub")
+    print("=" * 60)
+
+    started = time.perf_counter()
+    failures = []
+    total = cached_ok = 0
+    todo = []
+    owner = {}  # path -> (root, state_file)
+    for root, state_file in targets:
+        count = 0
+        for path, size, mtime in iter_images(root):
+            count += 1
+            owner[path] = (root, state_file)
+            hit = cache.get(path)
+            if hit and hit[0] == size and hit[1] == mtime:
+                if hit[2]:
+                    cached_ok += 1
+                else:
+                    failures.append({'path': path, 'reason': hit[3]})
+                continue
+            todo.append((path, size, mtime))
+        total += count
+        print(f"  {root}: {count} images")
+
+    print(f"  Cached: {total - len(todo)} | To check: {len(todo)} ({args.workers} workers)")
+
+    checked = 0
+    if todo:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            for path, size, mtime, ok, reason in pool.map(_check_entry, todo, chunksize=CHUNK_SIZE):
+                cache[path] = [size, mtime, ok, reason]
+                checked += 1
+                if not ok:
+                    failures.append({'path': path, 'reason': reason})
+                if checked % SAVE_EVERY == 0:
+                    print(f"   ... {checked}/{len(todo)} checked")
+                    save_json(cache, CACHE_FILE)
+        save_json(cache, CACHE_FILE)
+
+    # Attach exam ids so the failures can be re-fetched by exam
+    exam_by_folder = {}
+    for failure in failures:
+        root, state_file = owner[failure['path']]
+        if state_file not in exam_by_folder:
+            state = load_json(state_file, {}) if state_file else {}
+            exam_by_folder[state_file] = folder_to_exam(state)
+        folder_name = Path(failure['path']).parent.name
+        failure.update({
+            'root': str(root),
+            'state_file': str(state_file) if state_file else None,
+            'folder_name': folder_name,
+            'exam_id': exam_by_folder[state_file].get(folder_name),
+            'uuid': Path(failure['path']).stem,
+        })
+
+    save_json({'scrubbed_at': datetime.now().isoformat(), 'failures': failures}, FAILURES_FILE)
+
+    reasons = {}
+    for failure in failures:
+        key = failure['reason'].split(':')[0]
+        reasons[key] = reasons.get(key, 0) + 1
+
+    elapsed = time.perf_counter() - started
+    print("=" * 60)
+    print(f"  Images:        {total}")
+    print(f"  From cache:    {total - len(todo)} ({cached_ok} ok)")
+    print(f"  Checked now:   {checked} in {elapsed:.1f}s")
+    print(f"  Failures:      {len(failures)} -> {FAILURES_FILE}")
+    for reason, count in sorted(reasons.items(), key=lambda kv: -kv[1]):
+        print(f"    {count:>6}  {reason}")
+    unknown = sum(1 for f in failures if not f['exam_id'])
+    if unknown:
+        print(f"  ({unknown} failures are in folders not found in any state file)")
+    print("=" * 60)
+
+    if args.requeue and failures:
+        requeue(failures)
+        save_json({'scrubbed_at': datetime.now().isoformat(), 'failures': failures}, FAILURES_FILE)
+        # Quarantined paths are gone; their cache entries would never match again
+        for failure in failures:
+            cache.pop(failure['path'], None)
+        save_json(cache, CACHE_FILE)
+        print(f"  Quarantined {sum(1 for f in failures if 'quarantined' in f)} files in {QUARANTINE_DIR}/")
+        print("  Re-run the downloader for each state file to fetch them again.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+"""
+Bulk loader: staging_state_*.json + Bytescale mapping -> staging Postgres.
+==========================================================================
+Replaces the row-by-row Prisma imports (scripts/import_staging_data.js and
+scripts/import_staging_images.js). For each account the patients, exams and
+images are streamed into temp tables with COPY, then merged into the real
+tables (prisma-staging/schema.prisma) with set-based SQL. All accounts are
+loaded in ONE transaction: either the whole refresh lands or nothing does.
+
+Merge rules:
+    SourceLogin         upsert by email (totals, fetchedAt)
+    StagingPatient      insert new; for existing rows refresh the EyerCloud
+                        fields (never blanking them) and normalizedName only
+                        while normalizationStatus is still 'raw'
+    StagingExam         insert new; refresh examDate/location/technicianName
+    StagingExamImage    insert new; fill url when the row has none
+                        (--overwrite-urls: whenever it differs)
+
+Exams whose patient is not in the DB and images whose exam is not are
+skipped by the SQL, as the Node scripts did.
+
+Needs psycopg (3) or psycopg2. The DSN is --dsn or STAGING_DATABASE_URL
+(also read from prisma-staging/.env). To try it on a local Postgres:
+
+    createdb neuroapp_staging_test
+    STAGING_DATABASE_URL=postgresql://localhost/neuroapp_staging_test \\
+        npx prisma db push --schema prisma-staging/schema.prisma
+    python load_staging_db.py --dsn postgresql://localhost/neuroapp_staging_test
+
+Usage:
+    cd scripts/eyercloud_downloader
+    python load_staging_db.py --dry-run                 # load, print counts, roll back
+    python load_staging_db.py                           # every staging_state_*.json here
+    python load_staging_db.py --state staging_state_mozaniareis.json
+    python load_staging_db.py --overwrite-urls
+    python load_staging_db.py --changes-only            # exams added/modified in the exam feed
+
+--changes-only loads, per account, only the exams added/modified in the exam
+feed since the last DB run (consumer "db"), with their patients and images.
+Removed exams are left in the DB. After the commit the feed is acked up to
+where the upload has acked it.
+"""
+
+import os
+import sys
+import json
+import time
+import secrets
+import argparse
+from pathlib import Path
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from etl_common import Account, load_json, normalize_name, PROJECT_ROOT
+from exam_feed import ExamFeed
+from profiling import profile_main
+
+ENV_FILE = PROJECT_ROOT / "prisma-staging" / ".env"
+FEED_CONSUMER = 'db'
+# Consumers that put images on Bytescale (upload_staging_images.py, ingest_daemon.py):
+# exams past their cursors may still lack urls, so --changes-only never acks beyond them
+UPLOAD_CONSUMERS = ('upload', 'daemon')
+
+# Same defaults as scripts/import_staging_data.js
+SOURCE_LOGINS = {
+    'mozaniareis@usp.br': {'clinicName': 'Pós-Doutorado', 'userName': 'Mozania Reis de Matos'},
+    'dramelinalannes.endocrino@gmail.com': {'clinicName': 'Campos do Jordão', 'userName': 'Melina Morais Lannes'},
+}
+
+TEMP_TABLES = {
+    'tmp_patient': ('id', 'raw_name', 'normalized_name', 'cpf', 'gender', 'birth_date', 'phone',
+                    'prontuario', 'cns', 'ophthalmic', 'underlying'),
+    'tmp_exam': ('id', 'exam_date', 'location', 'technician', 'patient_id'),
+    'tmp_image': ('id', 'url', 'file_name', 'type', 'eyer_uuid', 'exam_id'),
+}
+
+CREATE_TEMP_SQL = """
+CREATE TEMP TABLE tmp_patient (
+    id text PRIMARY KEY, raw_name text, normalized_name text, cpf text, gender text,
+    birth_date timestamp(3), phone text, prontuario text, cns text, ophthalmic jsonb, underlying jsonb
+) ON COMMIT DROP;
+CREATE TEMP TABLE tmp_exam (
+    id text PRIMARY KEY, exam_date timestamp(3), location text, technician text, patient_id text
+) ON COMMIT DROP;
+CREATE TEMP TABLE tmp_image (
+    id text PRIMARY KEY, url text, file_name text, type text, eyer_uuid text, exam_id text
+) ON COMMIT DROP;
+"""
+
+UPSERT_LOGIN_SQL = """
+INSERT INTO "SourceLogin" (id, email, "clinicName", "userName", "totalExams", "totalPatients", "fetchedAt")
+VALUES (%(id)s, %(email)s, %(clinic)s, %(user)s, %(exams)s, %(patients)s, %(fetched)s)
+ON CONFLICT (email) DO UPDATE SET
+    "totalExams" = EXCLUDED."totalExams",
+    "totalPatients" = EXCLUDED."totalPatients",
+    "fetchedAt" = EXCLUDED."fetchedAt"
+RETURNING id
+"""
+
+# (xmax = 0) is true for freshly inserted rows, false for rows the upsert updated
+MERGE_PATIENTS_SQL = """
+WITH merged AS (
+    INSERT INTO "StagingPatient" AS p (
+        id, "rawName", "normalizedName", cpf, gender, "birthDate", phone, prontuario, cns,
+        "ophthalmicDiseases", "underlyingDiseases", "sourceLoginId", "updatedAt")
+    SELECT id, raw_name, normalized_name, cpf, gender, birth_date, phone, prontuario, cns,
+           ophthalmic, underlying, %(login)s, now()
+    FROM tmp_patient
+    ON CONFLICT (id) DO UPDATE SET
+        "rawName" = EXCLUDED."rawName",
+        "normalizedName" = CASE WHEN p."normalizationStatus" = 'raw'
+                                THEN EXCLUDED."normalizedName" ELSE p."normalizedName" END,
+        cpf = COALESCE(EXCLUDED.cpf, p.cpf),
+        gender = COALESCE(EXCLUDED.gender, p.gender),
+        "birthDate" = COALESCE(EXCLUDED."birthDate", p."birthDate"),
+        phone = COALESCE(EXCLUDED.phone, p.phone),
+        prontuario = COALESCE(EXCLUDED.prontuario, p.prontuario),
+        cns = COALESCE(EXCLUDED.cns, p.cns),
+        "ophthalmicDiseases" = COALESCE(EXCLUDED."ophthalmicDiseases", p."ophthalmicDiseases"),
+        "underlyingDiseases" = COALESCE(EXCLUDED."underlyingDiseases", p."underlyingDiseases"),
+        "updatedAt" = now()
+    WHERE (p."rawName", p.cpf, p.gender, p."birthDate", p.phone, p.prontuario, p.cns,
+           p."ophthalmicDiseases"::text, p."underlyingDiseases"::text)
+        IS DISTINCT FROM
+          (EXCLUDED."rawName", COALESCE(EXCLUDED.cpf, p.cpf), COALESCE(EXCLUDED.gender, p.gender),
+           COALESCE(EXCLUDED."birthDate", p."birthDate"), COALESCE(EXCLUDED.phone, p.phone),
+           COALESCE(EXCLUDED.prontuario, p.prontuario), COALESCE(EXCLUDED.cns, p.cns),
+           COALESCE(EXCLUDED."ophthalmicDiseases", p."ophthalmicDiseases")::text,
+           COALESCE(EXCLUDED."underlyingDiseases", p."underlyingDiseases")::text)
+       OR (p."normalizationStatus" = 'raw' AND p."normalizedName" IS DISTINCT FROM EXCLUDED."normalizedName")
+    RETURNING (xmax = 0) AS inserted
+)
+SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM merged
+"""
+
+MERGE_EXAMS_SQL = """
+WITH merged AS (
+    INSERT INTO "StagingExam" AS e (
+        id, "eyerCloudId", "examDate", location, "technicianName", "patientId", "sourceLoginId", "updatedAt")
+    -- the exam date only falls back to now() for new rows (as the Node import did)
+    SELECT t.id, t.id, COALESCE(t.exam_date, now()), t.location, t.technician, t.patient_id, %(login)s, now()
+    FROM tmp_exam t
+    JOIN "StagingPatient" sp ON sp.id = t.patient_id
+    ON CONFLICT (id) DO UPDATE SET
+        "examDate" = COALESCE((SELECT exam_date FROM tmp_exam WHERE id = e.id), e."examDate"),
+        location = COALESCE(EXCLUDED.location, e.location),
+        "technicianName" = COALESCE(EXCLUDED."technicianName", e."technicianName"),
+        "updatedAt" = now()
+    WHERE (e."examDate", e.location, e."technicianName")
+        IS DISTINCT FROM (COALESCE((SELECT exam_date FROM tmp_exam WHERE id = e.id), e."examDate"),
+                          COALESCE(EXCLUDED.location, e.location),
+                          COALESCE(EXCLUDED."technicianName", e."technicianName"))
+    RETURNING (xmax = 0) AS inserted
+)
+SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM merged
+"""
+
+MERGE_IMAGES_SQL = """
+WITH merged AS (
+    INSERT INTO "StagingExamImage" AS i (id, url, "fileName", type, "eyerUuid", "examId")
+    SELECT t.id, t.url, t.file_name, t.type, t.eyer_uuid, t.exam_id
+    FROM tmp_image t
+    JOIN "StagingExam" se ON se.id = t.exam_id
+    ON CONFLICT (id) DO UPDATE SET url = EXCLUDED.url
+    WHERE EXCLUDED.url <> '' AND i.url IS DISTINCT FROM EXCLUDED.url
+      AND (%(overwrite)s OR i.url = '')
+    RETURNING (xmax = 0) AS inserted
+)
+SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM merged
+"""
+
+
+# --- rows from the state files ---
+
+def parse_date(value):
+    """DD/MM/YYYY or ISO -> naive UTC ISO string (None if unparseable), like the Node parseDate."""
+    if not value:
+        return None
+    value = value.strip()
+    parts = value.split('/')
+    try:
+        if len(parts) == 3:
+            day, month, year = (int(p) for p in parts)
+            return datetime(year, month, day).isoformat()
+        dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt.isoformat()
+
+
+def _text(value):
+    return value.strip() or None if isinstance(value, str) else None
+
+
+def _json(value):
+    return json.dumps(value, ensure_ascii=False) if value else None
+
+
+def patient_rows(state):
+    for pat in state.get('patients', {}).values():
+        if len(pat.get('id') or '') < 10:
+            continue
+        yield (pat['id'], pat.get('rawName') or '', _text(pat.get('normalizedName')), _text(pat.get('cpf')),
+               _text(pat.get('gender')), parse_date(pat.get('birthday')), _text(pat.get('phone')),
+               _text(pat.get('prontuario')), _text(pat.get('cns')),
+               _json(pat.get('ophthalmicDiseases')), _json(pat.get('underlyingDiseases')))
+
+
+def exam_rows(state):
+    """Exams with a resolvable patient (id, else the patient with the same normalized name)."""
+    patients = {pid: pat for pid, pat in state.get('patients', {}).items() if len(pid or '') >= 10}
+    by_name = {pat['normalizedName']: pid for pid, pat in patients.items() if pat.get('normalizedName')}
+    for exam in state.get('exams', {}).values():
+        if len(exam.get('id') or '') < 10:
+            continue
+        patient_id = exam.get('patientId')
+        if patient_id not in patients:
+            patient_id = by_name.get(normalize_name(exam.get('patientName', '')))
+        if not patient_id:
+            continue
+        yield (exam['id'], parse_date(exam.get('examDate')), _text(exam.get('clinicName')),
+               _text(exam.get('technicianName')), patient_id)
+
+
+def mapping_images(mapping):
+    """{uuid: (exam_id, image)} for every uploaded image of a mapping file."""
+    images = {}
+    for entry in (mapping or {}).values():
+        for img in entry.get('images', []):
+            if img.get('uuid'):
+                images[img['uuid']] = (entry.get('exam_id', ''), img)
+    return images
+
+
+def changed_subset(state, mapping, exam_ids):
+    """The part of a state and mapping behind `exam_ids`: their exams, patients and images."""
+    exams = {eid: exam for eid, exam in state.get('exams', {}).items() if eid in exam_ids}
+    patient_ids = {exam.get('patientId') for exam in exams.values()}
+    names = {normalize_name(exam.get('patientName', '')) for exam in exams.values()}
+    patients = {pid: pat for pid, pat in state.get('patients', {}).items()
+                if pid in patient_ids or pat.get('normalizedName') in names}
+    exam_images = {eid: images for eid, images in state.get('exam_images', {}).items() if eid in exam_ids}
+    # Mapping folders can carry a short exam id, so also match them by image uuid
+    uuids = {img.get('uuid') for images in exam_images.values() for img in images or []}
+    mapping = {folder: entry for folder, entry in (mapping or {}).items()
+               if entry.get('exam_id') in exam_ids or any(img.get('uuid') in uuids for img in entry.get('images', []))}
+    return dict(state, exams=exams, patients=patients, exam_images=exam_images), mapping
+
+
+def image_rows(state, mapping):
+    uploaded = mapping_images(mapping)
+    seen = set()
+    for exam_id, images in state.get('exam_images', {}).items():
+        for img in images or []:
+            uuid = img.get('uuid')
+            if not uuid or uuid in seen:
+                continue
+            seen.add(uuid)
+            mapped = uploaded.get(uuid, (None, {}))[1]
+            url = mapped.get('cdn_url') or mapped.get('bytescale_url') or img.get('url') or ''
+            yield (f"img-{uuid}.jpg", url, f"{uuid}.jpg", (img.get('type') or 'UNKNOWN').upper(), uuid, exam_id)
+    # Uploaded images the socket listing did not carry
+    for uuid, (exam_id, img) in uploaded.items():
+        if uuid not in seen and exam_id:
+            yield (f"img-{uuid}.jpg", img.get('cdn_url') or img.get('bytescale_url') or '',
+                   img.get('filename') or f"{uuid}.jpg", (img.get('type') or 'UNKNOWN').upper(), uuid, exam_id)
+
+
+# --- COPY ---
+
+def _copy_field(value):
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def copy_lines(rows):
+    for row in rows:
+        yield '\t'.join(_copy_field(v) for v in row) + '\n'
+
+
+class _LineReader:
+    """File-like read() over a generator of COPY lines (for psycopg2.copy_expert)."""
+
+    def __init__(self, lines):
+        self._lines = lines
+        self._buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._lines)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+
+def copy_rows(conn, table, rows):
+    """COPY rows into a temp table; returns the number of rows streamed."""
+    columns = TEMP_TABLES[table]
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    count = 0
+
+    def counted():
+        nonlocal count
+        for line in copy_lines(rows):
+            count += 1
+            yield line
+
+    with conn.cursor() as cur:
+        if hasattr(cur, 'copy'):  # psycopg 3
+            with cur.copy(sql) as copy:
+                batch = []
+                for line in counted():
+                    batch.append(line)
+                    if len(batch) >= 1000:
+                        copy.write(''.join(batch))
+                        batch = []
+                if batch:
+                    copy.write(''.join(batch))
+        else:  # psycopg2
+            cur.copy_expert(sql, _LineReader(counted()), size=1 << 16)
+    return count
+
+
+# --- connection ---
+
+def resolve_dsn(dsn):
+    if not dsn:
+        try:
+            from dotenv import load_dotenv
+            load_dotenv(ENV_FILE)
+        except ImportError:
+            pass
+        dsn = os.getenv('STAGING_DATABASE_URL')
+    if not dsn:
+        print("ERROR: pass --dsn or set STAGING_DATABASE_URL")
+        sys.exit(1)
+    # Prisma URLs carry ?schema=...; libpq rejects it, so it becomes the search_path
+    parts = urlsplit(dsn)
+    query = dict(parse_qsl(parts.query))
+    schema = query.pop('schema', None)
+    return urlunsplit(parts._replace(query=urlencode(query))), schema
+
+
+def connect(dsn, schema=None):
+    try:
+        import psycopg
+        conn = psycopg.connect(dsn)
+    except ImportError:
+        try:
+            import psycopg2
+        except ImportError:
+            print("pip install 'psycopg[binary]'  (or psycopg2-binary)")
+            sys.exit(1)
+        conn = psycopg2.connect(dsn)
+    if schema:
+        with conn.cursor() as cur:
+            cur.execute("SELECT set_config('search_path', %s, true)", (schema,))
+    return conn
+
+
+# --- load ---
+
+def load_account(conn, state, mapping, overwrite_urls=False, exam_ids=None):
+    """Load one account; exam_ids restricts the rows to those exams (SourceLogin totals stay whole)."""
+    email = state['email']
+    defaults = SOURCE_LOGINS.get(email)
+    if defaults is None:
+        clinics = [e.get('clinicName') for e in state.get('exams', {}).values() if e.get('clinicName')]
+        defaults = {'clinicName': max(set(clinics), key=clinics.count) if clinics else '',
+                    'userName': email.split('@')[0]}
+
+    with conn.cursor() as cur:
+        cur.execute("TRUNCATE tmp_patient, tmp_exam, tmp_image")
+        cur.execute(UPSERT_LOGIN_SQL, {
+            'id': 'c' + secrets.token_hex(12),  # Prisma's cuid() is generated client-side
+            'email': email, 'clinic': defaults['clinicName'], 'user': defaults['userName'],
+            'exams': len(state.get('exams', {})), 'patients': len(state.get('patients', {})),
+            'fetched': parse_date(state.get('fetched_at')) or datetime.now().isoformat(),
+        })
+        login_id = cur.fetchone()[0]
+
+    if exam_ids is not None:
+        state, mapping = changed_subset(state, mapping, exam_ids)
+    copied = {
+        'patients': copy_rows(conn, 'tmp_patient', patient_rows(state)),
+        'exams': copy_rows(conn, 'tmp_exam', exam_rows(state)),
+        'images': copy_rows(conn, 'tmp_image', image_rows(state, mapping)),
+    }
+
+    merged = {}
+    with conn.cursor() as cur:
+        cur.execute("ANALYZE tmp_patient; ANALYZE tmp_exam; ANALYZE tmp_image")
+        for name, sql in (('patients', MERGE_PATIENTS_SQL), ('exams', MERGE_EXAMS_SQL), ('images', MERGE_IMAGES_SQL)):
+            cur.execute(sql, {'login': login_id, 'overwrite': overwrite_urls})
+            merged[name] = cur.fetchone()
+    return login_id, copied, merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description='COPY staging states + mappings into the staging Postgres')
+    parser.add_argument('--state', action='append', default=None,
+                        help='staging_state_<account>.json (repeatable; default: all in this folder)')
+    parser.add_argument('--dsn', default=None, help='Postgres URL (default: STAGING_DATABASE_URL)')
+    parser.add_argument('--overwrite-urls', action='store_true', help='Replace image URLs that differ from the mapping')
+    parser.add_argument('--dry-run', action='store_true', help='Load and merge, print counts, then roll back')
+    parser.add_argument('--changes-only', action='store_true',
+                        help='Only load exams added/modified in the exam feed since the last DB run')
+    args = parser.parse_args()
+
+    if args.state:
+        states = [Path(s) for s in args.state]
+    else:
+        states = [acct.staging_state_file for acct in Account.discover()]
+    if not states:
+        print("ERROR: no staging_state_*.json found (pass --state)")
+        sys.exit(1)
+
+    dsn, schema = resolve_dsn(args.dsn)
+    print("=" * 60)
+    print("  Staging DB bulk load (COPY + set-based merge)")
+    print(f"  Target: {urlsplit(dsn).hostname or 'local socket'}{urlsplit(dsn).path}"
+          f"{f' (schema {schema})' if schema else ''}")
+    print(f"  Mode:   {'DRY-RUN (rolled back)' if args.dry_run else 'EXECUTE'}")
+    print("=" * 60)
+
+    started = time.perf_counter()
+    conn = connect(dsn, schema)
+    acks = []  # (feed, seq) to ack once the transaction is committed
+    try:
+        with conn.cursor() as cur:
+            cur.execute(CREATE_TEMP_SQL)
+        for state_file in states:
+            state = load_json(state_file)
+            if not state or not state.get('email'):
+                print(f"SKIP {state_file}: missing or without email")
+                continue
+            mapping = load_json(Account(state['email']).mapping_file, {})
+            feed = ExamFeed(state['email'])
+            exam_ids = None
+            if args.changes_only and not feed.is_new(FEED_CONSUMER):
+                changed = feed.pending(FEED_CONSUMER)
+                exam_ids = set(changed['added']) | set(changed['modified'])
+            t0 = time.perf_counter()
+            login_id, copied, merged = load_account(conn, state, mapping, args.overwrite_urls, exam_ids)
+            print(f"\n{state['email']} (SourceLogin {login_id}) -- {time.perf_counter() - t0:.2f}s"
+                  f"{f' -- {len(exam_ids)} changed exams' if exam_ids is not None else ''}")
+            uploaded_seq = max(feed.cursor(consumer) for consumer in UPLOAD_CONSUMERS)
+            acks.append((feed, max(uploaded_seq, feed.cursor(FEED_CONSUMER))))
+            for name in ('patients', 'exams', 'images'):
+                inserted, updated = merged[name]
+                print(f"  {name:<9} copied {copied[name]:>6}   inserted {inserted:>6}   updated {updated:>6}")
+
+        if args.dry_run:
+            conn.rollback()
+            print("\nRolled back (--dry-run).")
+        else:
+            conn.commit()
+            print("\nCommitted.")
+            for feed, seq in acks:
+                feed.ack(FEED_CONSUMER, seq)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    print(f"Total: {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == '__main__':
+    profile_main(main, 'load_staging_db')
@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+"""
+Single-crawl metadata snapshot + local backfills.
+=================================================
+fetch_patient_details.py, fetch_anamnesis.py, fetch_birth_dates.py,
+resync_metadata.py, deep_metadata_sync.py and fix_metadata.py each crawl
+/patient/list or /exam/filter again just to patch a few fields. This script
+crawls both endpoints ONCE per account and writes a normalized, versioned
+snapshot; every backfill then becomes a pure local join against it.
+
+    crawl   login, paginate /patient/list + /exam/filter (per clinic), write snapshot
+    apply   join the latest snapshot into download_state.json (and mappings)
+    info    show what the latest snapshot contains
+
+Snapshots are kept per account under metadata_snapshots/<account>/:
+    snapshot_YYYYmmdd_HHMMSS.json   (one per crawl, never overwritten)
+    latest.json                     (copy of the newest one)
+
+Usage:
+    cd scripts/eyercloud_downloader
+    python metadata_snapshot.py crawl                         # .env account, auth_state.json
+    python metadata_snapshot.py crawl --email "x@y.com" --password "..."
+    python metadata_snapshot.py apply --dry-run
+    python metadata_snapshot.py apply --only cpf,gender,birthday
+    python metadata_snapshot.py apply --state download_state.json --mapping ../../bytescale_mapping_v2.json
+    python metadata_snapshot.py apply --write-legacy   # also patient_details.json / anamnesis_data.json
+"""
+
+import os
+import sys
+import json
+import shutil
+import asyncio
+import argparse
+from pathlib import Path
+from datetime import datetime
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+from etl_common import sanitize_email, load_json, save_json, normalize_name
+from exam_feed import ExamFeed, inventory_from_snapshot, print_change
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_DIR = Path("metadata_snapshots")
+STATE_FILE = Path("download_state.json")
+DETAILS_FILE = Path("patient_details.json")
+ANAMNESIS_FILE = Path("anamnesis_data.json")
+
+API_BASE = f"{os.getenv('EYERCLOUD_DOMAIN', 'https://eyercloud.com').rstrip('/')}/api/v2/eyercloud"
+PAGE_SIZE = 20
+
+BACKFILLS = ('cpf', 'gender', 'birthday', 'anamnesis', 'exam')
+
+# snapshot key -> candidate anamnesis keys (English and Portuguese variants)
+UNDERLYING_KEYS = {
+    'diabetes': ('diabetes',),
+    'hypertension': ('hypertension', 'hipertensaoArterial'),
+    'cholesterol': ('cholesterol', 'hipercolesterolemia'),
+    'smoker': ('smoker', 'tabagismo'),
+}
+OPHTHALMIC_KEYS = {
+    'diabeticRetinopathy': ('diabeticRetinopathy', 'retinopatia'),
+    'dmri': ('dmri',),
+    'glaucoma': ('glaucoma',),
+    'cataract': ('cataract', 'catarata'),
+    'pterygium': ('pterygium',),
+    'lowVisualAcuity': ('lowVisualAcuity',),
+}
+
+
+def _text(value):
+    return value.strip() if isinstance(value, str) else ''
+
+
+# --- normalization ---
+
+def normalize_patient(pat):
+    """/patient/list (or embedded exam.patient) record -> snapshot patient."""
+    full_name = _text(pat.get('fullName')) or \
+        f"{_text(pat.get('firstName'))} {_text(pat.get('lastName'))}".strip()
+    return {
+        'id': pat.get('id') or pat.get('_id') or '',
+        'fullName': full_name,
+        'normalizedName': normalize_name(full_name),
+        # CPF lives in 'document2' in the API; 'cpf' only in older payloads
+        'cpf': _text(pat.get('document2')) or _text(pat.get('cpf')),
+        'gender': _text(pat.get('gender')),
+        'birthday': _text(pat.get('birthday')),
+        'mrn': _text(pat.get('mrn')),
+        'phone': _text(pat.get('telephone1')),
+    }
+
+
+def normalize_exam(exam):
+    patient = exam.get('patient')
+    clinic = exam.get('clinic')
+    return {
+        'id': exam.get('id') or exam.get('_id') or '',
+        'patientId': (patient.get('id') or patient.get('_id') or '') if isinstance(patient, dict)
+                     else (patient if isinstance(patient, str) else ''),
+        'patientName': _text((patient or {}).get('fullName') if isinstance(patient, dict) else '')
+                       or _text(exam.get('patientFullName')) or _text(exam.get('patientName')),
+        'date': exam.get('date') or '',
+        'clinicName': (clinic.get('name', '') if isinstance(clinic, dict) else clinic if isinstance(clinic, str) else '')
+                      or exam.get('clinicName', ''),
+        'clinicId': clinic.get('id', '') if isinstance(clinic, dict) else exam.get('clinicId', ''),
+        'status': exam.get('status', ''),
+    }
+
+
+def disease_flags(anamnesis, keys):
+    return {
+        field: any(bool(anamnesis.get(k)) for k in candidates)
+        for field, candidates in keys.items()
+    }
+
+
+def build_snapshot(email, raw_patients, raw_exams):
+    patients = {}
+    anamnesis = {}
+
+    def merge(pat):
+        record = normalize_patient(pat)
+        pid = record['id']
+        if not pid:
+            return
+        existing = patients.get(pid)
+        if existing:
+            for key, value in record.items():
+                if value and not existing.get(key):
+                    existing[key] = value
+        else:
+            patients[pid] = record
+        raw_anamnesis = pat.get('anamnesis')
+        if isinstance(raw_anamnesis, dict) and raw_anamnesis:
+            anamnesis[pid] = {
+                'raw': raw_anamnesis,
+                'otherDisease': _text(pat.get('otherDisease')) or _text(raw_anamnesis.get('otherDisease')),
+            }
+
+    # /patient/list is authoritative; embedded exam patients only fill gaps
+    for pat in raw_patients:
+        merge(pat)
+    exams = {}
+    for exam in raw_exams:
+        record = normalize_exam(exam)
+        if not record['id']:
+            continue
+        exams[record['id']] = record
+        if isinstance(exam.get('patient'), dict):
+            merge(exam['patient'])
+
+    return {
+        'schema_version': SNAPSHOT_VERSION,
+        'account': email,
+        'fetched_at': datetime.now().isoformat(),
+        'counts': {'patients': len(patients), 'exams': len(exams), 'anamnesis': len(anamnesis)},
+        'patients': patients,
+        'exams': exams,
+        'anamnesis': anamnesis,
+    }
+
+
+def account_dir(email):
+    return SNAPSHOT_DIR / (sanitize_email(email) if email else 'default')
+
+
+def write_snapshot(snapshot):
+    directory = account_dir(snapshot['account'])
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"snapshot_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    save_json(snapshot, path)
+    shutil.copyfile(path, directory / "latest.json")
+    return path
+
+
+def load_snapshot(email=None, path=None):
+    path = Path(path) if path else account_dir(email) / "latest.json"
+    snapshot = load_json(path)
+    if snapshot is None:
+        return None, path
+    if snapshot.get('schema_version') != SNAPSHOT_VERSION:
+        print(f"ERROR: {path} has schema_version {snapshot.get('schema_version')}, "
+              f"expected {SNAPSHOT_VERSION}. Re-run 'crawl'.")
+        return None, path
+    return snapshot, path
+
+
+# --- crawl ---
+
+async def paginate(request, url, payload_for_page, label):
+    """POST page after page until an empty page or a page of already-seen ids."""
+    items = []
+    seen = set()
+    page_num = 1
+    while True:
+        response = await request.post(url, data=payload_for_page(page_num))
+        if response.status != 200:
+            print(f"  {label} page {page_num}: HTTP {response.status} - stopping")
+            break
+        result = (await response.json()).get('result', [])
+        ids = {item.get('id') for item in result}
+        if not result or ids <= seen:
+            break
+        seen |= ids
+        items.extend(item for item in result if item.get('id'))
+        if page_num % 10 == 0:
+            print(f"  {label}: page {page_num}, {len(items)} so far")
+        if len(result) < PAGE_SIZE:
+            break
+        page_num += 1
+    print(f"  {label}: {len(items)} records in {page_num} pages")
+    return items
+
+
+async def crawl_exams(request):
+    """/exam/filter of every clinic: (exams, partial).
+
+    /exam/filter only returns the clinic selected on the session, so each
+    clinic is selected with clinic/change first (as downloader.py does).
+    partial is True when a clinic could not be selected.
+    """
+    response = await request.post(f"{API_BASE}/clinic/list")
+    clinics = (await response.json()).get('result', []) if response.status == 200 else []
+    if not clinics:
+        print("  clinic/list: no clinics returned - crawling the selected clinic only")
+        return await paginate(request, f"{API_BASE}/exam/filter", exam_filter_payload, 'exam/filter'), True
+
+    exams = []
+    partial = False
+    for clinic in clinics:
+        label = f"exam/filter [{clinic.get('name', clinic['id'])}]"
+        response = await request.post(f"{API_BASE}/clinic/change", data={'id': clinic['id']})
+        if response.status != 200:
+            print(f"  {label}: clinic/change HTTP {response.status} - skipped")
+            partial = True
+            continue
+        exams.extend(await paginate(request, f"{API_BASE}/exam/filter", exam_filter_payload, label))
+    return exams, partial
+
+
+def exam_filter_payload(page_num):
+    return {
+        'startDate': '01/01/2000', 'endDate': '01/01/2050',
+        'statusFilter': 'all', 'page': str(page_num),
+    }
+
+
+async def crawl(args):
+    from playwright.async_api import async_playwright
+    from browser_bootstrap import open_browser, login_eyercloud, auth_file_for
+    from auth_probe import probe_auth
+
+    auth_file = Path(args.auth) if args.auth else auth_file_for(args.email)
+
+    async with async_playwright() as p:
+        browser = None
+        if probe_auth(auth_file):
+            # Saved cookies still work: API calls only, no browser at all
+            print("Saved session is valid (auth probe) - skipping the browser.")
+            request = await p.request.new_context(storage_state=str(auth_file))
+        else:
+            browser, context, page = await open_browser(p, auth_file)
+            if not await login_eyercloud(page, args.email, args.password, auth_file):
+                print("FATAL: Could not login.")
+                await browser.close()
+                sys.exit(1)
+            request = context.request
+
+        print("\nCrawling (one pass per endpoint)...")
+        raw_patients = await paginate(request, f"{API_BASE}/patient/list",
+                                      lambda n: {'page': n}, 'patient/list')
+        raw_exams, partial = await crawl_exams(request)
+        if browser is not None:
+            await browser.close()
+        else:
+            await request.dispose()
+
+    snapshot = build_snapshot(args.email or '', raw_patients, raw_exams)
+    path = write_snapshot(snapshot)
+    print(f"\nSnapshot saved: {path}")
+    if partial:
+        # Exams of the clinics not crawled must not show up as removed
+        print("Some clinics were not crawled: exam feed updated as partial")
+    print_change(ExamFeed(args.email).update(inventory_from_snapshot(snapshot), source=str(path),
+                                             partial=partial))
+    print(f"  Patients:  {snapshot['counts']['patients']}")
+    print(f"  Exams:     {snapshot['counts']['exams']}")
+    print(f"  Anamnesis: {snapshot['counts']['anamnesis']}")
+
+
+# --- apply (pure local joins) ---
+
+class SnapshotIndex:
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.exams = snapshot['exams']
+        self.exams_by_short = {}
+        for eid in self.exams:
+            self.exams_by_short.setdefault(eid[:8], eid)
+
+        # name -> most complete patient (same tie-break as fetch_patient_details)
+        self.by_name = {}
+        for pat in snapshot['patients'].values():
+            norm = pat['normalizedName']
+            if not norm:
+                continue
+            score = bool(pat['cpf']) + bool(pat['gender']) + bool(pat['birthday']) + \
+                (pat['id'] in snapshot['anamnesis'])
+            best = self.by_name.get(norm)
+            if best is None or score > best[0]:
+                self.by_name[norm] = (score, pat)
+
+    def find(self, exam_id, patient_name):
+        """(exam, patient) for a state entry: exact exam id, short id, then name."""
+        eid = exam_id if exam_id in self.exams else self.exams_by_short.get((exam_id or '')[:8])
+        exam = self.exams.get(eid) if eid else None
+        patient = None
+        if exam and exam['patientId']:
+            patient = self.snapshot['patients'].get(exam['patientId'])
+        if patient is None:
+            hit = self.by_name.get(normalize_name(patient_name or (exam or {}).get('patientName', '')))
+            patient = hit[1] if hit else None
+        return exam, patient
+
+
+def apply_to_record(record, exam, patient, anamnesis, only, overwrite, counters):
+    changed = False
+
+    def put(field, value, counter):
+        nonlocal changed
+        if value and (overwrite or not record.get(field)):
+            if record.get(field) != value:
+                record[field] = value
+                counters[counter] += 1
+                changed = True
+
+    if patient:
+        if 'cpf' in only:
+            put('cpf', patient['cpf'], 'cpf')
+        if 'gender' in only:
+            put('gender', patient['gender'], 'gender')
+        if 'birthday' in only:
+            put('birthday', patient['birthday'], 'birthday')
+        if 'anamnesis' in only and anamnesis:
+            underlying = disease_flags(anamnesis['raw'], UNDERLYING_KEYS)
+            ophthalmic = disease_flags(anamnesis['raw'], OPHTHALMIC_KEYS)
+            if record.get('underlying_diseases') != underlying or record.get('ophthalmic_diseases') != ophthalmic:
+                record['underlying_diseases'] = underlying
+                record['ophthalmic_diseases'] = ophthalmic
+                counters['anamnesis'] += 1
+                changed = True
+            if anamnesis['otherDisease'] and record.get('otherDisease') != anamnesis['otherDisease']:
+                record['otherDisease'] = anamnesis['otherDisease']
+                changed = True
+    if exam and 'exam' in only:
+        put('exam_date', exam['date'], 'exam')
+        put('clinic_name', exam['clinicName'], 'exam')
+    return changed
+
+
+def apply(args):
+    snapshot, path = load_snapshot(args.email, args.snapshot)
+    if snapshot is None:
+        print(f"ERROR: No snapshot at {path}. Run: python metadata_snapshot.py crawl")
+        return
+    only = set(args.only.split(',')) if args.only else set(BACKFILLS)
+    unknown = only - set(BACKFILLS)
+    if unknown:
+        print(f"ERROR: unknown backfill(s): {', '.join(sorted(unknown))} (choose from {', '.join(BACKFILLS)})")
+        return
+
+    index = SnapshotIndex(snapshot)
+    print(f"Snapshot: {path} ({snapshot['fetched_at']})")
+    print(f"  {snapshot['counts']['patients']} patients, {snapshot['counts']['exams']} exams")
+    print(f"Backfills: {', '.join(sorted(only))}{' (overwrite)' if args.overwrite else ''}\n")
+
+    targets = []
+    state = load_json(args.state)
+    if state is None:
+        print(f"ERROR: State not found: {args.state}")
+        return
+    targets.append((args.state, state, [
+        (eid, rec) for eid, rec in state.get('exam_details', {}).items()
+    ]))
+    for mapping_path in args.mapping:
+        mapping = load_json(mapping_path, {}) or {}
+        targets.append((mapping_path, mapping, [
+            (rec.get('exam_id') or key.rsplit('_', 1)[-1], rec)
+            for key, rec in mapping.items() if isinstance(rec, dict)
+        ]))
+
+    for target_path, data, records in targets:
+        counters = {field: 0 for field in BACKFILLS}
+        matched = changed = 0
+        for exam_id, record in records:
+            exam, patient = index.find(exam_id, record.get('patient_name'))
+            if not exam and not patient:
+                continue
+            matched += 1
+            anamnesis = snapshot['anamnesis'].get(patient['id']) if patient else None
+            if apply_to_record(record, exam, patient, anamnesis, only, args.overwrite, counters):
+                changed += 1
+                record['metadata_snapshot'] = snapshot['fetched_at']
+
+        print(f"{target_path}: {matched}/{len(records)} matched, {changed} changed")
+        for field in BACKFILLS:
+            if field in only:
+                print(f"    {field:<10} {counters[field]}")
+        if not args.dry_run and changed:
+            save_json(data, target_path)
+
+    if args.write_legacy and not args.dry_run:
+        details = {
+            pid: {
+                'name': pat['fullName'], 'cpf': pat['cpf'], 'gender': pat['gender'],
+                'birthday': pat['birthday'],
+                'anamnesis': snapshot['anamnesis'].get(pid, {}).get('raw', {}),
+                'otherDisease': snapshot['anamnesis'].get(pid, {}).get('otherDisease', ''),
+            }
+            for pid, pat in snapshot['patients'].items()
+        }
+        save_json(details, DETAILS_FILE)
+        save_json({
+            pid: {'name': d['name'], 'anamnesis': d['anamnesis'], 'otherDisease': d['otherDisease']}
+            for pid, d in details.items() if d['anamnesis']
+        }, ANAMNESIS_FILE)
+        print(f"\nLegacy files written: {DETAILS_FILE}, {ANAMNESIS_FILE}")
+
+    if args.dry_run:
+        print("\nDRY-RUN: nothing written.")
+    else:
+        print("\nNext: node scripts/fix_cpf_gender.js / node scripts/fix_diseases.js (with --execute)")
+
+
+def info(args):
+    snapshot, path = load_snapshot(args.email, args.snapshot)
+    if snapshot is None:
+        print(f"No snapshot at {path}")
+        return
+    patients = snapshot['patients'].values()
+    print(f"Snapshot:   {path}")
+    print(f"Account:    {snapshot['account'] or '(default)'}")
+    print(f"Fetched at: {snapshot['fetched_at']}")
+    print(f"Patients:   {len(snapshot['patients'])} "
+          f"(cpf {sum(1 for p in patients if p['cpf'])}, "
+          f"birthday {sum(1 for p in patients if p['birthday'])}, "
+          f"gender {sum(1 for p in patients if p['gender'])})")
+    print(f"Exams:      {len(snapshot['exams'])}")
+    print(f"Anamnesis:  {len(snapshot['anamnesis'])}")
+    history = sorted(path.parent.glob('snapshot_*.json'))
+    print(f"History:    {len(history)} snapshot(s) in {path.parent}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Single-crawl metadata snapshot and local backfills')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_crawl = sub.add_parser('crawl', help='Fetch /patient/list + /exam/filter once and write a snapshot')
+    p_crawl.add_argument('--email', default=os.getenv('EYERCLOUD_USUARIO'))
+    p_crawl.add_argument('--password', default=os.getenv('EYERCLOUD_SENHA'))
+    p_crawl.add_argument('--auth', default=None, help='Playwright storage_state file')
+
+    p_apply = sub.add_parser('apply', help='Backfill state/mappings from the latest snapshot (no network)')
+    p_apply.add_argument('--email', default=os.getenv('EYERCLOUD_USUARIO'), help='Account whose snapshot to use')
+    p_apply.add_argument('--snapshot', default=None, help='Explicit snapshot file instead of latest')
+    p_apply.add_argument('--state', default=str(STATE_FILE), help='Download state to update')
+    p_apply.add_argument('--mapping', action='append', default=[], help='Mapping JSON to update too (repeatable)')
+    p_apply.add_argument('--only', default=None, help=f"Comma-separated subset of: {','.join(BACKFILLS)}")
+    p_apply.add_argument('--overwrite', action='store_true', help='Replace non-empty cpf/gender/birthday/exam fields')
+    p_apply.add_argument('--write-legacy', action='store_true',
+                         help=f'Also write {DETAILS_FILE} and {ANAMNESIS_FILE}')
+    p_apply.add_argument('--dry-run', action='store_true')
+
+    p_info = sub.add_parser('info', help='Describe the latest snapshot')
+    p_info.add_argument('--email', default=os.getenv('EYERCLOUD_USUARIO'))
+    p_info.add_argument('--snapshot', default=None)
+
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"  Metadata snapshot -- {args.command}")
+    print("=" * 60)
+
+    if args.command == 'crawl':
+        asyncio.run(crawl(args))
+    elif args.command == 'apply':
+        apply(args)
+    else:
+        info(args)
+
+
+if __name__ == "__main__":
+    main()
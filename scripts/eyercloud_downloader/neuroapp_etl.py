@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+neuroapp-etl: one entry point for the EyerCloud -> Bytescale ETL.
+=================================================================
+Subcommands over the shared helpers in etl_common.py:
+
+    list            exams known for an account (--live: re-list via the browser)
+    fetch-details   /examData/list for exams without image details (browser)
+    download        download_staging_images.py (--dry-run: local preview)
+    upload          upload_staging_images.py (--dry-run: local preview)
+    report          per-account progress from the state files (--csv/--xlsx)
+    reconcile       reconcile_bytescale.py
+    work-queue      reconcile_sources.py: EyerCloud x disk x Bytescale x DB work queue
+    load-db         load_staging_db.py: COPY the states + mappings into the staging DB
+    dedup           image_dedup.py: perceptual-hash duplicates across all local images
+    link-patients   patient_linkage.py: duplicate patients across staging, main DB and EyerCloud
+
+Only the standard library is imported at startup. Playwright, requests and
+openpyxl are imported inside the subcommand that needs them, so --help,
+report, list and the --dry-run previews start in milliseconds. Options not
+listed below are passed through to the underlying script, e.g.
+`download --email x --password y --fetch-concurrency 16`. Those delegated runs
+also take --profile[=cprofile] (see profiling.py).
+
+Usage:
+    cd scripts/eyercloud_downloader
+    python neuroapp_etl.py report
+    python neuroapp_etl.py list --email "mozaniareis@usp.br" --limit 20
+    python neuroapp_etl.py list --email "mozaniareis@usp.br" --password "xxx" --live
+    python neuroapp_etl.py fetch-details --email "mozaniareis@usp.br" --password "xxx"
+    python neuroapp_etl.py download --email "mozaniareis@usp.br" --dry-run
+    python neuroapp_etl.py download --email "mozaniareis@usp.br" --password "xxx" --resume
+    python neuroapp_etl.py upload --email "mozaniareis@usp.br" --dry-run
+    python neuroapp_etl.py reconcile --dry-run
+    python neuroapp_etl.py work-queue --db db_images.csv
+    python neuroapp_etl.py load-db --dry-run
+    python neuroapp_etl.py dedup --show 20
+    python neuroapp_etl.py link-patients --cross-only
+"""
+
+import os
+import sys
+import argparse
+
+from etl_common import Account, load_json, save_json, USEFUL_TYPES
+
+REPORT_COLUMNS = ('account', 'exams_listed', 'exams_with_details', 'exams_complete',
+                  'images_expected', 'images_on_disk', 'images_mapped', 'failed')
+
+
+def _accounts(args):
+    if getattr(args, 'email', None):
+        return [Account(args.email)]
+    accounts = Account.discover()
+    if not accounts:
+        print("No staging_state_*.json found here (run from scripts/eyercloud_downloader or pass --email)")
+    return accounts
+
+
+def _require(args, *names):
+    missing = [f"--{n.replace('_', '-')}" for n in names if not getattr(args, n, None)]
+    if missing:
+        print(f"ERROR: {args.command} needs {' '.join(missing)}")
+        sys.exit(2)
+
+
+def _delegate(module_name, argv):
+    """Run another script's main() with argv, importing it (and its dependencies) only now."""
+    import importlib
+    from profiling import profile_main
+
+    module = importlib.import_module(module_name)
+    saved = sys.argv
+    sys.argv = [f"{module_name}.py"] + argv
+    try:
+        profile_main(module.main, module_name)
+    finally:
+        sys.argv = saved
+
+
+def _images_on_disk(download_dir):
+    """{uuid: absolute path} of the .jpg files under downloads_staging/<account>."""
+    images = {}
+    if not download_dir.exists():
+        return images
+    for folder in os.scandir(download_dir):
+        if not folder.is_dir():
+            continue
+        for entry in os.scandir(folder.path):
+            if entry.name.endswith('.jpg') and entry.is_file():
+                images[entry.name[:-4]] = os.path.abspath(entry.path)
+    return images
+
+
+def _mapped_uuids(acct):
+    mapping = load_json(acct.mapping_file, {}) or {}
+    return {img['uuid'] for entry in mapping.values() for img in entry.get('images', []) if img.get('uuid')}
+
+
+# --- list ---
+
+def cmd_list(args, extra):
+    if args.live:
+        _require(args, 'email', 'password')
+        _delegate('download_staging_images',
+                  ['--email', args.email, '--password', args.password, '--metadata-only'] + extra)
+        return
+
+    for acct in _accounts(args):
+        state = load_json(acct.staging_state_file, {}) or {}
+        exam_images = state.get('exam_images', {})
+        exams = sorted(state.get('exams', {}).values(), key=lambda e: e.get('examDate') or '', reverse=True)
+        print(f"{acct.email}: {len(exams)} exams, {len(state.get('patients', {}))} patients "
+              f"(listed {state.get('fetched_at') or 'never'})")
+        for exam in exams[:args.limit]:
+            print(f"  {(exam.get('examDate') or '')[:10]:<10}  {exam.get('id', '')}  "
+                  f"{len(exam_images.get(exam.get('id'), [])):>3} img  {exam.get('patientName', '')}")
+
+
+# --- fetch-details ---
+
+def cmd_fetch_details(args, extra):
+    import asyncio
+    _require(args, 'email', 'password')
+    asyncio.run(_fetch_details(args))
+
+
+async def _fetch_details(args):
+    from download_staging_images import async_playwright, exams_from_staging_state
+    from browser_bootstrap import open_browser, login_eyercloud, open_exam_page
+    from browser_batch import iter_exam_data
+    from etl_common import useful_images, exam_details_record
+
+    acct = Account(args.email)
+    staging_state = load_json(acct.staging_state_file)
+    if not staging_state:
+        print(f"ERROR: {acct.staging_state_file} not found. Run: python neuroapp_etl.py list --live ...")
+        sys.exit(1)
+    dl_state = load_json(acct.dl_state_file) or acct.new_dl_state()
+    known = dl_state['exam_details']
+    exams = {e['id']: e for e in exams_from_staging_state(staging_state) if args.all or e['id'] not in known}
+    print(f"Exams without details: {len(exams)}")
+    if not exams:
+        return
+
+    async with async_playwright() as p:
+        browser, context, page = await open_browser(p, acct.auth_file)
+        if not await login_eyercloud(page, args.email, args.password, acct.auth_file) or not await open_exam_page(page):
+            print("FATAL: Could not login.")
+            await browser.close()
+            sys.exit(1)
+
+        done = 0
+        async for exam_id, details in iter_exam_data(page, exams, concurrency=args.concurrency):
+            patient_name = (exams[exam_id].get('patient', {}) or {}).get('fullName', '') or 'Unknown'
+            record = exam_details_record(patient_name, exam_id, useful_images(details, USEFUL_TYPES))
+            record.pop('download_date')
+            known.setdefault(exam_id, {}).update(record)
+            done += 1
+            if done % 100 == 0:
+                save_json(dl_state, acct.dl_state_file)
+                print(f"  {done}/{len(exams)}")
+        await browser.close()
+
+    save_json(dl_state, acct.dl_state_file)
+    print(f"Details saved for {done} of {len(exams)} exams -> {acct.dl_state_file}")
+
+
+# --- download ---
+
+def cmd_download(args, extra):
+    if not args.dry_run:
+        _require(args, 'email', 'password')
+        argv = ['--email', args.email, '--password', args.password]
+        if args.resume:
+            argv.append('--resume')
+        _delegate('download_staging_images', argv + extra)
+        return
+
+    from completeness import LocalInventory, exam_is_complete
+    for acct in _accounts(args):
+        staging_state = load_json(acct.staging_state_file, {}) or {}
+        dl_state = load_json(acct.dl_state_file) or acct.new_dl_state()
+        done = set(dl_state['downloaded_exams'])
+        pending = [eid for eid in staging_state.get('exams', {}) if eid not in done]
+        inventory = LocalInventory(acct.download_dir)
+        details = dl_state['exam_details']
+        on_disk = [eid for eid in pending if exam_is_complete(details.get(eid), inventory, USEFUL_TYPES)]
+        without_details = [eid for eid in pending if eid not in details]
+        missing_images = sum(
+            details[eid].get('expected_images', 0) - len(inventory.files(details[eid].get('folder_name', '')))
+            for eid in pending if eid in details and eid not in on_disk
+        )
+        print(f"{acct.email}:")
+        print(f"  Exams listed:              {len(staging_state.get('exams', {}))}")
+        print(f"  Already downloaded:        {len(done)}")
+        print(f"  Pending:                   {len(pending)}")
+        print(f"    complete on disk:        {len(on_disk)} (only need marking)")
+        print(f"    need /examData/list:     {len(without_details)}")
+        print(f"    images missing on disk:  ~{max(missing_images, 0)}")
+
+
+# --- upload ---
+
+def cmd_upload(args, extra):
+    if not args.dry_run:
+        _require(args, 'email')
+        _delegate('upload_staging_images', ['--email', args.email] + extra)
+        return
+
+    for acct in _accounts(args):
+        on_disk = _images_on_disk(acct.download_dir)
+        progress = load_json(acct.upload_progress_file, {}) or {}
+        uploaded_paths = set(progress.get('uploaded_files', []))
+        mapped = _mapped_uuids(acct)
+        to_upload = [uuid for uuid, path in on_disk.items() if uuid not in mapped and path not in uploaded_paths]
+        print(f"{acct.email}:")
+        print(f"  Images on disk:   {len(on_disk)}")
+        print(f"  Already mapped:   {len(on_disk) - len(to_upload)}")
+        print(f"  To upload:        {len(to_upload)}")
+
+
+# --- report ---
+
+def account_report(acct):
+    staging_state = load_json(acct.staging_state_file, {}) or {}
+    dl_state = load_json(acct.dl_state_file) or acct.new_dl_state()
+    checkpoint = load_json(acct.checkpoint_file, {}) or {}
+    return {
+        'account': acct.email,
+        'exams_listed': len(staging_state.get('exams', {})),
+        'exams_with_details': len(dl_state['exam_details']),
+        'exams_complete': len(dl_state['downloaded_exams']),
+        'images_expected': sum(d.get('expected_images', 0) for d in dl_state['exam_details'].values()),
+        'images_on_disk': len(_images_on_disk(acct.download_dir)),
+        'images_mapped': len(_mapped_uuids(acct)),
+        'failed': len(checkpoint.get('failed', {})),
+    }
+
+
+def cmd_report(args, extra):
+    if args.legacy:
+        _delegate('regenerate_report', extra)
+        return
+
+    rows = [account_report(acct) for acct in _accounts(args)]
+    if args.json:
+        import json
+        print(json.dumps(rows, indent=2))
+    else:
+        labels = [c.replace('_', ' ') for c in REPORT_COLUMNS[1:]]
+        print(f"{'account':<36}" + ''.join(f"{label:>{len(label) + 2}}" for label in labels))
+        for row in rows:
+            print(f"{row['account']:<36}" + ''.join(f"{row[c]:>{len(label) + 2}}"
+                                                  for c, label in zip(REPORT_COLUMNS[1:], labels)))
+
+    if args.csv:
+        import csv
+        with open(args.csv, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS, delimiter=';')
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"CSV: {args.csv}")
+    if args.xlsx:
+        from openpyxl import Workbook
+        wb = Workbook()
+        ws = wb.active
+        ws.title = "Ingestão"
+        ws.append(list(REPORT_COLUMNS))
+        for row in rows:
+            ws.append([row[c] for c in REPORT_COLUMNS])
+        wb.save(args.xlsx)
+        print(f"XLSX: {args.xlsx}")
+
+
+# --- reconcile ---
+
+def cmd_reconcile(args, extra):
+    _delegate('reconcile_bytescale', extra)
+
+
+def cmd_work_queue(args, extra):
+    _delegate('reconcile_sources', extra)
+
+
+def cmd_load_db(args, extra):
+    _delegate('load_staging_db', extra)
+
+
+def cmd_dedup(args, extra):
+    _delegate('image_dedup', extra)
+
+
+def cmd_link_patients(args, extra):
+    _delegate('patient_linkage', extra)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='neuroapp-etl', description='EyerCloud -> Bytescale ETL')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def account_args(p, password=False):
+        p.add_argument('--email', default=None, help='EyerCloud login email (default: every account here)')
+        if password:
+            p.add_argument('--password', default=None, help='EyerCloud password')
+
+    p = sub.add_parser('list', help='Exams known for an account')
+    account_args(p, password=True)
+    p.add_argument('--live', action='store_true', help='Re-list via the browser (download_staging_images --metadata-only)')
+    p.add_argument('--limit', type=int, default=0, help='Also print the N newest exams')
+    p.set_defaults(func=cmd_list)
+
+    p = sub.add_parser('fetch-details', help='/examData/list for exams without image details')
+    account_args(p, password=True)
+    p.add_argument('--all', action='store_true', help='Refetch exams that already have details')
+    p.add_argument('--concurrency', type=int, default=8, help='Requests in flight inside the browser')
+    p.set_defaults(func=cmd_fetch_details)
+
+    p = sub.add_parser('download', help='Download pending exams (download_staging_images.py)')
+    account_args(p, password=True)
+    p.add_argument('--resume', action='store_true', help='Reuse the exam list from the staging state')
+    p.add_argument('--dry-run', action='store_true', help='Only show what is pending (no browser, no network)')
+    p.set_defaults(func=cmd_download)
+
+    p = sub.add_parser('upload', help='Upload downloaded images (upload_staging_images.py)')
+    account_args(p)
+    p.add_argument('--dry-run', action='store_true', help='Only count what is left to upload (no network)')
+    p.set_defaults(func=cmd_upload)
+
+    p = sub.add_parser('report', help='Per-account progress from the local state files')
+    account_args(p)
+    p.add_argument('--json', action='store_true', help='Print JSON instead of a table')
+    p.add_argument('--csv', default=None, help='Also write the table as CSV')
+    p.add_argument('--xlsx', default=None, help='Also write the table as XLSX (needs openpyxl)')
+    p.add_argument('--legacy', action='store_true', help='Run regenerate_report.py instead')
+    p.set_defaults(func=cmd_report)
+
+    p = sub.add_parser('reconcile', help='Rebuild the mapping from Bytescale (reconcile_bytescale.py)')
+    p.set_defaults(func=cmd_reconcile)
+
+    p = sub.add_parser('work-queue', help='Download/upload/relink/orphaned queue (reconcile_sources.py)')
+    p.set_defaults(func=cmd_work_queue)
+
+    p = sub.add_parser('load-db', help='Bulk load states + mappings into the staging DB (load_staging_db.py)')
+    p.set_defaults(func=cmd_load_db)
+
+    p = sub.add_parser('dedup', help='Near-duplicate images across accounts (image_dedup.py)')
+    p.set_defaults(func=cmd_dedup)
+
+    p = sub.add_parser('link-patients', help='Duplicate patients across sources (patient_linkage.py)')
+    p.set_defaults(func=cmd_link_patients)
+    return parser
+
+
+def passes_through(args):
+    """True when unknown options go to the underlying script."""
+    if args.func in (cmd_reconcile, cmd_work_queue, cmd_load_db, cmd_dedup,
+                     cmd_link_patients):
+        return True
+    if args.func is cmd_list:
+        return args.live
+    if args.func in (cmd_download, cmd_upload):
+        return not args.dry_run
+    return False
+
+
+def main(argv=None):
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if extra and not passes_through(args):
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    args.func(args, extra)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""
+Record linkage for duplicate patients (staging + main DB).
+==========================================================
+find_duplicates.js, consolidate_staging_dupes.js, check_pending_duplicates.js,
+cruzar_mozania.py and friends each normalize names their own way and compare
+every patient with every other one. This does it once for all sources:
+
+    1. normalize every record once: name (accents, punctuation, particles,
+       the prontuario/CPF digits EyerCloud users type into the name), CPF
+       (digits, check digits), birth date (YYYY-MM-DD) and prontuario
+       (zero-padded segments, '6.31.88' == '006.031.088');
+    2. candidate pairs come only from blocks that share a key: CPF,
+       prontuario, birth date + phonetic first name, phonetic first + last
+       name. Blocks larger than --max-block (MARIA ... SILVA) are dropped and
+       reported rather than scanned;
+    3. pairs are scored in numpy batches with agree/disagree weights per field
+       (CPF and birth date disagreeing weigh heavily against a match) plus the
+       overlap of the phonetic name tokens;
+    4. pairs >= --threshold are joined into clusters (union-find), ranked by
+       their weakest link; pairs between --review and --threshold go to a
+       review list.
+
+Sources (each optional, all used when present):
+    --staging-raw   retina_apoe/staging_patients_raw.json (export of StagingPatient)
+    --snapshot      scripts/db_snapshots/snapshot_*.json (node scripts/db_snapshot.js; Patient)
+    staging_state_*.json in this folder (EyerCloud patients with CPF/birthday/mrn)
+
+Output: patient_duplicates.json
+
+Usage:
+    cd scripts/eyercloud_downloader
+    python patient_linkage.py
+    python patient_linkage.py --cross-only            # only clusters spanning two sources
+    python patient_linkage.py --snapshot ../db_snapshots/snapshot_2026-02-20_1015.json --show 30
+    python patient_linkage.py --threshold 10 --review 6
+"""
+
+import re
+import sys
+import time
+import zlib
+import argparse
+from pathlib import Path
+from functools import lru_cache
+from itertools import combinations
+
+import numpy as np
+
+from etl_common import PROJECT_ROOT, Account, UnionFind, load_json, save_json, normalize_name
+from profiling import profile_main
+
+STAGING_RAW_FILE = PROJECT_ROOT / 'retina_apoe' / 'staging_patients_raw.json'
+SNAPSHOT_DIR = PROJECT_ROOT / 'scripts' / 'db_snapshots'
+OUTPUT_FILE = Path('patient_duplicates.json')
+
+MAX_BLOCK = 200
+BATCH_SIZE = 1 << 18  # pairs per scoring batch
+THRESHOLD = 8.0
+REVIEW = 4.0
+
+# (agree, disagree) weights, in log-odds-ish points; missing on either side = 0
+WEIGHTS = {
+    'cpf': (9.0, -6.0),
+    'birth': (4.0, -5.0),
+    'prontuario': (5.0, -1.0),  # reused across clinics, so a mismatch says little
+    'first': (1.5, -2.0),
+    'last': (1.0, -0.5),
+}
+NAME_WEIGHT = 8.0  # times (token overlap - 0.5)
+
+PARTICLES = {'DE', 'DA', 'DO', 'DAS', 'DOS', 'DES', 'E'}
+PRON_RE = re.compile(r'(\d{2,3}[./]\d{2,3}[./]?\d{0,3}|\d{6,9})\s*$')
+CPF_RE = re.compile(r'\d{3}\.?\d{3}\.?\d{3}-?\d{2}')
+
+
+# --- normalization ---
+
+def normalize_cpf(value):
+    """11 digits with valid check digits, else ''."""
+    digits = re.sub(r'\D', '', value or '')
+    if len(digits) != 11 or digits == digits[0] * 11:
+        return ''
+    for n in (9, 10):
+        total = sum(int(d) * w for d, w in zip(digits[:n], range(n + 1, 1, -1)))
+        if (total * 10) % 11 % 10 != int(digits[n]):
+            return ''
+    return digits
+
+
+def normalize_birth(value):
+    """'DD/MM/YYYY' or ISO -> 'YYYY-MM-DD' ('' for missing/placeholder dates)."""
+    value = (value or '').strip()
+    m = re.match(r'(\d{1,2})/(\d{1,2})/(\d{4})', value)
+    if m:
+        day, month, year = m.groups()
+        value = f"{year}-{int(month):02d}-{int(day):02d}"
+    elif re.match(r'\d{4}-\d{2}-\d{2}', value):
+        value = value[:10]  # EyerCloud stores local midnight as T03:00Z: same day
+    else:
+        return ''
+    if value[:4] < '1900' or value.startswith('1970-01-01'):
+        return ''
+    return value
+
+
+def normalize_prontuario(value):
+    """Segmented numbers zero-padded ('6.31.88' -> '006.031.088'); plain ones as digits."""
+    value = (value or '').strip()
+    parts = [p for p in re.split(r'[./\s-]+', value) if p]
+    if len(parts) >= 2 and all(p.isdigit() for p in parts):
+        return '.'.join(p.zfill(3) for p in parts)
+    digits = re.sub(r'\D', '', value)
+    return digits if len(digits) >= 4 else ''
+
+
+def split_raw_name(raw):
+    """(name, embedded prontuario, embedded CPF) from a name field like 'MARIA SILVA 003.16.58'."""
+    raw = (raw or '').strip()
+    cpf = ''
+    m = CPF_RE.search(raw)
+    if m and normalize_cpf(m.group(0)):
+        cpf = normalize_cpf(m.group(0))
+        raw = (raw[:m.start()] + raw[m.end():]).strip()
+    pron = ''
+    m = PRON_RE.search(raw)
+    if m:
+        pron = m.group(1)
+        raw = raw[:m.start()].strip()
+    return raw, pron, cpf
+
+
+@lru_cache(maxsize=None)
+def phonetic(token):
+    """Portuguese-oriented phonetic key: spelling variants (SOUSA/SOUZA, LUIS/LUIZ,
+    ELISABETH/ELIZABETE, THEREZA/TEREZA) share a key."""
+    t = token
+    for a, b in (('PH', 'F'), ('LH', 'L'), ('NH', 'N'), ('CH', 'X'), ('SH', 'X'),
+                 ('QU', 'K'), ('GUE', 'GE'), ('GUI', 'GI'), ('TH', 'T'), ('W', 'V'), ('Y', 'I')):
+        t = t.replace(a, b)
+    t = re.sub(r'C(?=[EI])', 'S', t)
+    t = t.replace('C', 'K').replace('Z', 'S')
+    t = re.sub(r'G(?=[EI])', 'J', t)
+    t = re.sub(r'N(?=[^AEIOU]|$)', 'M', t)  # nasal before consonant / at the end
+    if t.startswith('H'):
+        t = t[1:]
+    t = t.replace('H', '')
+    t = re.sub(r'(.)\1+', r'\1', t)
+    if not t:
+        return token
+    # first letter + consonants, and a final A/O (MARIA != MARIO)
+    ending = t[-1] if len(t) > 1 and t[-1] in 'AO' else ''
+    return t[0] + re.sub(r'[AEIOU]', '', t[1:]) + ending
+
+
+def name_tokens(name):
+    name = re.sub(r'[^A-Z ]', ' ', normalize_name(name))
+    return [t for t in name.split() if t not in PARTICLES]
+
+
+def make_record(source, pid, raw_name, cpf='', birth='', prontuario='', extra=None):
+    name, embedded_pron, embedded_cpf = split_raw_name(raw_name)
+    tokens = name_tokens(name)
+    phon = [phonetic(t) for t in tokens if len(t) > 1]
+    return {
+        'key': f"{source}:{pid}",
+        'source': source,
+        'id': pid,
+        'raw_name': raw_name,
+        'name': ' '.join(tokens),
+        'cpf': normalize_cpf(cpf) or embedded_cpf,
+        'birth': normalize_birth(birth),
+        'prontuario': normalize_prontuario(prontuario) or normalize_prontuario(embedded_pron),
+        'phonetic': phon,
+        **(extra or {}),
+    }
+
+
+# --- sources ---
+
+def load_staging_raw(path):
+    records = []
+    for p in load_json(path, []) or []:
+        records.append(make_record('staging', p['id'], p.get('rawName') or p.get('normalizedName') or '',
+                                   p.get('cpf') or p.get('extractedCpf') or '',
+                                   str(p.get('birthDate') or ''),
+                                   # the prontuario column holds clinic codes ('PD'); the real one is in the name
+                                   p.get('prontuario') if re.search(r'\d', p.get('prontuario') or '') else '',
+                                   {'login': p.get('sourceLoginId')}))
+    return records
+
+
+def load_snapshot(path):
+    snapshot = load_json(path, {}) or {}
+    return [make_record('main', p['id'], p.get('name') or '', p.get('cpf') or '', str(p.get('birthDate') or ''))
+            for p in snapshot.get('data', {}).get('patients', [])]
+
+
+def load_eyercloud_states(accounts):
+    records = []
+    for acct in accounts:
+        state = load_json(acct.staging_state_file, {}) or {}
+        for pid, p in state.get('patients', {}).items():
+            records.append(make_record(f"eyercloud/{acct.email_safe}", pid, p.get('rawName') or '',
+                                       p.get('cpf') or '', p.get('birthday') or '', p.get('prontuario') or ''))
+    return records
+
+
+def latest_snapshot():
+    snapshots = sorted(SNAPSHOT_DIR.glob('snapshot_*.json'))
+    return snapshots[-1] if snapshots else None
+
+
+# --- blocking ---
+
+def blocking_keys(rec):
+    keys = []
+    if rec['cpf']:
+        keys.append(('cpf', rec['cpf']))
+    if rec['prontuario']:
+        keys.append(('prontuario', rec['prontuario']))
+    phon = rec['phonetic']
+    if phon:
+        if rec['birth']:
+            keys.append(('birth+first', rec['birth'], phon[0]))
+        if len(phon) > 1:
+            keys.append(('first+last', phon[0], phon[-1]))
+        else:
+            keys.append(('first+last', phon[0], ''))
+    return keys
+
+
+def candidate_pairs(records, max_block=MAX_BLOCK):
+    """(i, j) index arrays of every pair sharing a block, plus the oversized blocks."""
+    blocks = {}
+    for i, rec in enumerate(records):
+        for key in blocking_keys(rec):
+            blocks.setdefault(key, []).append(i)
+
+    n = len(records)
+    encoded = []
+    oversized = []
+    for key, members in blocks.items():
+        if len(members) < 2:
+            continue
+        if len(members) > max_block:
+            oversized.append((key, len(members)))
+            continue
+        encoded.extend(i * n + j for i, j in combinations(members, 2))
+    pairs = np.unique(np.array(encoded, dtype=np.int64))
+    oversized.sort(key=lambda kv: -kv[1])
+    return pairs // n, pairs % n, len(blocks), oversized
+
+
+# --- scoring ---
+
+def _codes(values):
+    """Factorize strings to int codes, '' -> -1."""
+    index = {}
+    return np.array([index.setdefault(v, len(index)) if v else -1 for v in values], dtype=np.int64)
+
+
+def _signature(tokens):
+    """64-bit set signature of the phonetic tokens (for vectorized overlap)."""
+    sig = 0
+    for t in tokens:
+        sig |= 1 << (zlib.crc32(t.encode()) & 63)
+    return sig
+
+
+def _popcount(x):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(x).astype(np.int64)
+    return np.unpackbits(x.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1).astype(np.int64)
+
+
+def feature_arrays(records):
+    return {
+        'cpf': _codes(r['cpf'] for r in records),
+        'birth': _codes(r['birth'] for r in records),
+        'prontuario': _codes(r['prontuario'] for r in records),
+        'first': _codes(r['phonetic'][0] if r['phonetic'] else '' for r in records),
+        'last': _codes(r['phonetic'][-1] if len(r['phonetic']) > 1 else '' for r in records),
+        'sig': np.array([_signature(r['phonetic']) for r in records], dtype=np.uint64),
+    }
+
+
+def score_pairs(features, left, right, batch_size=BATCH_SIZE):
+    """Match score of every (left[k], right[k]) pair, computed batch by batch."""
+    scores = np.empty(len(left), dtype=np.float64)
+    for start in range(0, len(left), batch_size):
+        i = left[start:start + batch_size]
+        j = right[start:start + batch_size]
+        total = np.zeros(len(i), dtype=np.float64)
+        for field, (agree, disagree) in WEIGHTS.items():
+            a, b = features[field][i], features[field][j]
+            both = (a >= 0) & (b >= 0)
+            total += np.where(both & (a == b), agree, np.where(both, disagree, 0.0))
+        sa, sb = features['sig'][i], features['sig'][j]
+        union = _popcount(sa | sb)
+        overlap = np.where(union > 0, _popcount(sa & sb) / np.maximum(union, 1), 0.0)
+        total += NAME_WEIGHT * (overlap - 0.5)
+        scores[start:start + batch_size] = total
+    return scores
+
+
+# --- clustering ---
+
+def member(rec):
+    return {k: rec[k] for k in ('source', 'id', 'raw_name', 'cpf', 'birth', 'prontuario') if rec.get(k)}
+
+
+def build_clusters(records, left, right, scores, threshold):
+    keep = scores >= threshold
+    uf = UnionFind(len(records))
+    for i, j in zip(left[keep].tolist(), right[keep].tolist()):
+        uf.union(i, j)
+
+    edges = {}
+    for i, j, s in zip(left[keep].tolist(), right[keep].tolist(), scores[keep].tolist()):
+        edges.setdefault(uf.find(i), []).append((i, j, s))
+
+    clusters = []
+    for root, links in edges.items():
+        idx = sorted({k for i, j, _ in links for k in (i, j)})
+        sources = sorted({records[k]['source'] for k in idx})
+        clusters.append({
+            'score': round(min(s for _, _, s in links), 2),
+            'size': len(idx),
+            'sources': sources,
+            'members': [member(records[k]) for k in idx],
+            'links': [[records[i]['key'], records[j]['key'], round(s, 2)] for i, j, s in links],
+        })
+    clusters.sort(key=lambda c: (-c['score'], -c['size']))
+    return clusters
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Blocked record linkage of duplicate patients')
+    parser.add_argument('--staging-raw', default=str(STAGING_RAW_FILE), help='StagingPatient export (JSON list)')
+    parser.add_argument('--snapshot', default=None, help='db_snapshot.js output (default: latest)')
+    parser.add_argument('--no-states', action='store_true', help='Ignore staging_state_*.json in this folder')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='Score to call a pair a duplicate')
+    parser.add_argument('--review', type=float, default=REVIEW, help='Score to list a pair for manual review')
+    parser.add_argument('--max-block', type=int, default=MAX_BLOCK, help='Skip blocking keys shared by more records')
+    parser.add_argument('--cross-only', action='store_true', help='Only clusters spanning more than one source')
+    parser.add_argument('--show', type=int, default=10, help='Print the N best clusters')
+    parser.add_argument('--output', default=str(OUTPUT_FILE))
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    records = []
+    if Path(args.staging_raw).exists():
+        loaded = load_staging_raw(args.staging_raw)
+        print(f"  staging raw:  {len(loaded):>7}  {args.staging_raw}")
+        records += loaded
+    snapshot = Path(args.snapshot) if args.snapshot else latest_snapshot()
+    if snapshot and snapshot.exists():
+        loaded = load_snapshot(snapshot)
+        print(f"  main DB:      {len(loaded):>7}  {snapshot}")
+        records += loaded
+    if not args.no_states:
+        for acct in Account.discover():
+            loaded = load_eyercloud_states([acct])
+            print(f"  eyercloud:    {len(loaded):>7}  {acct.staging_state_file}")
+            records += loaded
+    if len(records) < 2:
+        print("Nothing to link: no sources found.")
+        sys.exit(1)
+    t_load = time.perf_counter() - started
+
+    t0 = time.perf_counter()
+    left, right, n_blocks, oversized = candidate_pairs(records, args.max_block)
+    t_block = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    scores = score_pairs(feature_arrays(records), left, right)
+    t_score = time.perf_counter() - t0
+
+    clusters = build_clusters(records, left, right, scores, args.threshold)
+    if args.cross_only:
+        clusters = [c for c in clusters if len(c['sources']) > 1]
+
+    in_review = (scores >= args.review) & (scores < args.threshold)
+    order = np.argsort(-scores[in_review], kind='stable')
+    review = [[member(records[i]), member(records[j]), round(s, 2)]
+              for i, j, s in zip(left[in_review][order].tolist(), right[in_review][order].tolist(),
+                                 scores[in_review][order].tolist())]
+    if args.cross_only:
+        review = [r for r in review if r[0]['source'] != r[1]['source']]
+
+    save_json({
+        'records': len(records),
+        'threshold': args.threshold,
+        'review_threshold': args.review,
+        'oversized_blocks': [[' / '.join(k), n] for k, n in oversized],
+        'clusters': clusters,
+        'review': review,
+    }, args.output)
+
+    n = len(records)
+    print("=" * 65)
+    print(f"  Records:         {n} (load {t_load:.2f}s)")
+    print(f"  Blocks:          {n_blocks} ({len(oversized)} over {args.max_block} skipped)")
+    print(f"  Candidate pairs: {len(left)} of {n * (n - 1) // 2} ({t_block:.2f}s blocking, {t_score:.2f}s scoring)")
+    print(f"  Clusters:        {len(clusters)} ({sum(c['size'] for c in clusters)} records)")
+    print(f"  For review:      {len(review)}")
+    print(f"  Output:          {args.output}")
+    print("=" * 65)
+    for key, size in oversized[:5]:
+        print(f"  oversized block {' / '.join(key)}: {size} records")
+    for cluster in clusters[:args.show]:
+        print(f"\n  score {cluster['score']:>6}  {', '.join(cluster['sources'])}")
+        for m in cluster['members']:
+            extra = '  '.join(f"{k}={m[k]}" for k in ('cpf', 'birth', 'prontuario') if m.get(k))
+            print(f"    {m['source']:<12} {m['raw_name'][:45]:<45} {extra}")
+
+
+if __name__ == "__main__":
+    profile_main(main, 'patient_linkage')
@@ -0,0 +1,19 @@
+"""
+Child-process hook for --profile runs.
+======================================
+profiling.child_env() puts this folder first on PYTHONPATH of the processes
+a profiled script starts (the AutoMorph modules), so Python imports it at
+startup and each child profiles itself into the parent's output prefix.
+Does nothing when NEUROAPP_PROFILE is not set.
+"""
+
+import os
+import sys
+
+if os.environ.get('NEUROAPP_PROFILE'):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        import profiling
+        profiling.start_child()
+    finally:
+        del sys.path[0]
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+Opt-in profiling for the ETL and retina_apoe scripts: --profile.
+===============================================================
+A slow sync or AutoMorph batch only left wall-clock prints behind. Any script
+whose entry point goes through profile_main() accepts
+
+    --profile                   sampling profiler (default, all threads)
+    --profile=cprofile          cProfile (deterministic, main thread only)
+    --profile-interval 0.01     sampling period in seconds
+
+and writes, next to its run log (metrics/ for the ETL scripts, profiles/
+for retina_apoe):
+
+    <script>_<timestamp>.folded        collapsed stacks, one "frame;frame;... count"
+                                       line per stack (flamegraph.pl, speedscope,
+                                       inferno-flamegraph); the first frames are the
+                                       phase and the thread name
+    <script>_<timestamp>.prof          cProfile stats (pstats, snakeviz) with =cprofile
+    <script>_<timestamp>_phases.json   per-phase wall-clock timers
+
+Phases come from telemetry.Metrics.mark() (login, listing, downloads, ...)
+and from profiling.mark() / profiling.section() in scripts without Metrics.
+The sampler is wall-clock: a thread waiting on a socket or on a subprocess
+shows up where it waits, which is what a slow sync needs. Child Python
+processes started through child_env() (the AutoMorph modules) are profiled
+too, into <script>_<timestamp>__<child>_<pid>.folded/.prof, under the phase
+that started them -- `cat <script>_<timestamp>*.folded` is one flame graph.
+
+Without --profile, profile_main() just calls main(): no thread, no tracing,
+and mark()/section() return after one global check.
+
+Usage:
+    cd scripts/eyercloud_downloader
+    python download_staging_images.py --email x --password y --profile
+    python neuroapp_etl.py download --email x --password y --profile=cprofile
+    python profiling.py top metrics/download_staging_images_20260101_120000.folded
+    python profiling.py run [--profile=cprofile] other_script.py [args...]
+    flamegraph.pl metrics/download_staging_images_20260101_120000.folded > flame.svg
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import inspect
+import argparse
+import threading
+from pathlib import Path
+from datetime import datetime
+from collections import Counter
+from contextlib import contextmanager
+
+PROFILE_DIR = Path("metrics")  # same folder as the telemetry timeline
+MODES = ('sample', 'cprofile')
+DEFAULT_INTERVAL = 0.01
+TOP = 20
+# Handed to child processes by child_env(); read by profile_hook/sitecustomize.py
+ENV_MODE = 'NEUROAPP_PROFILE'
+ENV_PREFIX = 'NEUROAPP_PROFILE_PREFIX'
+ENV_PHASE = 'NEUROAPP_PROFILE_PHASE'
+ENV_INTERVAL = 'NEUROAPP_PROFILE_INTERVAL'
+HOOK_DIR = Path(__file__).resolve().parent / 'profile_hook'
+
+_active = None
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+class Profiler:
+    """One profiled run: a sampler thread or cProfile, plus phase timers."""
+
+    def __init__(self, script, mode='sample', out_dir=PROFILE_DIR, interval=DEFAULT_INTERVAL,
+                 prefix=None, root=None, quiet=False):
+        if mode not in MODES:
+            raise ValueError(f"unknown profile mode {mode!r} (expected one of {', '.join(MODES)})")
+        self.script = script
+        self.mode = mode
+        self.interval = interval
+        self.started_at = datetime.now()
+        self.prefix = Path(prefix) if prefix else \
+            Path(out_dir) / f"{script}_{self.started_at.strftime('%Y%m%d_%H%M%S')}"
+        self.root = root  # phase of the parent process, for child profiles
+        self.quiet = quiet
+        self.phases = []  # (name, seconds)
+        self.samples = Counter()  # (phase, thread, code objects root-first) -> count
+        self._stack = []  # open phases: [name, started]
+        self._stop = threading.Event()
+        self._thread = None
+        self._cprofile = None
+        self.started = None
+        self.elapsed = 0.0
+
+    # --- phases ---
+
+    def phase_label(self):
+        names = [name for name, _ in self._stack]
+        if self.root:
+            names.insert(0, self.root)
+        return '/'.join(names) or self.script
+
+    def mark(self, name=None):
+        """End the current top-level phase and start `name` (same contract as Metrics.mark)."""
+        while self._stack:
+            self._end()
+        if name is not None:
+            self._stack.append((name, time.perf_counter()))
+
+    @contextmanager
+    def section(self, name):
+        """Nested phase inside the current one (e.g. one AutoMorph module in run_pipeline)."""
+        self._stack.append((name, time.perf_counter()))
+        try:
+            yield
+        finally:
+            self._end()
+
+    def _end(self):
+        label = self.phase_label()
+        _, started = self._stack.pop()
+        self.phases.append((label, time.perf_counter() - started))
+
+    # --- collection ---
+
+    def start(self):
+        global _active
+        self.started = time.perf_counter()
+        if self.mode == 'cprofile':
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        else:
+            self._thread = threading.Thread(target=self._sample_loop, name='profiler', daemon=True)
+            self._thread.start()
+        _active = self
+        return self
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            phase = self.phase_label()
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                stack.reverse()
+                self.samples[(phase, names.get(ident, str(ident)), tuple(stack))] += 1
+
+    def stop(self):
+        """Stop collecting and write the outputs; returns the files written."""
+        global _active
+        if _active is self:
+            _active = None
+        self.mark(None)
+        self.elapsed = time.perf_counter() - self.started
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+        self.prefix.parent.mkdir(parents=True, exist_ok=True)
+        written = []
+        if self._cprofile is not None:
+            path = self.prefix.with_name(self.prefix.name + '.prof')
+            self._cprofile.dump_stats(str(path))
+            written.append(path)
+        else:
+            path = self.prefix.with_name(self.prefix.name + '.folded')
+            path.write_text(''.join(f"{line} {count}\n" for line, count in self.folded()), encoding='utf-8')
+            written.append(path)
+        if self.root is None:
+            path = self.prefix.with_name(self.prefix.name + '_phases.json')
+            path.write_text(json.dumps(self.summary(), indent=2), encoding='utf-8')
+            written.append(path)
+        if not self.quiet:
+            self.print_summary(written)
+        return written
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    # --- output ---
+
+    def folded(self):
+        """(collapsed stack, count) pairs; frame names never contain ';'."""
+        lines = Counter()
+        for (phase, thread, stack), count in self.samples.items():
+            frames = [phase] + ([self.script] if self.root else []) + [thread]
+            frames += [_frame_label(code) for code in stack]
+            lines[';'.join(f.replace(';', ',') for f in frames)] += count
+        return sorted(lines.items())
+
+    def summary(self):
+        totals = {}
+        for name, seconds in self.phases:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return {
+            'script': self.script,
+            'mode': self.mode,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'wall_seconds': round(self.elapsed, 3),
+            'interval': self.interval if self.mode == 'sample' else None,
+            'samples': sum(self.samples.values()),
+            'phases': [{'name': n, 'seconds': round(s, 3)} for n, s in self.phases],
+            'phase_totals': {n: round(s, 3) for n, s in totals.items()},
+        }
+
+    def print_summary(self, written):
+        print(f"\n{'=' * 60}\nProfile ({self.mode}): {self.script}, {self.elapsed:.1f}s wall")
+        print('=' * 60)
+        for name, seconds in self.phases:
+            print(f"  {name:<40} {seconds:>9.2f}s")
+        if self._cprofile is not None:
+            import pstats
+            pstats.Stats(self._cprofile).sort_stats('cumulative').print_stats(TOP)
+        elif self.samples:
+            print_top(self.folded(), TOP)
+        for path in written:
+            print(f"  -> {path}")
+
+
+def print_top(folded, limit=TOP):
+    """Leaf frames by share of samples (the self time of a sampling profile)."""
+    leaves = Counter()
+    for line, count in folded:
+        leaves[line.rsplit(';', 1)[-1]] += count
+    total = sum(leaves.values()) or 1
+    print(f"\n  {'self %':>7}  {'samples':>8}  frame")
+    for frame, count in leaves.most_common(limit):
+        print(f"  {100 * count / total:>6.1f}%  {count:>8}  {frame}")
+
+
+# --- module-level hooks (no-ops unless a profile is running) ---
+
+def active():
+    return _active
+
+
+def mark(name=None):
+    if _active is not None:
+        _active.mark(name)
+
+
+@contextmanager
+def section(name):
+    if _active is None:
+        yield
+        return
+    with _active.section(name):
+        yield
+
+
+def child_env(env):
+    """env for a child Python process, with the profile hook added when profiling."""
+    if _active is None:
+        return env
+    env = dict(env)
+    path = env.get('PYTHONPATH')
+    env['PYTHONPATH'] = f"{HOOK_DIR}{os.pathsep}{path}" if path else str(HOOK_DIR)
+    env[ENV_MODE] = _active.mode
+    env[ENV_PREFIX] = str(_active.prefix.resolve())
+    env[ENV_PHASE] = _active.phase_label()
+    env[ENV_INTERVAL] = str(_active.interval)
+    return env
+
+
+def cmd_label(cmd):
+    """Short section name for a shell command: its .py/.sh script, else the executable."""
+    words = cmd.replace('"', ' ').split()
+    return next((Path(w).name for w in words if w.endswith(('.py', '.sh'))), Path(words[0]).name)
+
+
+def start_child():
+    """Profile this (child) process until exit; called from profile_hook/sitecustomize.py."""
+    mode = os.environ.get(ENV_MODE)
+    prefix = os.environ.get(ENV_PREFIX)
+    if mode not in MODES or not prefix or _active is not None:
+        return
+    profiler = Profiler('python', mode, interval=float(os.environ.get(ENV_INTERVAL) or DEFAULT_INTERVAL),
+                        root=os.environ.get(ENV_PHASE) or 'child', quiet=True)
+    profiler.start()
+
+    def finish():
+        # sys.argv is only set once the script starts, so the output is named here
+        name = Path(sys.argv[0]).stem if sys.argv and sys.argv[0] else 'python'
+        profiler.script = name
+        profiler.prefix = Path(f"{prefix}__{name}_{os.getpid()}")
+        try:
+            profiler.stop()
+        except OSError:
+            pass
+
+    atexit.register(finish)
+
+
+# --- entry point wrapper ---
+
+def pop_profile_args(argv):
+    """Remove --profile[=mode] / --profile-interval from argv; return (mode or None, interval)."""
+    mode, interval = None, DEFAULT_INTERVAL
+    rest = [argv[0]] if argv else []
+    i = 1
+    while i < len(argv):
+        arg = argv[i]
+        if arg == '--profile':
+            mode = 'sample'
+            if i + 1 < len(argv) and argv[i + 1] in MODES:
+                mode = argv[i + 1]
+                i += 1
+        elif arg.startswith('--profile='):
+            mode = arg.split('=', 1)[1]
+            if mode not in MODES:
+                raise SystemExit(f"--profile: expected one of {', '.join(MODES)}, got {mode!r}")
+        elif arg == '--profile-interval' and i + 1 < len(argv):
+            interval = float(argv[i + 1])
+            i += 1
+        elif arg.startswith('--profile-interval='):
+            interval = float(arg.split('=', 1)[1])
+        else:
+            rest.append(arg)
+        i += 1
+    argv[:] = rest
+    return mode, interval
+
+
+def _call(main):
+    result = main()
+    if inspect.iscoroutine(result):
+        import asyncio
+        return asyncio.run(result)
+    return result
+
+
+def profile_main(main, script, out_dir=PROFILE_DIR):
+    """Run main() (sync or async), under a profiler if sys.argv asks for one."""
+    mode, interval = pop_profile_args(sys.argv)
+    if mode is None:
+        return _call(main)
+    with Profiler(script, mode, out_dir, interval):
+        return _call(main)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile output helpers (see the module docstring)')
+    sub = parser.add_subparsers(dest='command', required=True)
+    top = sub.add_parser('top', help='Leaf frames with the most samples in .folded files')
+    top.add_argument('files', nargs='+', type=Path)
+    top.add_argument('--limit', type=int, default=TOP)
+    run = sub.add_parser('run', help='Run any script under --profile (like python -m cProfile)')
+    run.add_argument('--out-dir', type=Path, default=PROFILE_DIR)
+    run.add_argument('script', type=Path)
+    run.add_argument('args', nargs=argparse.REMAINDER)
+    mode, interval = pop_profile_args(sys.argv)
+    args = parser.parse_args()
+
+    if args.command == 'top':
+        folded = []
+        for path in args.files:
+            for line in path.read_text(encoding='utf-8').splitlines():
+                stack, _, count = line.rpartition(' ')
+                folded.append((stack, int(count)))
+        print_top(folded, args.limit)
+        return
+
+    import runpy
+    sys.argv = [str(args.script)] + args.args
+    sys.path.insert(0, str(args.script.resolve().parent))
+    with Profiler(args.script.stem, mode or 'sample', args.out_dir, interval):
+        runpy.run_path(str(args.script), run_name='__main__')
+
+
+if __name__ == "__main__":
+    main()
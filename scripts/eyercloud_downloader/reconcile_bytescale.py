@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Rebuild the Bytescale mapping from what is actually stored remotely.
+====================================================================
+Lists the remote /neuroapp/patients/... tree (folders in parallel, each
+folder page by page), joins every remote file against the local manifest
+(download state files + image_types.json + local download folders) and writes
+a mapping in the bytescale_mapping_v2.json format. Nothing is uploaded.
+
+Use it when the local upload state was lost or the mapping files diverged
+(bytescale_mapping_v2.json, bytescale_mapping_cleaned.json,
+atibaia_bytescale_mapping.json, ...).
+
+Usage:
+    cd scripts/eyercloud_downloader
+    python reconcile_bytescale.py --dry-run
+    python reconcile_bytescale.py --output bytescale_mapping_reconciled.json
+    python reconcile_bytescale.py --root /neuroapp/staging/patients \\
+        --state staging_download_state_mozaniareis.json \\
+        --downloads downloads_staging/mozaniareis
+    python reconcile_bytescale.py --backend local:/tmp/fake_bytescale   # offline
+    python reconcile_bytescale.py --write-progress bytescale_upload_progress.json
+
+If any folder listing fails nothing is written (a partial listing would make
+the uploader re-upload the files it missed); --force writes it anyway.
+"""
+
+import argparse
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from bytescale_backend import get_backend
+from etl_common import load_json, save_json
+from generate_derivatives import is_derivative_filename
+
+DEFAULT_ROOT = "/neuroapp/patients"
+DEFAULT_STATES = ["download_state.json"]
+DEFAULT_OUTPUT = Path("bytescale_mapping_reconciled.json")
+TYPES_FILE = Path("image_types.json")
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png')
+
+METADATA_FIELDS = (
+    'clinic_name', 'birthday', 'gender', 'cpf', 'exam_date',
+    'underlying_diseases', 'ophthalmic_diseases', 'otherDisease',
+)
+
+
+def list_folder_all_pages(backend, folder_path):
+    """All items of one folder, following the pagination cursor."""
+    items = []
+    cursor = None
+    while True:
+        page, cursor = backend.list_folder(folder_path, cursor)
+        items.extend(page)
+        if not cursor:
+            return items
+
+
+def walk_remote(backend, root, workers=8):
+    """List every file under `root`. Sibling folders are listed concurrently."""
+    files = []
+    folders_seen = 0
+    errors = []
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(list_folder_all_pages, backend, root): root}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                folder = pending.pop(future)
+                folders_seen += 1
+                try:
+                    items = future.result()
+                except Exception as e:
+                    errors.append((folder, str(e)))
+                    print(f"   FAIL listing {folder}: {e}")
+                    continue
+                for item in items:
+                    if item['type'] == 'Folder':
+                        pending[pool.submit(list_folder_all_pages, backend, item['path'])] = item['path']
+                    else:
+                        files.append(item)
+            if folders_seen % 50 == 0:
+                print(f"   ... {folders_seen} folders listed, {len(files)} files")
+
+    return files, folders_seen, errors
+
+
+def build_local_manifest(state_paths, downloads_dirs):
+    """Index local knowledge by folder name and by image UUID."""
+    by_folder = {}      # folder_name -> {'exam_id': ..., 'details': {...}}
+    by_exam_short = {}  # exam_id[:8] -> folder entry
+    uuid_types = {}     # uuid -> type
+
+    types = load_json(TYPES_FILE, {}) or {}
+    uuid_types.update(types)
+
+    for state_path in state_paths:
+        state = load_json(state_path)
+        if not state:
+            print(f"   State not found (skipped): {state_path}")
+            continue
+        for exam_id, details in state.get('exam_details', {}).items():
+            entry = {'exam_id': exam_id, 'details': details}
+            folder_name = details.get('folder_name')
+            if folder_name:
+                by_folder[folder_name] = entry
+            by_exam_short.setdefault(exam_id[:8], entry)
+            for img in details.get('image_list', []) + details.get('image_details', []):
+                if img.get('uuid') and img.get('type'):
+                    uuid_types[img['uuid']] = img['type']
+
+    local_files = {}  # (folder_name, filename) -> absolute path
+    for downloads_dir in downloads_dirs:
+        downloads_dir = Path(downloads_dir)
+        if not downloads_dir.exists():
+            continue
+        for folder in downloads_dir.iterdir():
+            if not folder.is_dir():
+                continue
+            for f in folder.iterdir():
+                if f.is_file() and f.suffix.lower() in IMAGE_SUFFIXES:
+                    local_files[(folder.name, f.name)] = str(f.absolute())
+
+    return by_folder, by_exam_short, uuid_types, local_files
+
+
+def lookup_exam(folder_name, by_folder, by_exam_short):
+    entry = by_folder.get(folder_name)
+    if entry:
+        return entry
+    exam_part = folder_name.rsplit('_', 1)[-1]
+    return by_exam_short.get(exam_part[:8])
+
+
+def rebuild_mapping(remote_files, backend, manifest, previous_mapping):
+    """Join remote files against the local manifest; returns (mapping, stats)."""
+    by_folder, by_exam_short, uuid_types, local_files = manifest
+    mapping = {}
+    stats = {'files': 0, 'typed': 0, 'with_local': 0, 'with_exam': 0, 'folders': 0}
+
+    # Thumbnails/previews sit next to their original: UUID_thumb.jpg etc.
+    derivatives = {}  # (remote_folder, uuid) -> {'thumb.jpg': url, ...}
+    for item in remote_files:
+        remote_folder, filename = item['path'].rsplit('/', 1)
+        if is_derivative_filename(filename):
+            stem, ext = filename.rsplit('.', 1)
+            uuid, kind = stem.rsplit('_', 1)
+            derivatives.setdefault((remote_folder, uuid), {})[f"{kind}.{ext}"] = backend.file_url(item['path'])
+
+    for item in sorted(remote_files, key=lambda i: i['path']):
+        file_path = item['path']
+        filename = file_path.rsplit('/', 1)[-1]
+        if not filename.lower().endswith(IMAGE_SUFFIXES) or is_derivative_filename(filename):
+            continue
+        remote_folder = file_path.rsplit('/', 1)[0]
+        folder_name = remote_folder.rsplit('/', 1)[-1]
+        uuid = filename.rsplit('.', 1)[0]
+        stats['files'] += 1
+
+        if folder_name not in mapping:
+            stats['folders'] += 1
+            parts = folder_name.rsplit('_', 1)
+            clean_name = parts[0].replace('_', ' ') if len(parts) == 2 else folder_name.replace('_', ' ')
+            entry = lookup_exam(folder_name, by_folder, by_exam_short)
+            record = {
+                'images': [],
+                'bytescale_folder': remote_folder,
+                'patient_name': clean_name,
+                'exam_id': parts[-1] if len(parts) == 2 else 'unknown',
+            }
+            previous = previous_mapping.get(folder_name, {})
+            for field in METADATA_FIELDS:
+                if field in previous:
+                    record[field] = previous[field]
+            if entry:
+                stats['with_exam'] += 1
+                details = entry['details']
+                record['exam_id'] = entry['exam_id']
+                record['patient_name'] = details.get('patient_name') or clean_name
+                for field in METADATA_FIELDS:
+                    if details.get(field) is not None:
+                        record[field] = details[field]
+            mapping[folder_name] = record
+
+        img_type = uuid_types.get(uuid, 'UNKNOWN')
+        if img_type != 'UNKNOWN':
+            stats['typed'] += 1
+        local_path = local_files.get((folder_name, filename), '')
+        if local_path:
+            stats['with_local'] += 1
+
+        image = {
+            'uuid': uuid,
+            'filename': filename,
+            'type': img_type,
+            'local_path': local_path,
+            'bytescale_path': file_path,
+            'bytescale_url': backend.file_url(file_path),
+        }
+        derived = derivatives.get((remote_folder, uuid))
+        if derived:
+            image['thumbnail_url'] = derived.get('thumb.jpg', '')
+            image['preview_url'] = derived.get('preview.jpg', '')
+        mapping[folder_name]['images'].append(image)
+
+    return mapping, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild Bytescale mapping from remote listing (no uploads)')
+    parser.add_argument('--backend', default=None, help="'bytescale' (default) or 'local:<dir>'")
+    parser.add_argument('--root', default=DEFAULT_ROOT, help=f'Remote root folder (default: {DEFAULT_ROOT})')
+    parser.add_argument('--state', action='append', default=None,
+                        help='Download state JSON to join against (repeatable, default: download_state.json)')
+    parser.add_argument('--downloads', action='append', default=None,
+                        help='Local downloads folder for local_path (repeatable, default: downloads)')
+    parser.add_argument('--previous', action='append', default=[],
+                        help='Existing mapping JSON to carry patient metadata from (repeatable)')
+    parser.add_argument('--output', default=str(DEFAULT_OUTPUT), help='Output mapping file')
+    parser.add_argument('--write-progress', default=None,
+                        help='Also rewrite this upload progress file so uploaders skip remote files')
+    parser.add_argument('--workers', type=int, default=8, help='Parallel folder listings (default: 8)')
+    parser.add_argument('--dry-run', action='store_true', help='List and join, but do not write files')
+    parser.add_argument('--force', action='store_true',
+                        help='Write the mapping/progress even if some folder listings failed')
+    args = parser.parse_args()
+
+    backend = get_backend(args.backend)
+    state_paths = args.state or DEFAULT_STATES
+    downloads_dirs = args.downloads or ['downloads']
+
+    print("=" * 65)
+    print("  Bytescale Reconciliation (remote listing -> mapping)")
+    print(f"  Backend:  {type(backend).__name__}")
+    print(f"  Root:     {args.root}")
+    print(f"  States:   {', '.join(state_paths)}")
+    print(f"  Output:   {args.output}")
+    print("=" * 65)
+
+    if args.dry_run:
+        print("*** DRY-RUN MODE -- no files will be written ***\n")
+
+    started = datetime.now()
+    print("Listing remote folders...")
+    remote_files, folders_seen, errors = walk_remote(backend, args.root, args.workers)
+    elapsed = (datetime.now() - started).total_seconds()
+    print(f"Listed {folders_seen} folders, {len(remote_files)} files in {elapsed:.1f}s\n")
+
+    manifest = build_local_manifest(state_paths, downloads_dirs)
+    print(f"Local manifest: {len(manifest[0])} exam folders, {len(manifest[2])} typed UUIDs, "
+          f"{len(manifest[3])} local files")
+
+    previous_mapping = {}
+    for path in args.previous:
+        data = load_json(path, {}) or {}
+        if isinstance(data, dict):
+            previous_mapping.update({k: v for k, v in data.items() if isinstance(v, dict)})
+
+    mapping, stats = rebuild_mapping(remote_files, backend, manifest, previous_mapping)
+
+    if errors and not args.dry_run and not args.force:
+        # A partial listing would make the uploader re-upload whatever it missed
+        print(f"\nERROR: {len(errors)} folder listings failed -- {args.output} "
+              f"{'and ' + args.write_progress + ' ' if args.write_progress else ''}not written. "
+              f"Re-run, or pass --force to write the partial result.")
+    elif not args.dry_run:
+        save_json(mapping, args.output)
+        print(f"\nMapping saved: {args.output}")
+        if args.write_progress:
+            progress = {
+                'uploaded_files': sorted(
+                    img['local_path'] for rec in mapping.values() for img in rec['images'] if img['local_path']
+                ),
+                'patient_mapping': mapping,
+            }
+            save_json(progress, args.write_progress)
+            print(f"Progress saved: {args.write_progress}")
+
+    print("=" * 65)
+    print("  SUMMARY")
+    print("=" * 65)
+    print(f"  Remote folders:      {stats['folders']}")
+    print(f"  Remote images:       {stats['files']}")
+    print(f"  Joined to an exam:   {stats['with_exam']}/{stats['folders']} folders")
+    print(f"  With known type:     {stats['typed']}")
+    print(f"  With local file:     {stats['with_local']}")
+    print(f"  Listing errors:      {len(errors)}")
+    print("=" * 65)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Cross-source reconciliation: EyerCloud x disk x Bytescale x DB -> work queue.
+=============================================================================
+Replaces the one-off scripts written per incident (download_missing_48.py,
+download_6_missing.py, download_upload_missing_9.py, diagnose_missing_exams.py,
+../find_missing_downloads.js). Four inventories are loaded into dicts keyed by
+image UUID and joined in one pass:
+
+    eyercloud   what should exist: exam_details of the download states plus
+                the exam_images of the staging states (useful types only)
+    disk        downloads/ and downloads_staging/<account>/ (one scandir per folder)
+    bytescale   bytescale_mapping_v2.json and bytescale_mapping_staging_*.json
+    db          optional StagingExamImage export (--db, CSV or JSON)
+
+Every UUID lands in at most one queue:
+
+    download    expected, not on disk and not on Bytescale (uuid null: the exam
+                has no image list yet, fetch its /examData/list)
+    upload      expected and on disk, not on Bytescale
+    relink      on Bytescale, but the DB row is missing, has no URL, another
+                URL or another exam (only with --db)
+    orphaned    on disk, Bytescale or in the DB, but in no EyerCloud inventory
+
+The download/upload items are consumed by
+`ingest_pipeline.py --work-queue work_queue.json`; missing/empty DB rows by
+`node scripts/import_staging_images.js --execute`.
+
+DB export (staging database):
+    psql "$STAGING_DATABASE_URL" -c "\\copy (SELECT id, url, \\"eyerUuid\\", \\"examId\\"
+        FROM \\"StagingExamImage\\") TO 'db_images.csv' CSV HEADER"
+
+Usage:
+    cd scripts/eyercloud_downloader
+    python reconcile_sources.py
+    python reconcile_sources.py --db db_images.csv --output work_queue.json
+    python reconcile_sources.py --account mozaniareis@usp.br --show 20
+    python ingest_pipeline.py --email "mozaniareis@usp.br" --password "xxx" --resume --work-queue work_queue.json
+"""
+
+import os
+import csv
+import json
+import time
+import argparse
+from pathlib import Path
+from datetime import datetime
+
+from etl_common import Account, load_json, save_json, USEFUL_TYPES, PROJECT_ROOT
+from profiling import profile_main
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+DEFAULT_OUTPUT = Path("work_queue.json")
+MIN_IMAGE_BYTES = 1000
+QUEUES = ('download', 'upload', 'relink', 'orphaned')
+LEGACY = 'legacy'
+
+
+class Source:
+    """One account's files: state files (expected images), download roots and mappings."""
+
+    def __init__(self, name, email, states, roots, mappings, useful_types=USEFUL_TYPES):
+        self.name = name
+        self.email = email
+        self.states = [Path(p) for p in states]
+        self.roots = [Path(p) for p in roots]
+        self.mappings = [Path(p) for p in mappings]
+        self.useful_types = useful_types
+
+    @classmethod
+    def legacy(cls):
+        # downloader.py: every image type, folders named PATIENT_EXAMID
+        return cls(LEGACY, None, [SCRIPT_DIR / "download_state.json"],
+                   [PROJECT_ROOT / "downloads", SCRIPT_DIR / "downloads"],
+                   [PROJECT_ROOT / "bytescale_mapping_v2.json"], useful_types=None)
+
+    @classmethod
+    def staging(cls, acct):
+        return cls(acct.email, acct.email,
+                   [SCRIPT_DIR / acct.dl_state_file, SCRIPT_DIR / acct.staging_state_file],
+                   [SCRIPT_DIR / acct.download_dir, PROJECT_ROOT / acct.download_dir],
+                   [acct.mapping_file])
+
+
+def fleet_sources(account=None):
+    if account:
+        return [Source.legacy()] if account == LEGACY else [Source.staging(Account(account))]
+    return [Source.legacy()] + [Source.staging(acct) for acct in Account.discover()]
+
+
+# --- inventories (uuid -> record) ---
+
+def _useful(img, useful_types):
+    return isinstance(img, dict) and img.get('uuid') and (useful_types is None or img.get('type') in useful_types)
+
+
+def load_expected(sources):
+    """EyerCloud side: {uuid: {...}}, exams with no image list yet, {exam_id: account}."""
+    states = [(src, load_json(path, {}) or {}) for src in sources for path in src.states]
+    expected, exams = {}, {}
+    for src, state in states:
+        for exam_id, details in state.get('exam_details', {}).items():
+            exams[exam_id] = src.name
+            for img in details.get('image_details') or details.get('image_list') or []:
+                if _useful(img, src.useful_types):
+                    expected[img['uuid']] = {
+                        'account': src.name, 'exam_id': exam_id, 'type': img.get('type'),
+                        'folder_name': details.get('folder_name', ''),
+                    }
+
+    # Staging states: the socket listing carries every exam's examImages
+    for src, state in states:
+        for exam_id, images in state.get('exam_images', {}).items():
+            exams[exam_id] = src.name
+            for img in images:
+                if _useful(img, src.useful_types) and img['uuid'] not in expected:
+                    expected[img['uuid']] = {
+                        'account': src.name, 'exam_id': exam_id, 'type': img.get('type'), 'folder_name': '',
+                    }
+
+    with_images = exams.keys()
+    no_details = []
+    for src, state in states:
+        for exam_id, exam in state.get('exams', {}).items():
+            if exam_id not in with_images and exam.get('imageCount', 1):
+                no_details.append({'account': src.name, 'exam_id': exam_id,
+                                   'patient_name': exam.get('patientName', '')})
+            exams.setdefault(exam_id, src.name)
+    return expected, no_details, exams
+
+
+def load_disk(sources):
+    disk = {}
+    for src in sources:
+        for root in src.roots:
+            if not root.is_dir():
+                continue
+            for folder in os.scandir(root):
+                if not folder.is_dir():
+                    continue
+                for entry in os.scandir(folder.path):
+                    name = entry.name
+                    if name.endswith('.jpg') and entry.is_file():
+                        size = entry.stat().st_size
+                        if size > MIN_IMAGE_BYTES:
+                            disk[name[:-4]] = {'account': src.name, 'path': entry.path,
+                                               'folder_name': folder.name, 'size': size}
+    return disk
+
+
+def load_mappings(sources):
+    mapped = {}
+    for src in sources:
+        for mapping_file in src.mappings:
+            mapping = load_json(mapping_file, {}) or {}
+            if not isinstance(mapping, dict):
+                continue
+            for folder_name, record in mapping.items():
+                if not isinstance(record, dict):
+                    continue
+                for img in record.get('images', []):
+                    uuid = img.get('uuid') or Path(img.get('filename', '')).stem
+                    if not uuid:
+                        continue
+                    mapped[uuid] = {
+                        'account': src.name, 'folder_name': folder_name,
+                        'exam_id': record.get('exam_id', ''),
+                        'urls': {u for u in (img.get('cdn_url'), img.get('bytescale_url')) if u},
+                        'url': img.get('cdn_url') or img.get('bytescale_url') or '',
+                        'mapping': str(mapping_file),
+                    }
+    return mapped
+
+
+def load_db(path):
+    """StagingExamImage rows from a CSV (psql \\copy ... CSV HEADER) or JSON export."""
+    path = Path(path)
+    if path.suffix.lower() == '.csv':
+        with open(path, newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+    else:
+        rows = load_json(path, [])
+    db = {}
+    for row in rows:
+        uuid = row.get('eyerUuid') or row.get('id', '').removeprefix('img-').removesuffix('.jpg')
+        if uuid:
+            db[uuid] = {'id': row.get('id', ''), 'url': row.get('url') or '', 'exam_id': row.get('examId', '')}
+    return db
+
+
+# --- join ---
+
+def reconcile(expected, no_details, disk, mapped, db=None, covered=None):
+    """One pass over the union of UUIDs -> {queue: [items]}.
+
+    covered: accounts that have an EyerCloud inventory; files of other accounts
+    cannot be called orphaned and are only counted as 'unverified'.
+    """
+    queues = {name: [] for name in QUEUES}
+    queues['unverified'] = 0
+    for item in no_details:
+        queues['download'].append(dict(item, uuid=None, reason='no_image_list'))
+
+    for uuid in expected.keys() | disk.keys() | mapped.keys() | (db or {}).keys():
+        exp = expected.get(uuid)
+        local = disk.get(uuid)
+        remote = mapped.get(uuid)
+        row = db.get(uuid) if db is not None else None
+
+        if exp is None:
+            where = [name for name, rec in (('disk', local), ('bytescale', remote), ('db', row)) if rec]
+            owner = local or remote or {}
+            if covered is not None and owner and owner['account'] not in covered:
+                queues['unverified'] += 1
+                continue
+            queues['orphaned'].append({
+                'uuid': uuid, 'where': where, 'account': owner.get('account'),
+                'exam_id': (remote or {}).get('exam_id') or (row or {}).get('exam_id', ''),
+                'path': (local or {}).get('path'), 'url': (remote or {}).get('url') or (row or {}).get('url'),
+            })
+            continue
+
+        base = {'uuid': uuid, 'account': exp['account'], 'exam_id': exp['exam_id'], 'type': exp['type']}
+        if remote is None:
+            if local is None:
+                queues['download'].append(dict(base, folder_name=exp['folder_name'], reason='missing'))
+            else:
+                queues['upload'].append(dict(base, path=local['path'], folder_name=local['folder_name']))
+            continue
+
+        # Only staging accounts are imported into the staging DB
+        if db is None or exp['account'] == LEGACY:
+            continue
+        if row is None:
+            reason = 'missing_row'
+        elif not row['url']:
+            reason = 'empty_url'
+        elif row['url'] not in remote['urls']:
+            reason = 'url_mismatch'
+        elif row['exam_id'] and row['exam_id'] != exp['exam_id']:
+            reason = 'exam_mismatch'
+        else:
+            continue
+        queues['relink'].append(dict(base, reason=reason, url=remote['url'],
+                                     db_id=(row or {}).get('id'), db_url=(row or {}).get('url'),
+                                     db_exam_id=(row or {}).get('exam_id')))
+    return queues
+
+
+def queue_for(work_queue, account):
+    """(exam_ids, uuids) of the download/upload items of one account."""
+    exam_ids, uuids = set(), set()
+    for name in ('download', 'upload'):
+        for item in work_queue.get('queues', {}).get(name, []):
+            if item.get('account') == account:
+                exam_ids.add(item['exam_id'])
+                if item.get('uuid'):
+                    uuids.add(item['uuid'])
+    return exam_ids, uuids
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Join EyerCloud, disk, Bytescale and DB inventories into a work queue')
+    parser.add_argument('--account', default=None, help=f"Only this account (email, or '{LEGACY}')")
+    parser.add_argument('--db', default=None, help='StagingExamImage export (CSV with header, or JSON list)')
+    parser.add_argument('--output', default=str(DEFAULT_OUTPUT), help=f'Work queue file (default: {DEFAULT_OUTPUT})')
+    parser.add_argument('--show', type=int, default=0, help='Print the first N items of each queue')
+    parser.add_argument('--dry-run', action='store_true', help='Only print the summary')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    sources = fleet_sources(args.account)
+    expected, no_details, exams = load_expected(sources)
+    covered = {src.name for src in sources if any(path.exists() for path in src.states)}
+    disk = load_disk(sources)
+    mapped = load_mappings(sources)
+    db = load_db(args.db) if args.db else None
+    if db is not None and args.account:
+        keep = expected.keys() | disk.keys() | mapped.keys()
+        db = {uuid: row for uuid, row in db.items() if uuid in keep or exams.get(row['exam_id'])}
+    loaded = time.perf_counter()
+
+    queues = reconcile(expected, no_details, disk, mapped, db, covered)
+    unverified = queues.pop('unverified')
+    elapsed = time.perf_counter() - started
+
+    print("=" * 60)
+    print("  Reconciliation")
+    print("=" * 60)
+    print(f"  Sources:    {', '.join(src.name for src in sources)}")
+    print(f"  EyerCloud:  {len(expected)} images in {len(exams)} exams ({len(no_details)} exams without image list)")
+    print(f"  Disk:       {len(disk)} images")
+    print(f"  Bytescale:  {len(mapped)} images")
+    print(f"  DB:         {'-' if db is None else f'{len(db)} rows'}")
+    print("-" * 60)
+    for name in QUEUES:
+        items = queues[name]
+        by_account = {}
+        for item in items:
+            by_account[item.get('account')] = by_account.get(item.get('account'), 0) + 1
+        detail = ', '.join(f"{acct}: {n}" for acct, n in sorted(by_account.items(), key=lambda kv: str(kv[0])))
+        print(f"  {name:<10} {len(items):>7}   {detail}")
+        for item in items[:args.show]:
+            print(f"      {json.dumps(item, ensure_ascii=False)}")
+    if unverified:
+        missing = ', '.join(src.name for src in sources if src.name not in covered)
+        print(f"  {unverified} images of sources without state files ({missing}) not classified")
+    print("-" * 60)
+    print(f"  Loaded in {loaded - started:.2f}s, joined in {elapsed - (loaded - started):.2f}s")
+
+    if args.dry_run:
+        return
+    save_json({
+        'generated_at': datetime.now().isoformat(),
+        'sources': [src.name for src in sources],
+        'counts': dict({name: len(queues[name]) for name in QUEUES}, unverified=unverified),
+        'queues': queues,
+    }, args.output)
+    print(f"  Work queue: {args.output}")
+
+
+if __name__ == '__main__':
+    profile_main(main, 'reconcile_sources')
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Ingestion telemetry: per-stage / per-host counters and latency histograms.
+=========================================================================
+The ingestion scripts only printed cumulative counters, so a run could not
+tell requests/s, MB/s, API latency percentiles or where the time went. A
+Metrics object records every timed operation as
+
+    (stage, host, seconds, bytes, ok)
+
+and keeps, per (stage, host), a request/error/byte counter and a fixed-bucket
+latency histogram. Stages used by the scripts:
+
+    login      browser or API login
+    listing    exam list (Sails socket / exam/filter)
+    details    /examData/list
+    cdn        image GET from CloudFront
+    disk       image write / read-back checks
+    verify, upload, derive, map   (ingest_pipeline stages)
+
+Outputs, under metrics/:
+    <script>_<timestamp>.jsonl   timeline, one line per operation (+ phase marks)
+    <script>.prom                Prometheus textfile (node_exporter textfile collector)
+    <script>_<timestamp>.json    end-of-run summary, for comparing runs
+and a summary table printed at the end of the run. Phases are also handed to
+a running --profile (profiling.py), which tags its samples with them.
+
+Usage:
+    from telemetry import Metrics
+    metrics = Metrics('download_staging_images')
+    metrics.mark('login')                       # phases: login, listing, downloads, ...
+    with metrics.timer('details', host='eyercloud.com'):
+        ...
+    metrics.observe('cdn', elapsed, host=host, nbytes=size, ok=ok)
+    metrics.close()       # writes .prom + summary, prints the table
+
+    python telemetry.py compare metrics/a.json metrics/b.json
+"""
+
+import json
+import time
+import bisect
+import argparse
+import threading
+from pathlib import Path
+from datetime import datetime
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import profiling
+
+METRICS_DIR = Path("metrics")
+# Seconds; upper bounds of the latency histogram buckets (+Inf is implicit)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROM_PREFIX = "neuroapp_ingest"
+
+
+def host_of(url):
+    return urlparse(url).netloc or 'local'
+
+
+class Series:
+    """Counters and latency histogram for one (stage, host)."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.samples = []  # raw latencies, for exact percentiles in the summary
+
+    def add(self, seconds, nbytes, ok):
+        self.requests += 1
+        self.errors += 0 if ok else 1
+        self.bytes += nbytes
+        self.seconds += seconds
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.samples.append(seconds)
+
+    def percentile(self, pct):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class Metrics:
+    def __init__(self, script, out_dir=METRICS_DIR, enabled=True):
+        self.script = script
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self.started_at = datetime.now()
+        self.series = {}
+        self.phases = []  # (name, seconds)
+        self._mark = None
+        self._lock = threading.Lock()
+        self._timeline = None
+        self.out_dir = Path(out_dir)
+        stamp = self.started_at.strftime('%Y%m%d_%H%M%S')
+        self.timeline_file = self.out_dir / f"{script}_{stamp}.jsonl"
+        self.summary_file = self.out_dir / f"{script}_{stamp}.json"
+        self.prom_file = self.out_dir / f"{script}.prom"
+        if enabled:
+            self.out_dir.mkdir(parents=True, exist_ok=True)
+            self._timeline = open(self.timeline_file, 'a', encoding='utf-8', buffering=1 << 16)
+
+    def _event(self, record):
+        record['t'] = round(time.perf_counter() - self.started, 4)
+        self._timeline.write(json.dumps(record) + '\n')
+
+    def observe(self, stage, seconds, host='local', nbytes=0, ok=True):
+        if not self.enabled:
+            return
+        with self._lock:
+            key = (stage, host)
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = Series()
+            series.add(seconds, nbytes, ok)
+            self._event({'stage': stage, 'host': host, 's': round(seconds, 4), 'bytes': nbytes, 'ok': ok})
+
+    @contextmanager
+    def timer(self, stage, host='local'):
+        """Time the block as one operation. Set `op['bytes']` / `op['ok']` inside it."""
+        op = {'bytes': 0, 'ok': True}
+        started = time.perf_counter()
+        try:
+            yield op
+        except BaseException:
+            op['ok'] = False
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - started, host, op['bytes'], op['ok'])
+
+    def _phase_event(self, name, event, seconds=None):
+        if not self.enabled:
+            return
+        record = {'phase': name, 'event': event}
+        if seconds is not None:
+            record['s'] = round(seconds, 4)
+        with self._lock:
+            self._event(record)
+
+    @contextmanager
+    def phase(self, name):
+        """Coarse wall-clock section of the run (login, listing, downloads, ...)."""
+        started = time.perf_counter()
+        self._phase_event(name, 'start')
+        try:
+            with profiling.section(name):
+                yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.phases.append((name, elapsed))
+            self._phase_event(name, 'end', elapsed)
+
+    def mark(self, name=None):
+        """End the current marked phase and start `name` (for long linear scripts)."""
+        profiling.mark(name)
+        if self._mark is not None:
+            current, started = self._mark
+            elapsed = time.perf_counter() - started
+            self.phases.append((current, elapsed))
+            self._phase_event(current, 'end', elapsed)
+            self._mark = None
+        if name is not None:
+            self._mark = (name, time.perf_counter())
+            self._phase_event(name, 'start')
+
+    # --- outputs ---
+
+    def summary(self):
+        wall = time.perf_counter() - self.started
+        stages = []
+        for (stage, host), s in sorted(self.series.items()):
+            stages.append({
+                'stage': stage,
+                'host': host,
+                'requests': s.requests,
+                'errors': s.errors,
+                'bytes': s.bytes,
+                'busy_seconds': round(s.seconds, 3),
+                'requests_per_s': round(s.requests / wall, 3) if wall else 0.0,
+                'mb_per_s': round(s.bytes / (1024 * 1024) / wall, 3) if wall else 0.0,
+                'p50': round(s.percentile(50), 4),
+                'p95': round(s.percentile(95), 4),
+                'p99': round(s.percentile(99), 4),
+            })
+        return {
+            'script': self.script,
+            'started_at': self.started_at.isoformat(),
+            'wall_seconds': round(wall, 3),
+            'phases': [{'name': n, 'seconds': round(s, 3)} for n, s in self.phases],
+            'stages': stages,
+        }
+
+    def prometheus_text(self):
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {PROM_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PROM_PREFIX}_{name} {kind}")
+
+        def labels(stage, host, **extra):
+            pairs = {'script': self.script, 'stage': stage, 'host': host, **extra}
+            return '{' + ','.join(f'{k}="{v}"' for k, v in pairs.items()) + '}'
+
+        items = sorted(self.series.items())
+        family('requests_total', 'counter', 'Operations per stage and host.')
+        for (stage, host), s in items:
+            lines.append(f"{PROM_PREFIX}_requests_total{labels(stage, host, status='ok')} {s.requests - s.errors}")
+            lines.append(f"{PROM_PREFIX}_requests_total{labels(stage, host, status='error')} {s.errors}")
+        family('bytes_total', 'counter', 'Payload bytes per stage and host.')
+        for (stage, host), s in items:
+            lines.append(f"{PROM_PREFIX}_bytes_total{labels(stage, host)} {s.bytes}")
+        family('latency_seconds', 'histogram', 'Operation latency per stage and host.')
+        for (stage, host), s in items:
+            cumulative = 0
+            for bound, count in zip(BUCKETS, s.buckets):
+                cumulative += count
+                lines.append(f"{PROM_PREFIX}_latency_seconds_bucket{labels(stage, host, le=bound)} {cumulative}")
+            lines.append(f"{PROM_PREFIX}_latency_seconds_bucket{labels(stage, host, le='+Inf')} {s.requests}")
+            lines.append(f"{PROM_PREFIX}_latency_seconds_sum{labels(stage, host)} {s.seconds:.6f}")
+            lines.append(f"{PROM_PREFIX}_latency_seconds_count{labels(stage, host)} {s.requests}")
+        family('phase_seconds', 'gauge', 'Wall time of each run phase.')
+        for name, seconds in self.phases:
+            lines.append(f'{PROM_PREFIX}_phase_seconds{{script="{self.script}",phase="{name}"}} {seconds:.3f}')
+        family('last_run_timestamp_seconds', 'gauge', 'End of the last run (unix time).')
+        lines.append(f'{PROM_PREFIX}_last_run_timestamp_seconds{{script="{self.script}"}} {time.time():.0f}')
+        return '\n'.join(lines) + '\n'
+
+    def print_summary(self, summary=None):
+        summary = summary or self.summary()
+        print(f"\n{'=' * 78}")
+        print(f"  TELEMETRY -- {self.script} ({summary['wall_seconds']:.1f}s)")
+        print(f"{'=' * 78}")
+        for phase in summary['phases']:
+            print(f"  phase {phase['name']:<12} {phase['seconds']:9.1f}s")
+        if summary['stages']:
+            print(f"  {'stage':<9} {'host':<28} {'reqs':>7} {'err':>5} {'req/s':>7} {'MB/s':>7} "
+                  f"{'p50':>7} {'p95':>7} {'p99':>7}")
+        for s in summary['stages']:
+            print(f"  {s['stage']:<9} {s['host'][:28]:<28} {s['requests']:>7} {s['errors']:>5} "
+                  f"{s['requests_per_s']:>7.2f} {s['mb_per_s']:>7.2f} "
+                  f"{s['p50']:>7.3f} {s['p95']:>7.3f} {s['p99']:>7.3f}")
+        if self.enabled:
+            print(f"  Timeline: {self.timeline_file}")
+            print(f"  Textfile: {self.prom_file}")
+        print(f"{'=' * 78}")
+
+    def close(self, quiet=False):
+        """Write the Prometheus textfile and the summary JSON; print the table."""
+        self.mark(None)
+        summary = self.summary()
+        if self.enabled:
+            with self._lock:
+                self._timeline.close()
+            tmp = self.prom_file.with_suffix('.prom.tmp')
+            tmp.write_text(self.prometheus_text(), encoding='utf-8')
+            tmp.replace(self.prom_file)  # atomic for the textfile collector
+            self.summary_file.write_text(json.dumps(summary, indent=2), encoding='utf-8')
+        if self.enabled and not quiet:
+            self.print_summary(summary)
+        return summary
+
+
+def compare(old_file, new_file):
+    """Print per-stage deltas between two summary JSON files."""
+    old = json.loads(Path(old_file).read_text(encoding='utf-8'))
+    new = json.loads(Path(new_file).read_text(encoding='utf-8'))
+    old_by_key = {(s['stage'], s['host']): s for s in old['stages']}
+
+    def delta(a, b):
+        return f"{(b - a) / a * 100:+6.1f}%" if a else "    n/a"
+
+    print(f"  wall {old['wall_seconds']:.1f}s -> {new['wall_seconds']:.1f}s "
+          f"({delta(old['wall_seconds'], new['wall_seconds'])})")
+    print(f"  {'stage':<9} {'host':<28} {'req/s':>16} {'p95':>16}")
+    for s in new['stages']:
+        o = old_by_key.get((s['stage'], s['host']))
+        if o is None:
+            print(f"  {s['stage']:<9} {s['host'][:28]:<28} (new)")
+            continue
+        print(f"  {s['stage']:<9} {s['host'][:28]:<28} "
+              f"{s['requests_per_s']:>8.2f} {delta(o['requests_per_s'], s['requests_per_s'])} "
+              f"{s['p95']:>8.3f} {delta(o['p95'], s['p95'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingestion telemetry tools')
+    sub = parser.add_subparsers(dest='command', required=True)
+    cmp_parser = sub.add_parser('compare', help='Compare two run summaries')
+    cmp_parser.add_argument('old')
+    cmp_parser.add_argument('new')
+    show_parser = sub.add_parser('show', help='Print a run summary')
+    show_parser.add_argument('summary')
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        compare(args.old, args.new)
+    else:
+        summary = json.loads(Path(args.summary).read_text(encoding='utf-8'))
+        Metrics(summary['script'], enabled=False).print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
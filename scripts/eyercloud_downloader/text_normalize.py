@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Shared name/text normalizer.
+============================
+One implementation for the normalize_name / normalize / normalize_str copies
+that used to live in fetch_staging_data, fetch_anamnesis, fetch_birth_dates,
+fetch_patient_details, metadata_snapshot, etl_common, scripts/analyze_mapping.py,
+retina_apoe/01_match_patients.py and retina_apoe/cruzar_mozania.py. Those
+mixed NFD and NFKD and disagreed on punctuation; all of them walked the
+string char by char through unicodedata.
+
+    normalize_name('  José  da Conceição ')   -> 'JOSE DA CONCEICAO'
+    normalize_key('Maria T. A. Trujello')      -> 'MARIA T A TRUJELLO'
+
+normalize_name: accents and compatibility forms folded (NFKD semantics:
+'ﬁ' -> 'FI', NBSP -> space), upper case, whitespace collapsed; punctuation
+and digits kept. normalize_key: the same, then anything but A-Z, 0-9 and
+space becomes a space (what cruzar_mozania.normalize_str did).
+
+Folding goes through precomputed translate tables instead: pure-ASCII names
+skip it, Latin-1 names (nearly all Brazilian ones) take one bytes.translate
+over a 256-byte table, other Latin/fullwidth text a str.translate table, and
+anything outside the tables falls back to unicodedata -- so the result is
+the same as the NFKD reference for every input. Results are memoized (names
+repeat a lot in the matching and backfill loops).
+
+Self-check (conformance table, reference comparison and timing):
+    cd scripts/eyercloud_downloader
+    python text_normalize.py
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+
+CACHE_SIZE = 1 << 16
+
+# Latin-1, Latin Extended-A/B, combining marks, spaces/punctuation, ligatures, fullwidth forms
+_FOLD_RANGES = ((0x80, 0x250), (0x300, 0x370), (0x2000, 0x2070), (0xFB00, 0xFB07), (0xFF01, 0xFF5F))
+
+
+def _reference_fold(text):
+    """The slow path: NFKD, drop combining marks."""
+    return ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+
+
+def _build_fold_table():
+    table = {}
+    for lo, hi in _FOLD_RANGES:
+        for cp in range(lo, hi):
+            folded = _reference_fold(chr(cp))
+            if folded != chr(cp):
+                table[cp] = folded or None
+    return table
+
+
+def _build_latin1_table(fold):
+    """Byte table for Latin-1 text: chars that fold to one ASCII char map to it, the rest to themselves."""
+    table = bytearray(range(256))
+    for cp in range(128, 256):
+        folded = fold.get(cp, chr(cp))
+        if folded and len(folded) == 1 and folded.isascii():
+            table[cp] = ord(folded)
+    return bytes(table)
+
+
+_FOLD = _build_fold_table()
+_FOLDABLE = frozenset(_FOLD)
+_LATIN1 = _build_latin1_table(_FOLD)
+_KEY = bytes(c if chr(c).isalnum() or c > 127 else ord(' ') for c in range(256))
+_NON_KEY = re.compile(r'[^A-Z0-9 ]')
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def normalize_name(name):
+    """Upper case, no accents, single spaces ('' for empty/None)."""
+    if not name:
+        return ''
+    if not name.isascii():
+        try:
+            folded = name.encode('latin-1').translate(_LATIN1)
+        except UnicodeEncodeError:
+            folded = None
+        if folded is not None and folded.isascii():
+            name = folded.decode('ascii')
+        else:
+            name = name.translate(_FOLD)
+            if not name.isascii() and any(ord(c) not in _FOLDABLE for c in name if ord(c) > 127):
+                name = _reference_fold(name)
+    return ' '.join(name.upper().split())
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def normalize_key(text):
+    """normalize_name with every character other than A-Z, 0-9 and space turned into a space."""
+    text = normalize_name(text)
+    if text.isascii():
+        text = text.encode('ascii').translate(_KEY).decode('ascii')
+    else:
+        text = _NON_KEY.sub(' ', text)
+    return ' '.join(text.split())
+
+
+# --- self-check ---
+
+CASES = [
+    # input, normalize_name, normalize_key
+    (None, '', ''),
+    ('', '', ''),
+    ('   ', '', ''),
+    ('maria', 'MARIA', 'MARIA'),
+    ('  José  da   Conceição ', 'JOSE DA CONCEICAO', 'JOSE DA CONCEICAO'),
+    ('JOÃO\tBATISTA\nSANTOS', 'JOAO BATISTA SANTOS', 'JOAO BATISTA SANTOS'),
+    ('Antônia Lúcia Gonçalves', 'ANTONIA LUCIA GONCALVES', 'ANTONIA LUCIA GONCALVES'),
+    ('ÂÃÀÁÄ ÊÉÈË ÎÍÌÏ ÔÕÒÓÖ ÛÚÙÜ Ç Ñ', 'AAAAA EEEE IIII OOOOO UUUU C N', 'AAAAA EEEE IIII OOOOO UUUU C N'),
+    ('E\u0301LIDA', 'ELIDA', 'ELIDA'),                # already decomposed (NFD input)
+    ('Maria\u00a0Aparecida', 'MARIA APARECIDA', 'MARIA APARECIDA'),   # NBSP
+    ('Gra\u00e7as\u2003Silva', 'GRACAS SILVA', 'GRACAS SILVA'),     # em space
+    ('ﬁlomena', 'FILOMENA', 'FILOMENA'),                     # ligature (NFKD only)
+    ('Ｍａｒｉａ', 'MARIA', 'MARIA'),                          # fullwidth
+    ('Maria T. A. Trujello', 'MARIA T. A. TRUJELLO', 'MARIA T A TRUJELLO'),
+    ("D'ÁVILA-SOUZA", "D'AVILA-SOUZA", 'D AVILA SOUZA'),
+    ('ABADIA DAS GRAÇAS ANDUJA 003.16.58', 'ABADIA DAS GRACAS ANDUJA 003.16.58', 'ABADIA DAS GRACAS ANDUJA 003 16 58'),
+    ('Susy Carla F.G. Santos', 'SUSY CARLA F.G. SANTOS', 'SUSY CARLA F G SANTOS'),
+    ('Mãe da Fabi', 'MAE DA FABI', 'MAE DA FABI'),
+    ('Straße', 'STRASSE', 'STRASSE'),
+    ('Øystein Æsir', 'ØYSTEIN ÆSIR', 'YSTEIN SIR'),          # no decomposition: kept / dropped
+    ('Łukasz Đorđe', 'ŁUKASZ ĐORĐE', 'UKASZ OR E'),
+    ('Ελένη', 'ΕΛΕΝΗ', ''),                                  # outside the tables: reference path
+    ('nº 12 ª', 'NO 12 A', 'NO 12 A'),
+]
+
+
+def _legacy_nfd(name):
+    """What fetch_staging_data / fetch_* / etl_common did."""
+    if not name:
+        return ''
+    name = name.upper().strip()
+    name = unicodedata.normalize('NFD', name)
+    name = ''.join(c for c in name if unicodedata.category(c) != 'Mn')
+    return ' '.join(name.split())
+
+
+def _legacy_nfkd(name):
+    """What retina_apoe/01_match_patients did."""
+    if not name:
+        return ''
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    name = name.upper().strip()
+    return re.sub(r'\s+', ' ', name)
+
+
+def self_check():
+    import random
+    import time
+
+    failures = 0
+    for raw, want_name, want_key in CASES:
+        got_name, got_key = normalize_name(raw), normalize_key(raw)
+        if (got_name, got_key) != (want_name, want_key):
+            failures += 1
+            print(f"FAIL {raw!r}: {got_name!r} / {got_key!r}, want {want_name!r} / {want_key!r}")
+    print(f"Conformance table: {len(CASES) - failures}/{len(CASES)} ok")
+
+    # Every code point the tables cover, and random names built from them, must
+    # match the NFKD reference exactly
+    rng = random.Random(0)
+    alphabet = [chr(cp) for lo, hi in _FOLD_RANGES for cp in range(lo, hi)] + list('abcxyz ABC XYZ .-')
+    samples = [chr(cp) for lo, hi in _FOLD_RANGES for cp in range(lo, hi)]
+    samples += [''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 30))) for _ in range(20000)]
+    mismatches = [s for s in samples if normalize_name(s) != _legacy_nfkd(s)]
+    for s in mismatches[:5]:
+        print(f"FAIL reference {s!r}: {normalize_name(s)!r} != {_legacy_nfkd(s)!r}")
+    print(f"NFKD reference:    {len(samples) - len(mismatches)}/{len(samples)} identical")
+    failures += len(mismatches)
+
+    # Names as they come from EyerCloud: the old NFD copies agree on all of them
+    first = ['MARIA', 'José', 'ANTÔNIA', 'João', 'Conceição', 'Lúcia', 'FRANCISCO', 'Ângela', 'Inês']
+    last = ['da Silva', 'GONÇALVES', 'Araújo', 'de Souza', 'Magalhães', 'FALCÃO', 'Brandão', "D'Ávila"]
+    names = [f"  {rng.choice(first)} {rng.choice(first)}  {rng.choice(last)} " for _ in range(50000)]
+    drift = [n for n in set(names) if normalize_name(n) != _legacy_nfd(n)]
+    print(f"Legacy NFD copies: {len(set(names)) - len(drift)}/{len(set(names))} identical")
+    failures += len(drift)
+
+    for label, fn in (('legacy NFD', _legacy_nfd), ('shared, uncached', normalize_name.__wrapped__),
+                      ('shared, cached', normalize_name)):
+        started = time.perf_counter()
+        for n in names:
+            fn(n)
+        print(f"  {label:<17} {len(names) / (time.perf_counter() - started) / 1e6:6.2f} M names/s")
+    return failures
+
+
+if __name__ == "__main__":
+    raise SystemExit(1 if self_check() else 0)
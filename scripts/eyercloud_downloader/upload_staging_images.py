@@ -20,6 +20,18 @@ Usage:
     python upload_staging_images.py --email "dramelinalannes.endocrino@gmail.com" --dry-run
     python upload_staging_images.py --email "dramelinalannes.endocrino@gmail.com"
     python upload_staging_images.py --email "mozaniareis@usp.br"
+    python upload_staging_images.py --email "mozaniareis@usp.br" --skip-duplicates   # after image_dedup.py
+    python upload_staging_images.py --email "mozaniareis@usp.br" --changes-only      # exam feed diff only
+
+With --skip-duplicates the redundant copies image_dedup.py found are not
+uploaded; each is written to the mapping with the kept copy's Bytescale path
+and URLs (plus "duplicate_of"). A copy whose kept copy is not uploaded yet is
+mapped on a later run.
+
+--changes-only uploads only the folders of exams added/modified in the exam
+feed since the last upload run (consumer "upload"). A run without errors acks
+the feed up to where download_staging_images.py has acked it: later changes
+may not be on disk yet.
 """
 
 import os
@@ -32,6 +44,12 @@ from datetime import datetime
 import mimetypes
 import argparse
 
+from etl_common import sanitize_email, load_json
+from exam_feed import ExamFeed
+from image_cache import ImageCache
+from image_dedup import duplicate_aliases
+from profiling import profile_main
+
 # --- BYTESCALE CONFIG ---
 API_KEY = "secret_W142icY3yUHGu9PToLGZuBAkGH58"
 ACCOUNT_ID = "W142icY"
@@ -39,10 +57,6 @@ UPLOAD_BASE_URL = f"https://api.bytescale.com/v2/accounts/{ACCOUNT_ID}/uploads/b
 CDN_BASE_URL = f"https://upcdn.io/{ACCOUNT_ID}/raw"
 
 
-def sanitize_email(email):
-    return re.sub(r'[^a-zA-Z0-9]', '_', email.split('@')[0])
-
-
 def sanitize_folder_name(name):
     """Remove special characters for use in Bytescale paths."""
     safe = re.sub(r'[<>:"/\\|?*]', '_', name)
@@ -81,13 +95,6 @@ def upload_file(filepath, folder_path, filename):
         return None
 
 
-def load_json(path):
-    if path.exists():
-        with open(path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return None
-
-
 def save_json(data, path):
     with open(path, 'w', encoding='utf-8') as f:
         json.dump(data, f, indent=4, ensure_ascii=False)
@@ -97,6 +104,10 @@ def main():
     parser = argparse.ArgumentParser(description='Upload staging images to Bytescale')
     parser.add_argument('--email', required=True, help='EyerCloud login email (used to find files)')
     parser.add_argument('--dry-run', action='store_true', help='Simulate without uploading')
+    parser.add_argument('--skip-duplicates', nargs='?', const='duplicate_images.json', default=None,
+                        help='Skip the redundant copies listed by image_dedup.py (default file: duplicate_images.json)')
+    parser.add_argument('--changes-only', action='store_true',
+                        help='Only upload exams added/modified in the exam feed since the last upload run')
     args = parser.parse_args()
 
     email_safe = sanitize_email(args.email)
@@ -166,6 +177,29 @@ def main():
     patient_folders = sorted([f for f in download_dir.iterdir() if f.is_dir()])
     print(f"Found {len(patient_folders)} patient folders\n")
 
+    # Exams up to the download cursor are on disk; that is as far as this run can ack
+    feed = ExamFeed(args.email)
+    feed_seq = feed.cursor('download')
+    if args.changes_only and not feed.is_new('upload'):
+        changed = feed.pending('upload')
+        wanted = set(changed['added']) | set(changed['modified'])
+        wanted_folders = {details.get('folder_name') for eid, details in exam_details.items() if eid in wanted}
+        patient_folders = [f for f in patient_folders if f.name in wanted_folders]
+        print(f"Changes only (feed seq {changed['seq']}): {len(patient_folders)} folders of added/modified exams\n")
+
+    # Redundant copies flagged by image_dedup.py (paths relative to this folder):
+    # skipped copy -> the copy kept in its place
+    duplicate_of = {}
+    if args.skip_duplicates:
+        duplicates = load_json(args.skip_duplicates)
+        if duplicates is None:
+            print(f"ERROR: {args.skip_duplicates} not found -- run image_dedup.py first")
+            return
+        duplicate_of = {str(Path(skip).resolve()): str(Path(keep).resolve())
+                        for skip, keep in duplicate_aliases(duplicates).items()}
+        print(f"Skipping {len(duplicate_of)} duplicate images listed in {args.skip_duplicates}")
+    pending_aliases = []  # (patient_data, uuid, filename, type, kept path)
+
     # Build UUID -> type lookup from download state
     uuid_type_map = {}
     for exam_id, details in exam_details.items():
@@ -244,6 +278,14 @@ def main():
                 sys.stdout.flush()
                 continue
 
+            keep_path = duplicate_of.get(str(image.resolve()))
+            if keep_path:
+                total_skipped += 1
+                print(f"   SKIP duplicate: {image.name}")
+                sys.stdout.flush()
+                pending_aliases.append((patient_data, uuid, image.name, img_type, keep_path))
+                continue
+
             # Already uploaded?
             if image_path in uploaded_set:
                 total_skipped += 1
@@ -285,10 +327,45 @@ def main():
                 print(f"   [Mapping saved at patient {patient_count}]")
                 sys.stdout.flush()
 
+    # Skipped copies point at the kept copy's upload, so reconcile_sources,
+    # load_staging_db and ingest_pipeline see their exams as complete
+    total_aliased = 0
+    total_waiting = 0
+    if pending_aliases:
+        uploaded = ImageCache.default().images  # every account's mapping + the legacy one
+        for data in progress['patient_mapping'].values():
+            for img in data['images']:
+                local = download_dir / data['folder_name'] / img['filename']
+                uploaded[str(local.resolve())] = img
+        for patient_data, uuid, filename, img_type, keep_path in pending_aliases:
+            if any(img['uuid'] == uuid for img in patient_data['images']):
+                continue
+            kept = uploaded.get(keep_path)
+            if kept is None:
+                # Kept copy not uploaded yet -- mapped on a later run
+                total_waiting += 1
+                continue
+            patient_data['images'].append({
+                'uuid': uuid,
+                'filename': filename,
+                'type': img_type,
+                'bytescale_path': kept.get('bytescale_path', ''),
+                'bytescale_url': kept.get('bytescale_url', ''),
+                'cdn_url': kept.get('cdn_url', ''),
+                'duplicate_of': keep_path,
+                'upload_date': datetime.now().isoformat(),
+            })
+            total_aliased += 1
+        if not args.dry_run:
+            save_json(progress, progress_path)
+
     # Final mapping save
     if not args.dry_run:
         save_json(progress['patient_mapping'], mapping_path)
         print(f"\nMapping saved: {mapping_path}")
+        # Duplicates still waiting for their kept copy must be offered again
+        if not total_errors and not total_waiting:
+            feed.ack('upload', max(feed_seq, feed.cursor('upload')))
 
     # Summary
     print("=" * 65)
@@ -298,6 +375,9 @@ def main():
     print(f"  Total images:     {total_images}")
     print(f"  Uploaded:         {total_uploaded}")
     print(f"  Skipped:          {total_skipped}")
+    if pending_aliases:
+        print(f"  Duplicates:       {total_aliased} mapped to the kept copy, "
+              f"{total_waiting} waiting for its upload")
     print(f"  Errors:           {total_errors}")
     print("=" * 65)
 
@@ -313,4 +393,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    profile_main(main, 'upload_staging_images')